@@ -0,0 +1,92 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures the per-call cost of phone number normalization.
+
+Compares calling phonenumbers directly (what lowlevel did before it cached
+results) against the cached and fast-path normalization in lowlevel, for both
+repeated numbers (cache hits) and numbers never seen before (cache misses).
+
+Usage: PYTHONPATH=. python benchmarks/normalize_numbers.py
+
+or: nox -s benchmark -- normalize_numbers
+"""
+
+import random
+import timeit
+
+import phonenumbers
+from hotline.telephony import lowlevel
+
+ITERATIONS = 20000
+
+
+def uncached_normalize_e164_number(value: str) -> str:
+    number = phonenumbers.parse("+" + value, "US")
+    return phonenumbers.format_number(number, phonenumbers.PhoneNumberFormat.E164)
+
+
+def uncached_pretty_print_number(number: str) -> str:
+    parsed = phonenumbers.parse(number, "US")
+    return phonenumbers.format_number(
+        parsed, phonenumbers.PhoneNumberFormat.INTERNATIONAL
+    )
+
+
+def per_call(func, values) -> float:
+    values = iter(values)
+    total = timeit.timeit(lambda: func(next(values)), number=ITERATIONS)
+    return total / ITERATIONS * 1000000
+
+
+def main():
+    rng = random.Random(1234)
+    unique = [f"1503{rng.randrange(2000000, 9999999)}" for _ in range(ITERATIONS)]
+    repeated = ["15035551234", "447700900123", "15035550000"] * ITERATIONS
+
+    cases = [
+        (
+            "normalize_e164_number (repeated)",
+            uncached_normalize_e164_number,
+            lowlevel.normalize_e164_number,
+            repeated,
+        ),
+        (
+            "normalize_e164_number (unique)",
+            uncached_normalize_e164_number,
+            lowlevel.normalize_e164_number,
+            unique,
+        ),
+        (
+            "pretty_print_number (repeated)",
+            uncached_pretty_print_number,
+            lowlevel.pretty_print_number,
+            ["+" + value for value in repeated],
+        ),
+    ]
+
+    print(f"{'case':<36}{'before (us)':>14}{'after (us)':>14}{'speedup':>10}")
+
+    for name, before, after, values in cases:
+        after.cache_clear()
+        before_us = per_call(before, values)
+        after_us = per_call(after, values)
+        print(
+            f"{name:<36}{before_us:>14.2f}{after_us:>14.2f}"
+            f"{before_us / after_us:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
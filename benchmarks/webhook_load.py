@@ -0,0 +1,341 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures how many telephony webhooks one app process can handle.
+
+Replays Nexmo-shaped payloads against an app serving the telephony
+blueprint, in-process and from a pool of threads (like a threaded gunicorn
+worker):
+
+1. inbound-call, once per caller, which dials every member of the event.
+2. connect-to-conference, once for each member leg those calls placed.
+3. event, a ringing, answered and completed status for each leg.
+4. inbound-sms, once per caller.
+
+The database is seeded with one event and its members, who take turns
+calling in. Nexmo is replaced by
+a FakeNexmo that can add latency to each API request. Throughput and
+p50/p95/p99 latencies are reported for each endpoint.
+
+The database is dropped and recreated, so only point --database-url at a
+scratch database. Without it, a temporary SQLite database is used.
+
+Usage: PYTHONPATH=. python benchmarks/webhook_load.py [--requests 500]
+    [--concurrency 8] [--members 5] [--nexmo-latency 0.05]
+    [--database-url postgres://...]
+
+or: nox -s benchmark -- webhook_load [--requests 500] ...
+"""
+
+import argparse
+import concurrent.futures
+import datetime
+import os
+import tempfile
+import time
+import urllib.parse
+import uuid
+from typing import List, NamedTuple, Optional, Tuple
+
+import flask
+import httpx
+import nexmo
+from hotline import csrf, injector
+from hotline.database import create_tables
+from hotline.database import highlevel as db
+from hotline.database import models
+from hotline.telephony import callevents, fakenexmo, webhandlers
+
+EVENT_NUMBER = "15035550000"
+BASE_URL = "http://hotline.test"
+
+
+class Request(NamedTuple):
+    path: str
+    payload: dict
+
+
+class Result(NamedTuple):
+    endpoint: str
+    latencies: List[float]
+    errors: int
+    elapsed: float
+
+
+class StubNexmoClient:
+    """Stands in for nexmo.Client, answering from a FakeNexmo after an
+    optional delay that simulates the round trip to Nexmo."""
+
+    def __init__(self, fake: fakenexmo.FakeNexmo, latency: float = 0):
+        self.fake = fake
+        self.latency = latency
+        self.application_id = "load-test"
+
+    def _request(self, method: str, path: str, params: dict) -> Optional[dict]:
+        if self.latency:
+            time.sleep(self.latency)
+
+        status, body = self.fake.handle(method, path, params)
+
+        if status >= 400:
+            raise nexmo.ClientError(f"{status} response from {path}: {body}")
+
+        return body
+
+    def create_call(self, params=None, **kwargs):
+        return self._request("POST", "/v1/calls", params or kwargs)
+
+    def update_call(self, uuid, params=None, **kwargs):
+        return self._request("PUT", f"/v1/calls/{uuid}", params or kwargs)
+
+    def send_speech(self, uuid, params=None, **kwargs):
+        return self._request("PUT", f"/v1/calls/{uuid}/talk", params or kwargs)
+
+    def send_message(self, params):
+        return self._request("POST", "/sms/json", params)
+
+
+def _member_number(n: int) -> str:
+    return f"1503555{n + 1:04d}"
+
+
+def seed_database(database_url: str, members: int) -> None:
+    db.initialize_db(database=database_url)
+    create_tables.create_tables()
+
+    with models.db:
+        number = models.Number.create(number=f"+{EVENT_NUMBER}", features="")
+        event = models.Event.create(
+            name="Load test",
+            slug="load-test",
+            primary_number=number.number,
+            primary_number_id=number,
+        )
+
+        for n in range(members):
+            models.EventMember.create(
+                event=event,
+                name=f"Member {n}",
+                number=f"+{_member_number(n)}",
+                verified=True,
+            )
+
+
+def inbound_call_requests(count: int, members: int) -> List[Request]:
+    """Calls from each member in turn, since only members can call in."""
+    return [
+        Request(
+            "/telephony/inbound-call",
+            {
+                "from": _member_number(n % members),
+                "to": EVENT_NUMBER,
+                "uuid": str(uuid.uuid4()),
+                "conversation_uuid": f"CON-{uuid.uuid4()}",
+            },
+        )
+        for n in range(count)
+    ]
+
+
+def connect_requests(fake: fakenexmo.FakeNexmo) -> List[Request]:
+    """One answer for every member leg that the inbound calls placed."""
+    requests = []
+
+    for call in fake.calls.values():
+        params = call["params"]
+        answer_url = urllib.parse.urlsplit(params["answer_url"][0])
+
+        requests.append(
+            Request(
+                answer_url.path,
+                {
+                    "from": params["from"]["number"].lstrip("+"),
+                    "to": params["to"][0]["number"].lstrip("+"),
+                    "uuid": call["uuid"],
+                    "conversation_uuid": call["conversation_uuid"],
+                },
+            )
+        )
+
+    return requests
+
+
+def event_requests(fake: fakenexmo.FakeNexmo) -> List[Request]:
+    requests = []
+
+    for call in fake.calls.values():
+        for status in ("ringing", "answered", "completed"):
+            requests.append(
+                Request(
+                    "/telephony/event",
+                    {
+                        "from": EVENT_NUMBER,
+                        "to": call["params"]["to"][0]["number"].lstrip("+"),
+                        "uuid": call["uuid"],
+                        "conversation_uuid": call["conversation_uuid"],
+                        "status": status,
+                        "direction": "outbound",
+                        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+                    },
+                )
+            )
+
+    return requests
+
+
+def inbound_sms_requests(count: int) -> List[Request]:
+    return [
+        Request(
+            "/telephony/inbound-sms",
+            {
+                "msisdn": f"1971555{n:04d}",
+                "to": EVENT_NUMBER,
+                "messageId": uuid.uuid4().hex,
+                "text": "Hello?",
+                "type": "text",
+                "message-timestamp": datetime.datetime.utcnow().strftime(
+                    "%Y-%m-%d %H:%M:%S"
+                ),
+            },
+        )
+        for n in range(count)
+    ]
+
+
+def make_app() -> flask.Flask:
+    app = flask.Flask(__name__)
+    app.secret_key = "load-test"
+    csrf.init_app(app)
+    app.register_blueprint(webhandlers.blueprint)
+    return app
+
+
+def replay(
+    client: httpx.Client, endpoint: str, requests: List[Request], concurrency: int
+) -> Result:
+    def send(request: Request) -> Tuple[float, bool]:
+        start = time.perf_counter()
+        response = client.post(request.path, json=request.payload)
+        return time.perf_counter() - start, response.status_code < 400
+
+    start = time.perf_counter()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(send, requests))
+
+    return Result(
+        endpoint=endpoint,
+        latencies=[latency for latency, _ in outcomes],
+        errors=sum(1 for _, ok in outcomes if not ok),
+        elapsed=time.perf_counter() - start,
+    )
+
+
+def _percentile(latencies: List[float], percentile: int) -> float:
+    if not latencies:
+        return 0
+    ordered = sorted(latencies)
+    return ordered[round((len(ordered) - 1) * percentile / 100)]
+
+
+def report(results: List[Result]) -> None:
+    print(
+        f"{'endpoint':<24}{'requests':>10}{'errors':>8}{'req/s':>10}"
+        f"{'p50 (ms)':>11}{'p95 (ms)':>11}{'p99 (ms)':>11}"
+    )
+
+    for result in results:
+        count = len(result.latencies)
+        print(
+            f"{result.endpoint:<24}{count:>10}{result.errors:>8}"
+            f"{count / result.elapsed:>10.1f}"
+            + "".join(
+                f"{_percentile(result.latencies, percentile) * 1000:>11.2f}"
+                for percentile in (50, 95, 99)
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--requests", type=int, default=500, help="Inbound calls and SMS to send."
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="Requests in flight at once."
+    )
+    parser.add_argument(
+        "--members", type=int, default=5, help="Verified members in the event."
+    )
+    parser.add_argument(
+        "--nexmo-latency",
+        type=float,
+        default=0.05,
+        help="Seconds each Nexmo API request takes.",
+    )
+    parser.add_argument(
+        "--database-url",
+        help="A scratch database to use instead of a temporary SQLite one.",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database_url = args.database_url or (
+            f"sqlite:///{os.path.join(tmpdir, 'load-test.sqlite')}"
+        )
+        seed_database(database_url, args.members)
+
+        fake = fakenexmo.FakeNexmo()
+        nexmo_client = StubNexmoClient(fake, latency=args.nexmo_latency)
+        injector.set("nexmo.client", lambda: nexmo_client)
+        injector.set("secrets", {"virtual_number": EVENT_NUMBER})
+
+        with httpx.Client(
+            transport=httpx.WSGITransport(app=make_app()), base_url=BASE_URL
+        ) as client:
+            results = [
+                replay(
+                    client,
+                    "inbound-call",
+                    inbound_call_requests(args.requests, args.members),
+                    args.concurrency,
+                )
+            ]
+            results.append(
+                replay(
+                    client,
+                    "connect-to-conference",
+                    connect_requests(fake),
+                    args.concurrency,
+                )
+            )
+            results.append(
+                replay(client, "event", event_requests(fake), args.concurrency)
+            )
+            results.append(
+                replay(
+                    client,
+                    "inbound-sms",
+                    inbound_sms_requests(args.requests),
+                    args.concurrency,
+                )
+            )
+
+        callevents.flush()
+
+    report(results)
+
+
+if __name__ == "__main__":
+    main()
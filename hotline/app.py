@@ -71,10 +71,7 @@ app.register_blueprint(hotline.numberadmin.webhandlers.blueprint)
 @app.template_filter("phone")
 def phone_format_filter(s):
     try:
-        number = phonenumbers.parse(s, "US")
-        return phonenumbers.format_number(
-            number, phonenumbers.PhoneNumberFormat.INTERNATIONAL
-        )
+        return hotline.telephony.lowlevel.pretty_print_number(s)
     except phonenumbers.NumberParseException:
         return s
 
@@ -159,6 +156,46 @@ def manual_add_number(number, country, features, sms_callback_url):
         number_entry.save()
 
 
+@app.cli.command()
+@click.argument("sms_callback_url")
+@click.option("--country", help="Only replenish this country's pool.")
+def replenish_number_pool(sms_callback_url, country):
+    import hotline.telephony.numberpool
+
+    low_water_marks = hotline.telephony.numberpool.low_water_marks()
+
+    if country:
+        low_water_marks = {country: low_water_marks.get(country, 0)}
+
+    for country, low_water_mark in low_water_marks.items():
+        numbers = hotline.telephony.numberpool.replenish(
+            country, sms_callback_url, low_water_mark=low_water_mark
+        )
+        print(f"Rented {len(numbers)} numbers for {country}.")
+
+
+@app.cli.command()
+@click.option("--once", is_flag=True, help="Exit once the outbox is empty.")
+def drain_outbox(once):
+    import hotline.telephony.outbox
+
+    if once:
+        hotline.telephony.outbox.drain()
+    else:
+        hotline.telephony.outbox.run_worker()
+
+
+@app.cli.command()
+@click.option("--once", is_flag=True, help="Exit once the inbox is empty.")
+def process_inbox(once):
+    import hotline.telephony.inbox
+
+    if once:
+        hotline.telephony.inbox.drain()
+    else:
+        hotline.telephony.inbox.run_worker()
+
+
 @app.cli.command()
 @click.argument("step")
 def apply_migration(step):
@@ -176,13 +213,18 @@ def apply_migration(step):
         migrator = playhouse.migrate.PostgresqlMigrator(models.db)
 
     migrations = migrations_module.migrate(migrator)
+    # Migrations can also introduce entirely new tables.
+    tables = getattr(migrations_module, "tables", [])
 
     print(f"The following migrations are about to be applied to {models.db.obj}:")
+    for table in tables:
+        print(" * ", "create_table", table._meta.table_name)
     for migration in migrations:
         print(" * ", migration.method, migration.args)
 
     input("Press enter to continue.")
 
+    models.db.create_tables(tables, safe=True)
     playhouse.migrate.migrate(*migrations)
 
     print("Done.")
@@ -0,0 +1,93 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs work in the background so that it doesn't hold up a response.
+
+Work submitted here is *not* durable. If the process goes away, pending work
+goes away with it, so only use this for things that are safe to lose.
+"""
+
+import concurrent.futures
+import logging
+import threading
+from typing import Any, Callable, Optional, Set
+
+from google.api_core import retry as retries
+from hotline import injector
+from hotline.database import highlevel as db
+
+DEFAULT_WORKERS = 4
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_lock = threading.Lock()
+_pending: Set[concurrent.futures.Future] = set()
+
+
+def _get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _executor
+
+    with _lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=injector.get("secrets.background.workers", DEFAULT_WORKERS),
+                thread_name_prefix="background",
+            )
+
+    return _executor
+
+
+def _run(func: Callable[[], Any], retry: Optional[retries.Retry]) -> Any:
+    if retry is not None:
+        func = retry(func)
+
+    try:
+        return func()
+    except Exception:
+        logger.exception(f"Background task {func} failed")
+        raise
+    finally:
+        db.close_db_connection()
+
+
+def _forget(future: concurrent.futures.Future) -> None:
+    with _lock:
+        _pending.discard(future)
+
+
+def submit(
+    func: Callable[[], Any], retry: Optional[retries.Retry] = None
+) -> concurrent.futures.Future:
+    """Runs func in a background thread.
+
+    If retry is given, func is retried according to it. Use functools.partial
+    to pass arguments to func.
+    """
+    future = _get_executor().submit(_run, func, retry)
+
+    with _lock:
+        _pending.add(future)
+
+    future.add_done_callback(_forget)
+
+    return future
+
+
+def wait(timeout: float = None) -> None:
+    """Waits for all currently pending background work to finish."""
+    with _lock:
+        pending = list(_pending)
+
+    concurrent.futures.wait(pending, timeout=timeout)
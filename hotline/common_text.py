@@ -17,10 +17,13 @@ voice_no_event = "No event was found for this number. Please reach out to the ev
 voice_blocked = "This number is currently unavailable."
 voice_non_member = "You're not a verified member of this hotline. Please contact the organizer to be added."
 voice_no_members = "Unfortunately, there are no verified members for this event's hotline. Please reach out to the event staff directly for assistance."
+voice_dial_out_failed = "Unfortunately, we weren't able to reach any of the hotline members. Please reach out to the event staff directly for assistance."
+voice_unavailable = "Unfortunately, the hotline can't place calls right now. Please try again in a few minutes, or reach out to the event staff directly for assistance."
 voice_default_greeting = "Thank you for calling the Code of Conduct hotline for {event.name}. This will dial all of the hotline members and put you on hold until one is able to answer."
 voice_answer_error = "Oh no, an error occurred and we couldn't find the event or member entry for this call."
 voice_answer_announce = "{member.name} is joining this call."
 voice_answer_greeting = "Hello {member.name}, connecting you to {event.name}."
+voice_answer_too_late = "Thanks for answering, but another member has already picked up this call. You don't need to do anything."
 
 sms_no_event = "Sorry, there doesn't seem to be an event configured for that number."
 sms_no_members = "Sorry, there aren't any organizers currently available. Please reach out to the event staff in person for assistance."
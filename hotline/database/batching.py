@@ -0,0 +1,114 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Buffers rows in memory and writes them with multi-row inserts.
+
+This keeps high-volume writes (like webhook events) off of the request path
+and turns many small inserts into a few large ones. Buffered rows are *not*
+durable: rows that haven't been flushed are lost if the process dies.
+"""
+
+import atexit
+import logging
+import threading
+from typing import List, Optional, Type
+
+import peewee
+from hotline import metrics
+from hotline.database import highlevel as db
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedWriter:
+    """Writes rows for a model in batches from a background thread.
+
+    Rows are flushed once batch_size rows are waiting, or flush_interval
+    seconds after the last flush, whichever comes first.
+    """
+
+    def __init__(
+        self,
+        model: Type[peewee.Model],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+    ):
+        self.model = model
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._metric = f"{model._meta.table_name}.writer"
+        self._rows: List[dict] = []
+        self._lock = threading.Lock()
+        # Only one flush at a time, so rows are written in the order they
+        # were added.
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, row: dict) -> None:
+        with self._lock:
+            self._rows.append(row)
+            full = len(self._rows) >= self.batch_size
+
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=self._metric, daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.flush)
+
+        if full:
+            self._wake.set()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._rows)
+
+    def flush(self) -> int:
+        """Writes all buffered rows. Returns the number of rows written."""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+
+            if not rows:
+                return 0
+
+            try:
+                with metrics.timer(f"{self._metric}.flush"):
+                    with self.model._meta.database.atomic():
+                        db.insert_many(self.model, rows)
+
+            except Exception:
+                logger.exception(
+                    f"Failed to write {len(rows)} {self.model.__name__} rows"
+                )
+                metrics.increment(f"{self._metric}.dropped", len(rows))
+                return 0
+
+            metrics.increment(f"{self._metric}.written", len(rows))
+
+            return len(rows)
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+
+            try:
+                self.flush()
+            finally:
+                db.close_db_connection()
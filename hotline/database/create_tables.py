@@ -24,6 +24,14 @@ models = [
     db.EventOrganizer,
     db.AuditLog,
     db.BlockList,
+    db.SendRateLimit,
+    db.OutboundMessage,
+    db.NexmoNumber,
+    db.CallEvent,
+    db.CallLeg,
+    db.WebhookReceipt,
+    db.InboundMessage,
+    db.NumberPoolLease,
 ]
 
 
@@ -12,21 +12,24 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""Flask extension for database stuff."""
+"""Flask extension for database stuff.
 
+Connections are taken lazily: peewee connects when a request runs its first
+query, so requests that never touch the database never take a connection.
+"""
 
+from hotline import metrics
 from hotline.database import models
 
 
-def _db_connect():
-    models.db.connect()
-
-
 def _db_close(response):
-    if not models.db.is_closed():
-        models.db.close()
+    if models.db.is_closed():
+        metrics.increment("database.requests.skipped")
+        return
+
+    metrics.increment("database.requests.connected")
+    models.db.close()
 
 
 def init_app(app):
-    app.before_request(_db_connect)
     app.teardown_request(_db_close)
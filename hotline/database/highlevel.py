@@ -14,17 +14,82 @@
 
 """High-level database operations."""
 
-from typing import Iterable, List, Optional
+import datetime
+import urllib.parse
+from typing import Iterable, List, NamedTuple, Optional, Tuple, Type
 
 import peewee
 import playhouse.db_url
+import playhouse.pool
 from hotline import audit_log, injector
-from hotline.database import models
+from hotline.database import models, pending, routing
+
+# Connection pool settings, used when the database URL has a pooled scheme
+# like postgres+pool://. Settings given in the URL's query string win.
+DEFAULT_POOL_MAX_CONNECTIONS = 20
+# Seconds before an idle connection is closed instead of reused.
+DEFAULT_POOL_STALE_TIMEOUT = 300
+# Seconds to wait for a connection when all of them are in use.
+DEFAULT_POOL_TIMEOUT = 10
+
+LOGS_PER_PAGE = 50
+
+# Rows per multi-row insert. This keeps even wide tables well under SQLite's
+# limit on the number of query parameters.
+INSERT_CHUNK_SIZE = 50
 
 
 @injector.needs("secrets.database")
 def initialize_db(database):
-    models.db.initialize(playhouse.db_url.connect(database))
+    params = {}
+    url = urllib.parse.urlsplit(database)
+
+    if url.scheme.endswith("+pool"):
+        given = urllib.parse.parse_qs(url.query)
+        params = {
+            name: injector.get(f"secrets.database_pool.{name}", default)
+            for name, default in (
+                ("max_connections", DEFAULT_POOL_MAX_CONNECTIONS),
+                ("stale_timeout", DEFAULT_POOL_STALE_TIMEOUT),
+                ("timeout", DEFAULT_POOL_TIMEOUT),
+            )
+            if name not in given
+        }
+
+    models.db.initialize(playhouse.db_url.connect(database, **params))
+
+
+def get_db_pool_stats() -> Optional[dict]:
+    """Returns statistics for the connection pool, or None if the database
+    isn't pooled."""
+    database = models.db.obj
+
+    if not isinstance(database, playhouse.pool.PooledDatabase):
+        return None
+
+    return {
+        "max_connections": database._max_connections,
+        "in_use": len(database._in_use),
+        "idle": len(database._connections),
+        "stale_timeout": database._stale_timeout,
+    }
+
+
+def close_db_connection() -> None:
+    """Closes the current thread's database connection, if it has one.
+
+    Threads outside of a request (background work, workers) need to do this
+    themselves.
+    """
+    if models.db.obj is not None and not models.db.is_closed():
+        models.db.close()
+
+
+def insert_many(model: Type[peewee.Model], rows: List[dict]) -> None:
+    """Inserts the rows with as few queries as the database allows. Call this
+    inside of a transaction so that it's all or nothing."""
+    for chunk in peewee.chunked(rows, INSERT_CHUNK_SIZE):
+        model.insert_many(chunk).execute()
 
 
 def list_events_for_user(user_id: str) -> Iterable[models.Event]:
@@ -125,26 +190,11 @@ def get_event_members(event) -> Iterable[models.EventMember]:
     yield from query
 
 
-def get_verified_member_for_event_by_number(event, number: int) -> models.EventMember:
-    return models.EventMember.get_or_none(
-        (models.EventMember.verified == True) & (models.EventMember.number == number)
-    )
-
-
 def get_verified_event_members(event) -> Iterable[models.EventMember]:
     query = event.members.where(models.EventMember.verified == True)  # noqa
     yield from query
 
 
-def get_verified_event_members_except_caller(
-    event, number: int
-) -> Iterable[models.EventMember]:
-    query = event.members.where(
-        (models.EventMember.verified == True) & (models.EventMember.number != number)
-    )
-    yield from query
-
-
 def new_event_member(event: models.Event) -> models.EventMember:
     member = models.EventMember()
     member.event = event
@@ -152,8 +202,59 @@ def new_event_member(event: models.Event) -> models.EventMember:
     return member
 
 
+def add_event_members(
+    event: models.Event, members: Iterable[Tuple[str, str]]
+) -> List[models.EventMember]:
+    """Adds unverified members from (name, number) pairs in bulk.
+
+    Numbers that are already members of the event are skipped. Returns the
+    members that were added.
+    """
+    members = list(members)
+    numbers = [number for _, number in members]
+
+    with models.db.atomic():
+        existing = {
+            number
+            for number, in models.EventMember.select(models.EventMember.number)
+            .where(
+                (models.EventMember.event == event)
+                & (models.EventMember.number.in_(numbers))
+            )
+            .tuples()
+        }
+
+        rows = [
+            {"event": event, "name": name, "number": number, "verified": False}
+            for name, number in members
+            if number not in existing
+        ]
+
+        insert_many(models.EventMember, rows)
+
+        added = list(
+            models.EventMember.select()
+            .where(
+                (models.EventMember.event == event)
+                & (models.EventMember.number.in_([row["number"] for row in rows]))
+            )
+            .order_by(models.EventMember.id)
+        )
+
+    # Saves a query per member when sending verification messages.
+    for member in added:
+        member.event = event
+
+    pending.add(member.number for member in added)
+
+    return added
+
+
 def remove_event_member(member_id: str) -> None:
-    models.EventMember.get(models.EventMember.id == int(member_id)).delete_instance()
+    member = models.EventMember.get(models.EventMember.id == int(member_id))
+    member.delete_instance()
+    routing.invalidate(member.event_id)
+    pending.invalidate()
 
 
 def get_member(member_id: str) -> models.EventMember:
@@ -191,27 +292,168 @@ def find_unused_event_numbers(country: str) -> List[models.Number]:
     )
 
 
+def count_unused_event_numbers(country: str) -> int:
+    return (
+        models.Number.select()
+        .join(
+            models.Event,
+            peewee.JOIN.LEFT_OUTER,
+            on=(models.Event.primary_number_id == models.Number.id),
+        )
+        .where(models.Event.primary_number_id.is_null())
+        .where(models.Number.country == country)
+        .count()
+    )
+
+
+def list_numbers() -> Iterable[models.Number]:
+    """Lists every number along with the event using it, if any, and its
+    details from Nexmo, if they've been fetched."""
+    return (
+        models.Number.select(
+            models.Number.number,
+            models.Number.country,
+            models.Number.features,
+            models.Event.name,
+            models.Event.slug,
+            models.NexmoNumber.voice_callback_type,
+            models.NexmoNumber.voice_callback_value,
+        )
+        .join(
+            models.Event,
+            peewee.JOIN.LEFT_OUTER,
+            on=(models.Event.primary_number_id == models.Number.id),
+        )
+        .join_from(
+            models.Number,
+            models.NexmoNumber,
+            peewee.JOIN.LEFT_OUTER,
+            on=(models.NexmoNumber.msisdn == models.Number.number),
+            attr="nexmo",
+        )
+    )
+
+
+def get_number_and_event(number: str) -> Tuple[models.Number, Optional[models.Event]]:
+    number_entry = models.Number.select().where(models.Number.number == number).get()
+
+    try:
+        event = (
+            models.Event.select()
+            .where(models.Event.primary_number_id == number_entry)
+            .get()
+        )
+    except peewee.DoesNotExist:
+        event = None
+
+    return number_entry, event
+
+
+def add_numbers(numbers: Iterable[dict]) -> None:
+    """Adds numbers rented from Nexmo to the pool of available numbers."""
+    rows = [
+        {
+            "number": number["msisdn"],
+            "country": number["country"],
+            "features": ",".join(number.get("features", [])),
+        }
+        for number in numbers
+    ]
+
+    with models.db.atomic():
+        insert_many(models.Number, rows)
+
+
+class NoNumbersAvailable(Exception):
+    """Raised when there are no unused numbers for an event's country."""
+
+
 def acquire_number(event: models.Event) -> str:
     with models.db.atomic():
         numbers = find_unused_event_numbers(event.country)
 
-        # TODO: Check for no available numbers
+        if not numbers:
+            raise NoNumbersAvailable(event.country)
+
         number = numbers[0]
         event.primary_number = number.number
         event.primary_number_id = number
 
         event.save()
 
-        return event.primary_number
+    routing.invalidate(event.id)
 
+    return event.primary_number
 
-def get_logs_for_event(event: models.Event):
-    return (
-        models.AuditLog.select()
-        .where(models.AuditLog.event == event)
-        .order_by(-models.AuditLog.timestamp)
+
+class LogPage(NamedTuple):
+    logs: List[models.AuditLog]
+    # Pass this as before to get the next (older) page, None if this is the
+    # last page.
+    next_cursor: Optional[str]
+
+
+def encode_log_cursor(log: models.AuditLog) -> str:
+    return f"{log.timestamp:%Y%m%d%H%M%S%f}-{log.id}"
+
+
+def decode_log_cursor(cursor: str) -> Tuple[datetime.datetime, int]:
+    """Raises ValueError if the cursor is malformed."""
+    timestamp, log_id = cursor.split("-")
+    return datetime.datetime.strptime(timestamp, "%Y%m%d%H%M%S%f"), int(log_id)
+
+
+def get_logs_for_event(
+    event: models.Event,
+    # Quoted, since audit_log imports this module.
+    kinds: Iterable["audit_log.Kind"] = (),
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    has_reporter_number: Optional[bool] = None,
+    before: Optional[str] = None,
+    limit: int = LOGS_PER_PAGE,
+) -> LogPage:
+    """Returns a page of an event's logs, newest first.
+
+    Pages are found by (timestamp, id) instead of by offset, so that every
+    page is a bounded range scan of the (event, timestamp) index. start is
+    inclusive and end is exclusive.
+    """
+    query = models.AuditLog.select().where(models.AuditLog.event == event)
+
+    kind_values = [int(kind) for kind in kinds]
+    if kind_values:
+        query = query.where(models.AuditLog.kind.in_(kind_values))
+
+    if start is not None:
+        query = query.where(models.AuditLog.timestamp >= start)
+
+    if end is not None:
+        query = query.where(models.AuditLog.timestamp < end)
+
+    if has_reporter_number is not None:
+        query = query.where(
+            models.AuditLog.reporter_number.is_null(not has_reporter_number)
+        )
+
+    if before is not None:
+        timestamp, log_id = decode_log_cursor(before)
+        query = query.where(
+            peewee.Tuple(models.AuditLog.timestamp, models.AuditLog.id)
+            < peewee.Tuple(timestamp, log_id)
+        )
+
+    # Fetch one extra row to find out if there's another page.
+    logs = list(
+        query.order_by(-models.AuditLog.timestamp, -models.AuditLog.id).limit(limit + 1)
     )
 
+    if len(logs) <= limit:
+        return LogPage(logs=logs, next_cursor=None)
+
+    logs = logs[:limit]
+    return LogPage(logs=logs, next_cursor=encode_log_cursor(logs[-1]))
+
 
 def get_blocklist_for_event(event: models.Event):
     return (
@@ -229,6 +471,7 @@ def create_blocklist_item(event: models.Event, log_id: str, user: dict):
     models.BlockList.create(
         event=event, number=log.reporter_number, blocked_by=user["name"]
     )
+    routing.invalidate(event.id)
 
     audit_log.log(
         kind=audit_log.Kind.NUMBER_BLOCKED,
@@ -244,6 +487,7 @@ def remove_blocklist_item(event: models.Event, blocklist_id: str, user: dict):
     )
 
     item.delete_instance()
+    routing.invalidate(event.id)
 
     audit_log.log(
         kind=audit_log.Kind.NUMBER_UNBLOCKED,
@@ -251,13 +495,3 @@ def remove_blocklist_item(event: models.Event, blocklist_id: str, user: dict):
         event=event,
         user=user["user_id"],
     )
-
-
-def check_if_blocked(event: models.Event, number: str):
-    try:
-        models.BlockList.get(
-            models.BlockList.event == event, models.BlockList.number == number
-        )
-        return True
-    except peewee.DoesNotExist:
-        return False
@@ -0,0 +1,27 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Adds indexes for blocked caller, member, organizer and unused number
+lookups."""
+
+
+def migrate(migrator):
+    return [
+        migrator.add_index("blocklist", ("event_id", "number")),
+        migrator.add_index("eventmember", ("event_id", "verified", "number")),
+        # Replaced by the index above.
+        migrator.drop_index("eventmember", "eventmember_event_id_verified"),
+        migrator.add_index("eventorganizer", ("event_id", "user_id")),
+        migrator.add_index("number", ("country",)),
+    ]
@@ -47,6 +47,8 @@ class Number(BaseModel):
 
 
 Number.add_index(Number.number)
+# For finding unused numbers in a country.
+Number.add_index(Number.country)
 
 
 # TODO NZ: Rename this. Group?
@@ -77,6 +79,10 @@ class Event(BaseModel):
     # hint: "Thank you for calling the Code of Conduct hotline"
     voice_greeting = peewee.TextField(null=True, index=False)
 
+    # Changed whenever anything that affects call routing changes, see
+    # hotline.database.routing.
+    routing_version = peewee.BigIntegerField(default=0)
+
 
 Event.add_index(Event.slug)
 Event.add_index(Event.primary_number)
@@ -93,7 +99,9 @@ class EventMember(BaseModel):
     verified = peewee.BooleanField()
 
 
-EventMember.add_index(EventMember.event, EventMember.verified)
+# Covers the members to call for an event along with whether the caller is
+# one of them.
+EventMember.add_index(EventMember.event, EventMember.verified, EventMember.number)
 EventMember.add_index(EventMember.number, EventMember.verified)
 
 
@@ -109,6 +117,7 @@ class EventOrganizer(BaseModel):
 
 
 EventOrganizer.add_index(EventOrganizer.user_id)
+EventOrganizer.add_index(EventOrganizer.event, EventOrganizer.user_id)
 
 
 # TODO NZ: Keep the audit log, but remove from the view
@@ -130,3 +139,127 @@ class BlockList(BaseModel):
     event = peewee.ForeignKeyField(Event, backref="blocklist")
     number = peewee.TextField()
     blocked_by = peewee.TextField(null=True)
+
+
+BlockList.add_index(BlockList.event, BlockList.number)
+
+
+class OutboundMessage(BaseModel):
+    """An SMS queued to be sent by the outbox worker."""
+
+    created = peewee.DateTimeField(default=datetime.datetime.utcnow)
+    sender = peewee.TextField()
+    to = peewee.TextField()
+    text = peewee.TextField()
+    # See hotline.telephony.outbox.State.
+    state = peewee.IntegerField(default=0)
+    attempts = peewee.IntegerField(default=0)
+    next_attempt = peewee.DateTimeField(default=datetime.datetime.utcnow)
+    sent = peewee.DateTimeField(null=True)
+    error = peewee.TextField(null=True)
+    nexmo_message_id = peewee.TextField(null=True)
+
+
+OutboundMessage.add_index(OutboundMessage.state, OutboundMessage.next_attempt)
+
+
+class SendRateLimit(BaseModel):
+    """Shared rate limiting state for outbound messages, one row per sender.
+
+    tat is the "theoretical arrival time" used by the generic cell rate
+    algorithm, stored as microseconds since the epoch.
+    """
+
+    sender = peewee.TextField(unique=True)
+    tat = peewee.BigIntegerField(default=0)
+
+
+class NumberPoolLease(BaseModel):
+    """Lets only one process at a time rent numbers for a country's pool, one
+    row per country. See hotline.telephony.numberpool."""
+
+    country = peewee.CharField(unique=True)
+    # The lease is held until this time, unless it's released sooner.
+    expires = peewee.DateTimeField(default=datetime.datetime.utcnow)
+
+
+class NexmoNumber(BaseModel):
+    """A local copy of a number in the Nexmo account, so that admin pages don't
+    have to ask Nexmo about every number. See hotline.telephony.inventory."""
+
+    msisdn = peewee.TextField(unique=True)
+    country = peewee.CharField(null=True)
+    type = peewee.TextField(null=True)
+    features = peewee.TextField(null=True)
+    mo_http_url = peewee.TextField(null=True)
+    voice_callback_type = peewee.TextField(null=True)
+    voice_callback_value = peewee.TextField(null=True)
+    fetched = peewee.DateTimeField(default=datetime.datetime.utcnow)
+
+
+class CallEvent(BaseModel):
+    """A call status event posted by Nexmo to /telephony/event, such as
+    ringing, answered or completed, for a single leg of a call."""
+
+    timestamp = peewee.DateTimeField(null=True)
+    received = peewee.DateTimeField(default=datetime.datetime.utcnow)
+    conversation_uuid = peewee.TextField(null=True)
+    call_uuid = peewee.TextField(null=True)
+    status = peewee.TextField(null=True)
+    direction = peewee.TextField(null=True)
+    from_number = peewee.TextField(null=True)
+    to_number = peewee.TextField(null=True)
+    duration = peewee.IntegerField(null=True)
+    # The whole event, as JSON, for fields not broken out above.
+    data = peewee.TextField(null=True, index=False)
+
+
+CallEvent.add_index(CallEvent.conversation_uuid, CallEvent.timestamp)
+CallEvent.add_index(CallEvent.call_uuid, CallEvent.timestamp)
+
+
+class CallLeg(BaseModel):
+    """A call placed to a member for an inbound call, so that the rest can be
+    hung up once enough members have answered."""
+
+    created = peewee.DateTimeField(default=datetime.datetime.utcnow)
+    conversation_uuid = peewee.TextField()
+    call_uuid = peewee.TextField(unique=True)
+    number = peewee.TextField()
+    # See hotline.telephony.voice.LegState.
+    state = peewee.IntegerField(default=0)
+    answered = peewee.DateTimeField(null=True)
+
+
+CallLeg.add_index(CallLeg.conversation_uuid, CallLeg.state)
+
+
+class WebhookReceipt(BaseModel):
+    """Records that a webhook was handled, so that retries of it from Nexmo
+    can be answered without handling it again. See hotline.telephony.dedupe."""
+
+    key = peewee.TextField(unique=True)
+    created = peewee.DateTimeField(default=datetime.datetime.utcnow, index=True)
+    # Null while the first delivery is still being handled.
+    completed = peewee.DateTimeField(null=True)
+    response = peewee.TextField(null=True, index=False)
+
+
+class InboundMessage(BaseModel):
+    """An inbound SMS waiting to be processed by the inbox worker."""
+
+    created = peewee.DateTimeField(default=datetime.datetime.utcnow)
+    # Nexmo's messageId, used to ignore retried deliveries.
+    message_id = peewee.TextField(null=True, unique=True)
+    sender = peewee.TextField()
+    to = peewee.TextField()
+    text = peewee.TextField()
+    # See hotline.telephony.inbox.State.
+    state = peewee.IntegerField(default=0)
+    attempts = peewee.IntegerField(default=0)
+    next_attempt = peewee.DateTimeField(default=datetime.datetime.utcnow)
+    processed = peewee.DateTimeField(null=True)
+    error = peewee.TextField(null=True)
+
+
+InboundMessage.add_index(InboundMessage.state, InboundMessage.sender)
@@ -0,0 +1,96 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An in-process set of the numbers of members who haven't verified yet.
+
+Every inbound SMS might be a verification reply, but hardly any are, so this
+lets most messages skip looking for a pending member. The set is loaded on
+first use and reloaded once it's older than
+``secrets.pending_verifications.ttl`` seconds. This process keeps it up to
+date as members are added, verified and removed, but members added by other
+processes only show up after a reload.
+"""
+
+import threading
+import time
+from typing import FrozenSet, Iterable, Optional
+
+from hotline import injector, metrics
+from hotline.database import models
+
+DEFAULT_TTL = 30.0
+
+_lock = threading.Lock()
+_numbers: Optional[FrozenSet[str]] = None
+_loaded = 0.0
+
+
+def _load() -> FrozenSet[str]:
+    return frozenset(
+        number
+        for number, in models.EventMember.select(models.EventMember.number)
+        .where(models.EventMember.verified == False)  # noqa
+        .distinct()
+        .tuples()
+    )
+
+
+def _rebuild() -> FrozenSet[str]:
+    global _numbers, _loaded
+
+    # The lock is held while loading, so that numbers added in the meantime
+    # aren't lost when the new set replaces the old one.
+    _numbers = _load()
+    _loaded = time.monotonic()
+    metrics.increment("pending_verifications.loads")
+
+    return _numbers
+
+
+def rebuild() -> None:
+    with _lock:
+        _rebuild()
+
+
+def might_be_pending(number: str) -> bool:
+    """Returns False if the number definitely doesn't belong to a member
+    waiting to be verified, as far as this process knows."""
+    ttl = injector.get("secrets.pending_verifications.ttl", DEFAULT_TTL)
+
+    with _lock:
+        numbers = _numbers
+
+        if numbers is None or time.monotonic() - _loaded >= ttl:
+            numbers = _rebuild()
+
+        return number in numbers
+
+
+def add(numbers: Iterable[str]) -> None:
+    """Call this after adding unverified members."""
+    global _numbers
+
+    with _lock:
+        if _numbers is not None:
+            _numbers = _numbers.union(numbers)
+
+
+def invalidate() -> None:
+    """Call this after verifying or removing members. The set is reloaded the
+    next time it's used, since the number might still be pending for another
+    event."""
+    global _numbers
+
+    with _lock:
+        _numbers = None
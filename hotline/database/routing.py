@@ -0,0 +1,202 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An in-process cache of what's needed to route calls to an event.
+
+Entries are keyed by the event's number and hold a snapshot of the event, its
+greeting, its block list and its verified members. Anything that changes
+those calls invalidate(), which drops this process's entry and bumps the
+event's routing_version. Other processes notice the new version the next time
+they recheck their entry, at most ``secrets.routing_cache.ttl`` seconds later.
+"""
+
+import threading
+import time
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+import peewee
+from hotline import common_text, injector, metrics
+from hotline.database import models
+
+DEFAULT_TTL = 5.0
+
+
+class InboundCallRoute(NamedTuple):
+    """Everything needed to route an inbound call to an event's hotline."""
+
+    event: Optional[models.Event]
+    blocked: bool
+    caller_is_member: bool
+    members: List[models.EventMember]
+    greeting_ncco: Optional[dict] = None
+
+
+class _Entry(NamedTuple):
+    event: models.Event
+    version: int
+    greeting_ncco: dict
+    blocked_numbers: FrozenSet[str]
+    members: Tuple[models.EventMember, ...]
+    checked: float
+
+
+_lock = threading.Lock()
+_entries: Dict[str, _Entry] = dict()
+
+
+def greeting_ncco(event: models.Event) -> dict:
+    if event.voice_greeting is not None and event.voice_greeting.strip():
+        greeting = event.voice_greeting
+    else:
+        greeting = common_text.voice_default_greeting.format(event=event)
+
+    return {"action": "talk", "text": greeting}
+
+
+def _blocked_numbers():
+    """The event's block list as a single comma separated column, so that it
+    can be loaded along with the event and its members."""
+    if isinstance(models.db.obj, peewee.PostgresqlDatabase):
+        aggregate = peewee.fn.STRING_AGG(models.BlockList.number, ",")
+    else:
+        aggregate = peewee.fn.GROUP_CONCAT(models.BlockList.number, ",")
+
+    return models.BlockList.select(aggregate).where(
+        models.BlockList.event == models.Event.id
+    )
+
+
+def _load(event_number: str) -> Optional[_Entry]:
+    # One row per verified member, or a single row with no member if there
+    # aren't any, all in one query.
+    rows = list(
+        models.Event.select(
+            models.Event,
+            models.EventMember,
+            _blocked_numbers().alias("blocked_numbers"),
+        )
+        .join(
+            models.EventMember,
+            peewee.JOIN.LEFT_OUTER,
+            on=(
+                (models.EventMember.event == models.Event.id)
+                & (models.EventMember.verified == True)  # noqa
+            ),
+            attr="member",
+        )
+        .where(models.Event.primary_number == event_number)
+        .order_by(models.EventMember.id)
+    )
+
+    if not rows:
+        return None
+
+    event = rows[0]
+    members = []
+
+    for row in rows:
+        member = getattr(row, "member", None)
+        if member is not None:
+            member.event = event
+            members.append(member)
+
+    return _Entry(
+        event=event,
+        version=event.routing_version,
+        greeting_ncco=greeting_ncco(event),
+        blocked_numbers=frozenset((event.blocked_numbers or "").split(",")) - {""},
+        members=tuple(members),
+        checked=time.monotonic(),
+    )
+
+
+def _get_entry(event_number: str) -> Optional[_Entry]:
+    with _lock:
+        entry = _entries.get(event_number)
+
+    ttl = injector.get("secrets.routing_cache.ttl", DEFAULT_TTL)
+
+    if entry is not None and time.monotonic() - entry.checked < ttl:
+        metrics.increment("routing_cache.hits")
+        return entry
+
+    if entry is not None:
+        # Past the TTL, so make sure nobody has changed the event since.
+        version = (
+            models.Event.select(models.Event.routing_version)
+            .where(
+                (models.Event.id == entry.event.id)
+                & (models.Event.primary_number == event_number)
+            )
+            .scalar()
+        )
+
+        if version == entry.version:
+            metrics.increment("routing_cache.rechecks")
+            entry = entry._replace(checked=time.monotonic())
+            with _lock:
+                _entries[event_number] = entry
+            return entry
+
+    metrics.increment("routing_cache.misses")
+    entry = _load(event_number)
+
+    with _lock:
+        if entry is None:
+            _entries.pop(event_number, None)
+        else:
+            _entries[event_number] = entry
+
+    return entry
+
+
+def get_inbound_call_route(event_number: str, caller_number: str) -> InboundCallRoute:
+    """Returns the route for a call from caller_number to event_number, from
+    the cache when possible."""
+    entry = _get_entry(event_number)
+
+    if entry is None:
+        return InboundCallRoute(
+            event=None, blocked=False, caller_is_member=False, members=[]
+        )
+
+    return InboundCallRoute(
+        event=entry.event,
+        blocked=caller_number in entry.blocked_numbers,
+        caller_is_member=any(
+            member.number == caller_number for member in entry.members
+        ),
+        members=[member for member in entry.members if member.number != caller_number],
+        greeting_ncco=entry.greeting_ncco,
+    )
+
+
+def invalidate(event_id: int) -> None:
+    """Call this after changing anything that affects how calls to the event
+    are routed."""
+    with _lock:
+        for number, entry in list(_entries.items()):
+            if entry.event.id == event_id:
+                del _entries[number]
+
+    # The version is a timestamp instead of a counter, so that saving a stale
+    # copy of the event can't bring back a version that's already cached.
+    models.Event.update(routing_version=time.time_ns()).where(
+        models.Event.id == event_id
+    ).execute()
+
+
+def clear() -> None:
+    with _lock:
+        _entries.clear()
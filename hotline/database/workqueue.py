@@ -0,0 +1,159 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Work queues stored in database tables, like the SMS inbox and outbox.
+
+Each row in a queue's table has ``state``, ``attempts``, ``next_attempt`` and
+``error`` columns. Workers claim rows with compare-and-set updates, so any
+number of worker processes can drain the same queue. A claimed row that isn't
+finished within CLAIM_TIMEOUT can be claimed again, so rows don't get stuck if
+a worker dies. Failed attempts are retried with exponential backoff.
+
+Queues name their states to suit what they do, but the values must be these.
+"""
+
+import concurrent.futures
+import datetime
+import logging
+import time
+from typing import Callable, Iterable, List, Optional, TypeVar
+
+import peewee
+from hotline import injector, metrics
+from hotline.database import highlevel as db
+
+PENDING = 0
+CLAIMED = 1
+DONE = 2
+FAILED = 3
+
+DEFAULT_WORKERS = 8
+DEFAULT_MAX_ATTEMPTS = 5
+
+# How long a worker has to finish a row it has claimed before another worker
+# may claim it.
+CLAIM_TIMEOUT = datetime.timedelta(minutes=2)
+
+# Backoff between attempts, doubled for each failed attempt.
+BACKOFF_INITIAL = datetime.timedelta(seconds=5)
+BACKOFF_MAXIMUM = datetime.timedelta(minutes=10)
+
+logger = logging.getLogger(__name__)
+
+Row = TypeVar("Row", bound=peewee.Model)
+
+
+def claim(model, candidates: Iterable[Row]) -> List[Row]:
+    """Claims the candidate rows that no other worker has claimed since they
+    were read. Returns the rows that were claimed."""
+    now = datetime.datetime.utcnow()
+    claimed = []
+
+    for row in candidates:
+        updated = (
+            model.update(
+                state=CLAIMED,
+                attempts=model.attempts + 1,
+                next_attempt=now + CLAIM_TIMEOUT,
+            )
+            .where(
+                (model.id == row.id)
+                & (model.state == row.state)
+                & (model.next_attempt == row.next_attempt)
+            )
+            .execute()
+        )
+
+        if updated:
+            row.attempts += 1
+            claimed.append(row)
+
+    return claimed
+
+
+def backoff(attempts: int) -> datetime.timedelta:
+    return min(BACKOFF_INITIAL * 2 ** (attempts - 1), BACKOFF_MAXIMUM)
+
+
+def fail(name: str, row: peewee.Model, error: Exception) -> None:
+    """Records a failed attempt. The row is retried later, unless it has used
+    up ``secrets.<name>.max_attempts`` attempts."""
+    metrics.increment(f"{name}.failed_attempts")
+
+    max_attempts = injector.get(f"secrets.{name}.max_attempts", DEFAULT_MAX_ATTEMPTS)
+
+    if row.attempts >= max_attempts:
+        row.state = FAILED
+    else:
+        row.state = PENDING
+        row.next_attempt = datetime.datetime.utcnow() + backoff(row.attempts)
+
+    row.error = str(error)
+    row.save()
+
+
+def drain(
+    name: str,
+    claim_batch: Callable[[], List[Row]],
+    handle: Callable[[Row], bool],
+    workers: Optional[int] = None,
+    should_pause: Optional[Callable[[], bool]] = None,
+) -> int:
+    """Handles claimed batches of rows concurrently until there are none left
+    that are due, or until should_pause returns True.
+
+    handle returns whether the row was handled successfully. Returns the
+    number of rows that were attempted.
+    """
+    if workers is None:
+        workers = injector.get(f"secrets.{name}.workers", DEFAULT_WORKERS)
+
+    def handle_and_close(row: Row) -> bool:
+        try:
+            return handle(row)
+        finally:
+            db.close_db_connection()
+
+    attempted = 0
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix=name
+    ) as executor:
+        while True:
+            if should_pause is not None and should_pause():
+                break
+
+            rows = claim_batch()
+
+            if not rows:
+                break
+
+            start = time.monotonic()
+            results = list(executor.map(handle_and_close, rows))
+            metrics.observe(f"{name}.batch", time.monotonic() - start)
+
+            attempted += len(results)
+            logger.info(
+                f"Handled {sum(results)} of {len(results)} {name} messages"
+                f" in {time.monotonic() - start:.3f} seconds."
+            )
+
+    return attempted
+
+
+def run_worker(drain: Callable[[], int], poll_interval: float = 1.0) -> None:
+    """Drains a queue forever."""
+    while True:
+        if not drain():
+            time.sleep(poll_interval)
@@ -12,9 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import csv
+
 import phonenumbers
 import wtforms
-from hotline import common_text
+from hotline import audit_log, common_text
 
 
 class EventEditForm(wtforms.Form):
@@ -50,21 +52,63 @@ class EventEditForm(wtforms.Form):
     )
 
 
-def validate_phone_number(form, field):
+def normalize_phone_number(value: str) -> str:
     try:
-        number = phonenumbers.parse(field.data, "US")
+        number = phonenumbers.parse(value, "US")
 
     except phonenumbers.NumberParseException:
-        raise wtforms.ValidationError(
-            f"{field.data} does not appear to be a valid number."
-        )
+        raise wtforms.ValidationError(f"{value} does not appear to be a valid number.")
 
     if not phonenumbers.is_possible_number(number):
         raise wtforms.ValidationError(
-            f"{field.data} does not appear to be a possible number."
+            f"{value} does not appear to be a possible number."
         )
 
-    field.data = phonenumbers.format_number(number, phonenumbers.PhoneNumberFormat.E164)
+    return phonenumbers.format_number(number, phonenumbers.PhoneNumberFormat.E164)
+
+
+def validate_phone_number(form, field):
+    field.data = normalize_phone_number(field.data)
+
+
+def validate_member_list(form, field):
+    """Parses one "name, number" pair per line, which is also what a two
+    column CSV file looks like. Replaces the field's data with a list of
+    (name, E164 number) tuples."""
+    members = []
+    seen = set()
+
+    for line_number, row in enumerate(csv.reader(field.data.splitlines()), 1):
+        row = [cell.strip() for cell in row]
+
+        if not any(row):
+            continue
+
+        # Allow a header row, as exported by most spreadsheets.
+        if line_number == 1 and [cell.lower() for cell in row] == ["name", "number"]:
+            continue
+
+        if len(row) < 2 or not row[0] or not row[1]:
+            field.errors.append(f"Line {line_number}: expected a name and a number.")
+            continue
+
+        try:
+            number = normalize_phone_number(row[1])
+        except wtforms.ValidationError as error:
+            field.errors.append(f"Line {line_number}: {error}")
+            continue
+
+        if number in seen:
+            field.errors.append(f"Line {line_number}: {row[1]} is listed twice.")
+            continue
+
+        seen.add(number)
+        members.append((row[0], number))
+
+    if not members and not field.errors:
+        raise wtforms.ValidationError("There aren't any members to add.")
+
+    field.data = members
 
 
 class AddMemberForm(wtforms.Form):
@@ -76,7 +120,45 @@ class AddMemberForm(wtforms.Form):
     )
 
 
+class ImportMembersForm(wtforms.Form):
+    members = wtforms.TextAreaField(
+        "Members",
+        validators=[wtforms.validators.InputRequired(), validate_member_list],
+        description=(
+            "One member per line, as their name and number separated by a comma,"
+            " for example <code>Alice, +1 503 555 0100</code>. You can also paste"
+            " in a two-column CSV file."
+        ),
+    )
+
+
 class AddOrganizerForm(wtforms.Form):
     email = wtforms.StringField(
         "Email", validators=[wtforms.validators.InputRequired()]
     )
+
+
+class LogFilterForm(wtforms.Form):
+    kind = wtforms.SelectMultipleField(
+        "Kind",
+        choices=[
+            (kind.value, kind.name.replace("_", " ").title()) for kind in audit_log.Kind
+        ],
+        coerce=int,
+        description="Leave empty to show every kind.",
+    )
+    start = wtforms.DateField(
+        "From",
+        validators=[wtforms.validators.Optional()],
+        description="YYYY-MM-DD, in UTC.",
+    )
+    end = wtforms.DateField(
+        "To",
+        validators=[wtforms.validators.Optional()],
+        description="YYYY-MM-DD, in UTC.",
+    )
+    reporter = wtforms.SelectField(
+        "Reporter number",
+        choices=[("", "Any"), ("yes", "Present"), ("no", "Not present")],
+        default="",
+    )
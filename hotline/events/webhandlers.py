@@ -12,14 +12,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
 import functools
 
 import flask
 import hotline.database.ext
+import hotline.telephony.numberpool
 import hotline.telephony.verification
 from hotline import audit_log
 from hotline.auth import auth_required, super_admin_required
 from hotline.database import highlevel as db
+from hotline.database import pending, routing
 from hotline.events import forms
 
 blueprint = flask.Blueprint("events", __name__, template_folder="templates")
@@ -93,6 +96,8 @@ def details(event, user):
     if flask.request.method == "POST" and form.validate():
         form.populate_obj(event)
         event.save()
+        # The greeting is part of the cached call route.
+        routing.invalidate(event.id)
 
         audit_log.log(
             audit_log.Kind.EVENT_MODIFIED,
@@ -118,6 +123,7 @@ def numbers(event, user):
         member = db.new_event_member(event)
         form.populate_obj(member)
         member.save()
+        pending.add([member.number])
 
         audit_log.log(
             audit_log.Kind.MEMBER_ADDED,
@@ -134,10 +140,45 @@ def numbers(event, user):
         )
 
     return flask.render_template(
-        "events/numbers.html", event=event, members=members, form=form
+        "events/numbers.html",
+        event=event,
+        members=members,
+        form=form,
+        import_form=forms.ImportMembersForm(),
     )
 
 
+@blueprint.route("/manage/events/<event_slug>/members/import", methods=["POST"])
+@event_access_required
+def import_members(event, user):
+    import_form = forms.ImportMembersForm(flask.request.form)
+
+    if not import_form.validate():
+        return flask.render_template(
+            "events/numbers.html",
+            event=event,
+            members=db.get_event_members(event),
+            form=forms.AddMemberForm(),
+            import_form=import_form,
+        )
+
+    members = db.add_event_members(event, import_form.members.data)
+
+    if members:
+        names = ", ".join(member.name for member in members)
+        audit_log.log(
+            audit_log.Kind.MEMBER_ADDED,
+            description=f"{flask.g.user['name']} added {len(members)} members: {names}.",
+            event=event,
+            user=user["user_id"],
+        )
+
+        # Start the verification process for everyone at once.
+        hotline.telephony.verification.start_member_verifications(members)
+
+    return flask.redirect(flask.url_for(".numbers", event_slug=event.slug))
+
+
 @blueprint.route("/manage/events/<event_slug>/members/remove/<member_id>")
 @event_access_required
 def remove_member(member_id, event, user):
@@ -227,6 +268,7 @@ def release(event, user):
     event.primary_number = None
     event.primary_number_id = None
     event.save()
+    routing.invalidate(event.id)
 
     audit_log.log(
         audit_log.Kind.NUMBER_RELEASED,
@@ -241,7 +283,18 @@ def release(event, user):
 @blueprint.route("/manage/events/<event_slug>/acquire")
 @event_access_required
 def acquire(event, user):
-    new_number = db.acquire_number(event)
+    sms_callback_url = flask.url_for("telephony.inbound_sms", _external=True)
+
+    try:
+        new_number = db.acquire_number(event)
+    except db.NoNumbersAvailable:
+        hotline.telephony.numberpool.maybe_replenish(event.country, sms_callback_url)
+        flask.abort(
+            503,
+            "There aren't any numbers available right now. Please try again in a few minutes.",
+        )
+
+    hotline.telephony.numberpool.maybe_replenish(event.country, sms_callback_url)
 
     audit_log.log(
         audit_log.Kind.NUMBER_ACQUIRED,
@@ -256,10 +309,45 @@ def acquire(event, user):
 @blueprint.route("/manage/events/<event_slug>/logs")
 @event_access_required
 def logs(event, user):
-    logs = db.get_logs_for_event(event)
+    form = forms.LogFilterForm(flask.request.args)
+    page = db.LogPage(logs=[], next_cursor=None)
+
+    # Links to other pages keep the filters.
+    filters = flask.request.args.to_dict(flat=False)
+    filters.pop("before", None)
+
+    if form.validate():
+        start = end = None
+
+        if form.start.data:
+            start = datetime.datetime.combine(form.start.data, datetime.time())
+
+        if form.end.data:
+            # The end date is inclusive.
+            end = datetime.datetime.combine(
+                form.end.data + datetime.timedelta(days=1), datetime.time()
+            )
+
+        try:
+            page = db.get_logs_for_event(
+                event,
+                kinds=form.kind.data or (),
+                start=start,
+                end=end,
+                has_reporter_number={"yes": True, "no": False}.get(form.reporter.data),
+                before=flask.request.args.get("before"),
+            )
+        except ValueError:
+            flask.abort(400, "Invalid page.")
 
     return flask.render_template(
-        "events/logs.html", event=event, logs=logs, Kind=audit_log.Kind
+        "events/logs.html",
+        event=event,
+        form=form,
+        logs=page.logs,
+        next_cursor=page.next_cursor,
+        filters=filters,
+        Kind=audit_log.Kind,
     )
 
 
@@ -0,0 +1,65 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A really simple, in-process metrics registry.
+
+Counters and timings are kept per-process. They're meant for logging and for
+the admin views, not as a replacement for a real monitoring system.
+"""
+
+import contextlib
+import threading
+import time
+from typing import Dict
+
+_lock = threading.Lock()
+_counters: Dict[str, int] = dict()
+_timings: Dict[str, Dict[str, float]] = dict()
+
+
+def increment(name: str, value: int = 1) -> None:
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name: str, seconds: float) -> None:
+    """Records a single duration, in seconds, for the given timing."""
+    with _lock:
+        timing = _timings.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+        timing["count"] += 1
+        timing["total"] += seconds
+        timing["max"] = max(timing["max"], seconds)
+
+
+@contextlib.contextmanager
+def timer(name: str):
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(name, time.monotonic() - start)
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "timings": {name: dict(timing) for name, timing in _timings.items()},
+        }
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _timings.clear()
@@ -14,8 +14,9 @@
 
 import flask
 import hotline.database.ext
+import hotline.metrics
+import hotline.telephony.inventory
 import hotline.telephony.lowlevel
-import peewee
 from hotline.auth import super_admin_required
 from hotline.database import highlevel as db
 from hotline.database import models
@@ -27,39 +28,28 @@ hotline.database.ext.init_app(blueprint)
 @blueprint.route("/admin/numbers")
 @super_admin_required
 def list():
-    numbers = models.Number.select(
-        models.Number.number,
-        models.Number.country,
-        models.Number.features,
-        models.Event.name,
-        models.Event.slug,
-    ).join(
-        models.Event,
-        peewee.JOIN.LEFT_OUTER,
-        on=(models.Event.primary_number_id == models.Number.id),
-    )
+    hotline.telephony.inventory.refresh_if_stale()
 
-    return flask.render_template("numberadmin/list.html", numbers=numbers)
+    return flask.render_template(
+        "numberadmin/list.html",
+        numbers=db.list_numbers(),
+        last_refreshed=hotline.telephony.inventory.last_refreshed(),
+    )
 
 
 @blueprint.route("/admin/numbers/<number>/details")
 @super_admin_required
 def details(number):
-    number_entry = models.Number.select().where(models.Number.number == number).get()
-
-    try:
-        event = (
-            models.Event.select()
-            .where(models.Event.primary_number_id == number_entry)
-            .get()
-        )
-    except peewee.DoesNotExist:
-        event = None
+    number_entry, event = db.get_number_and_event(number)
 
-    info = hotline.telephony.lowlevel.get_number_info(number)
+    hotline.telephony.inventory.refresh_if_stale()
+    info = hotline.telephony.inventory.get_number_info(number)
 
     return flask.render_template(
-        "numberadmin/details.html", number=number_entry, event=event, info=info,
+        "numberadmin/details.html",
+        number=number_entry,
+        event=event,
+        info=info,
     )
 
 
@@ -82,3 +72,22 @@ def rent():
     number_record.save()
 
     return flask.redirect(flask.url_for(".list"))
+
+
+@blueprint.route("/admin/numbers/refresh", methods=["POST"])
+@super_admin_required
+def refresh():
+    hotline.telephony.inventory.refresh()
+
+    return flask.redirect(flask.url_for(".list"))
+
+
+@blueprint.route("/admin/stats")
+@super_admin_required
+def stats():
+    return flask.render_template(
+        "numberadmin/stats.html",
+        database_pool=db.get_db_pool_stats(),
+        nexmo_pools=hotline.telephony.lowlevel.get_http_pool_stats(),
+        metrics=hotline.metrics.snapshot(),
+    )
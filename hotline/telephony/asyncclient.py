@@ -0,0 +1,279 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An asyncio client for the parts of the Nexmo API that the hotline uses.
+
+The methods mirror the names, arguments, return values and exceptions of
+nexmo.Client, but they're coroutines, so many requests can be in flight on a
+single thread. Synchronous code can use run() to execute coroutines on a
+long-lived event loop, which keeps connections alive between calls.
+"""
+
+import asyncio
+import concurrent.futures
+import threading
+import time
+import uuid
+from typing import Any, Coroutine, Optional
+
+import httpx
+import jwt
+import nexmo
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from hotline import injector
+from hotline.telephony import circuitbreaker
+
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_TIMEOUT = 10.0
+
+
+class AsyncClient:
+    def __init__(
+        self,
+        key: str,
+        secret: str,
+        application_id: str = None,
+        private_key: str = None,
+        transport: httpx.AsyncBaseTransport = None,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        timeout: float = DEFAULT_TIMEOUT,
+        rest_url: str = "https://rest.nexmo.com",
+        api_url: str = "https://api.nexmo.com",
+        breaker: circuitbreaker.CircuitBreaker = None,
+    ):
+        # The regular client knows how to find credentials and private keys.
+        self._auth = nexmo.Client(
+            key=key,
+            secret=secret,
+            application_id=application_id,
+            private_key=private_key,
+        )
+        self.application_id = application_id
+        self.rest_url = rest_url
+        self.api_url = api_url
+        self._transport = transport
+        self._limits = httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_connections
+        )
+        self._timeout = timeout
+        self._breaker = breaker
+        self._http: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._signing_key: Any = None
+
+    def _get_http(self) -> httpx.AsyncClient:
+        # Connections belong to the event loop they were made on, so a client
+        # used from a new loop needs new connections.
+        loop = asyncio.get_running_loop()
+
+        if self._http is None or self._loop is not loop:
+            self._http = httpx.AsyncClient(
+                transport=self._transport,
+                limits=self._limits,
+                timeout=self._timeout,
+                headers=self._auth.headers,
+            )
+            self._loop = loop
+
+        return self._http
+
+    async def aclose(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def _credentials(self, params: Optional[dict]) -> dict:
+        return dict(
+            params or {}, api_key=self._auth.api_key, api_secret=self._auth.api_secret
+        )
+
+    def _jwt_headers(self) -> dict:
+        # Parsing the private key is far slower than signing with it, so
+        # only do it once instead of for every request like nexmo.Client.
+        if self._signing_key is None:
+            private_key = self._auth.private_key
+            if isinstance(private_key, str):
+                private_key = private_key.encode("utf-8")
+            self._signing_key = serialization.load_pem_private_key(
+                private_key, password=None, backend=default_backend()
+            )
+
+        iat = int(time.time())
+        payload = {
+            "application_id": self.application_id,
+            "iat": iat,
+            "exp": iat + 60,
+            "jti": str(uuid.uuid4()),
+        }
+
+        token = jwt.encode(payload, self._signing_key, algorithm="RS256")
+        if isinstance(token, bytes):
+            token = token.decode("ascii")
+
+        return {"Authorization": f"Bearer {token}"}
+
+    async def _send(self, method: str, base_url: str, path: str, **kwargs) -> Any:
+        response = await self._get_http().request(method, base_url + path, **kwargs)
+        return _parse(base_url, response)
+
+    async def _request(self, method: str, base_url: str, path: str, **kwargs) -> Any:
+        if self._breaker is None:
+            return await self._send(method, base_url, path, **kwargs)
+
+        return await self._breaker.call_async(
+            self._send, method, base_url, path, **kwargs
+        )
+
+    async def send_message(self, params: dict) -> dict:
+        return await self._request(
+            "POST", self.rest_url, "/sms/json", data=self._credentials(params)
+        )
+
+    async def get_account_numbers(self, params: dict = None, **kwargs) -> dict:
+        return await self._request(
+            "GET",
+            self.rest_url,
+            "/account/numbers",
+            params=self._credentials(params or kwargs),
+        )
+
+    async def get_available_numbers(
+        self, country_code: str, params: dict = None, **kwargs
+    ) -> dict:
+        return await self._request(
+            "GET",
+            self.rest_url,
+            "/number/search",
+            params=self._credentials(dict(params or kwargs, country=country_code)),
+        )
+
+    async def buy_number(self, params: dict = None, **kwargs) -> dict:
+        return await self._request(
+            "POST",
+            self.rest_url,
+            "/number/buy",
+            data=self._credentials(params or kwargs),
+        )
+
+    async def update_number(self, params: dict = None, **kwargs) -> dict:
+        return await self._request(
+            "POST",
+            self.rest_url,
+            "/number/update",
+            data=self._credentials(params or kwargs),
+        )
+
+    async def create_call(self, params: dict = None, **kwargs) -> dict:
+        return await self._request(
+            "POST",
+            self.api_url,
+            "/v1/calls",
+            json=params or kwargs,
+            headers=self._jwt_headers(),
+        )
+
+    async def send_speech(self, uuid: str, params: dict = None, **kwargs) -> dict:
+        return await self._request(
+            "PUT",
+            self.api_url,
+            f"/v1/calls/{uuid}/talk",
+            json=params or kwargs,
+            headers=self._jwt_headers(),
+        )
+
+
+def _parse(base_url: str, response: httpx.Response) -> Any:
+    """Interprets a response the same way nexmo.Client does."""
+    if response.status_code == 401:
+        raise nexmo.AuthenticationError
+    elif response.status_code == 204:
+        return None
+    elif 200 <= response.status_code < 300:
+        content_type = response.headers.get("content-type", "").split(";", 1)[0]
+        if content_type == "application/json":
+            return response.json()
+        return response.content
+    elif 400 <= response.status_code < 500:
+        message = f"{response.status_code} response from {base_url}"
+
+        try:
+            error = response.json()
+            if "type" in error and "title" in error and "detail" in error:
+                message = f"{error['title']}: {error['detail']} ({error['type']})"
+        except ValueError:
+            pass
+
+        raise nexmo.ClientError(message)
+    else:
+        raise nexmo.ServerError(f"{response.status_code} response from {base_url}")
+
+
+@injector.provides(
+    "nexmo.async_client",
+    needs=[
+        "secrets.nexmo.api_key",
+        "secrets.nexmo.api_secret",
+        "secrets.nexmo.private_key_location",
+        "secrets.nexmo.application_id",
+    ],
+)
+def _make_async_client(api_key, api_secret, private_key_location, application_id):
+    # Point both APIs at the same place when testing against a fake Nexmo.
+    base_url = injector.get("secrets.nexmo.base_url", None)
+    urls = {"rest_url": base_url, "api_url": base_url} if base_url else {}
+
+    return AsyncClient(
+        key=api_key,
+        secret=api_secret,
+        application_id=application_id,
+        private_key=private_key_location,
+        max_connections=injector.get(
+            "secrets.nexmo.async.max_connections", DEFAULT_MAX_CONNECTIONS
+        ),
+        timeout=injector.get("secrets.nexmo.http.read_timeout", DEFAULT_TIMEOUT),
+        # Share the breaker with nexmo.client, since they talk to the same API.
+        breaker=circuitbreaker.nexmo_breaker(),
+        **urls,
+    )
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(
+                target=_loop.run_forever, name="nexmo-async", daemon=True
+            )
+            thread.start()
+
+    return _loop
+
+
+def run(coroutine: Coroutine[Any, Any, Any], timeout: float = None) -> Any:
+    """Runs a coroutine on this process's shared event loop and waits for it.
+
+    This is safe to call from any thread that isn't already running an event
+    loop, such as request handlers.
+    """
+    future: concurrent.futures.Future = asyncio.run_coroutine_threadsafe(
+        coroutine, _get_loop()
+    )
+    return future.result(timeout=timeout)
@@ -0,0 +1,91 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Records the call status events that Nexmo posts to /telephony/event.
+
+Each leg of each call sends several events (started, ringing, answered,
+completed, and so on), so events are buffered and written in batches rather
+than one insert per webhook.
+"""
+
+import datetime
+import json
+import threading
+from typing import Optional
+
+from hotline import injector
+from hotline.database import batching, models
+
+_writer: Optional[batching.BufferedWriter] = None
+_lock = threading.Lock()
+
+
+def _get_writer() -> batching.BufferedWriter:
+    global _writer
+
+    with _lock:
+        if _writer is None:
+            _writer = batching.BufferedWriter(
+                models.CallEvent,
+                batch_size=injector.get(
+                    "secrets.call_events.batch_size", batching.DEFAULT_BATCH_SIZE
+                ),
+                flush_interval=injector.get(
+                    "secrets.call_events.flush_interval",
+                    batching.DEFAULT_FLUSH_INTERVAL,
+                ),
+            )
+
+    return _writer
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[datetime.datetime]:
+    # Nexmo's timestamps look like 2019-07-28T22:07:31.000Z.
+    if not value:
+        return None
+
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%fZ")
+    except ValueError:
+        return None
+
+
+def _parse_duration(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def record(event: dict) -> None:
+    """Buffers a call status event to be written to the database."""
+    _get_writer().add(
+        {
+            "timestamp": _parse_timestamp(event.get("timestamp")),
+            "received": datetime.datetime.utcnow(),
+            "conversation_uuid": event.get("conversation_uuid"),
+            "call_uuid": event.get("uuid"),
+            "status": event.get("status"),
+            "direction": event.get("direction"),
+            "from_number": event.get("from"),
+            "to_number": event.get("to"),
+            "duration": _parse_duration(event.get("duration")),
+            "data": json.dumps(event),
+        }
+    )
+
+
+def flush() -> int:
+    """Writes any buffered events right away."""
+    return _get_writer().flush()
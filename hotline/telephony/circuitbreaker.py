@@ -0,0 +1,261 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Stops calling Nexmo for a while when it's down or very slow.
+
+Without this, every request that talks to Nexmo during an outage waits for
+timeouts and retries, which can tie up every worker. After
+``failure_threshold`` failed or slow calls in a row the breaker opens, and
+calls fail right away with CircuitOpen. After ``reset_timeout`` seconds it
+lets a single call through as a probe: if that works the breaker closes,
+otherwise it stays open for another ``reset_timeout`` seconds.
+
+Breakers are per-process. They're configured with
+``secrets.nexmo.circuit_breaker``.
+"""
+
+import enum
+import functools
+import logging
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+import httpx
+import nexmo
+import requests
+from hotline import injector, metrics
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0
+# Calls that take longer than this count as failures, even if they work.
+DEFAULT_SLOW_CALL_THRESHOLD = 5.0
+
+# Methods of nexmo.Client that don't talk to Nexmo.
+_LOCAL_METHODS = frozenset(
+    ["auth", "check_signature", "signature", "generate_application_jwt"]
+)
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+@enum.unique
+class State(enum.Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+
+def is_failure(error: Exception) -> bool:
+    """Client errors mean Nexmo is up and didn't like the request, so only
+    server and connection errors count."""
+    return isinstance(
+        error,
+        (
+            nexmo.ServerError,
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+            # What the asyncio client raises for connection errors and timeouts.
+            httpx.TransportError,
+        ),
+    )
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout: float = DEFAULT_RESET_TIMEOUT,
+        slow_call_threshold: float = DEFAULT_SLOW_CALL_THRESHOLD,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slow_call_threshold = slow_call_threshold
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = State.CLOSED
+        self._failures = 0
+        self._opened = 0.0
+        self._probe_started: Optional[float] = None
+
+    @property
+    def state(self) -> State:
+        with self._lock:
+            return self._state
+
+    def _can_probe(self) -> bool:
+        now = self._clock()
+
+        if self._state == State.OPEN:
+            return now - self._opened >= self.reset_timeout
+
+        # Half open. If the probe never finished, allow another one.
+        return (
+            self._probe_started is None
+            or now - self._probe_started >= self.reset_timeout
+        )
+
+    def is_open(self) -> bool:
+        """Returns True if calls would be rejected right now."""
+        with self._lock:
+            return self._state != State.CLOSED and not self._can_probe()
+
+    def _before_call(self) -> None:
+        with self._lock:
+            if self._state == State.CLOSED:
+                return
+
+            if not self._can_probe():
+                metrics.increment(f"{self.name}.circuit_breaker.rejected")
+                raise CircuitOpen(f"The circuit breaker for {self.name} is open.")
+
+            logger.info(f"Probing {self.name} after opening its circuit breaker.")
+            self._state = State.HALF_OPEN
+            self._probe_started = self._clock()
+
+    def _on_success(self) -> None:
+        with self._lock:
+            if self._state != State.CLOSED:
+                logger.info(f"Closing the circuit breaker for {self.name}.")
+                metrics.increment(f"{self.name}.circuit_breaker.closed")
+
+            self._state = State.CLOSED
+            self._failures = 0
+            self._probe_started = None
+
+    def _on_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+
+            if self._state == State.CLOSED and (
+                self._failures < self.failure_threshold
+            ):
+                return
+
+            if self._state == State.CLOSED:
+                logger.warning(
+                    f"Opening the circuit breaker for {self.name} after"
+                    f" {self._failures} failures in a row."
+                )
+                metrics.increment(f"{self.name}.circuit_breaker.opened")
+
+            self._state = State.OPEN
+            self._opened = self._clock()
+            self._probe_started = None
+
+    def _on_result(self, start: float, error: Exception = None) -> None:
+        if error is not None:
+            failed = is_failure(error)
+        else:
+            failed = self._clock() - start > self.slow_call_threshold
+
+        if failed:
+            self._on_failure()
+        else:
+            self._on_success()
+
+    def call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        self._before_call()
+
+        start = self._clock()
+
+        try:
+            result = func(*args, **kwargs)
+
+        except Exception as error:
+            self._on_result(start, error)
+            raise
+
+        self._on_result(start)
+
+        return result
+
+    async def call_async(
+        self, func: Callable[..., Awaitable[Any]], *args, **kwargs
+    ) -> Any:
+        """Like call(), but for coroutine functions."""
+        self._before_call()
+
+        start = self._clock()
+
+        try:
+            result = await func(*args, **kwargs)
+
+        except Exception as error:
+            self._on_result(start, error)
+            raise
+
+        self._on_result(start)
+
+        return result
+
+
+class BreakerClient:
+    """Wraps a nexmo.Client so that every call to Nexmo goes through a
+    circuit breaker. Everything else is passed through to the client."""
+
+    def __init__(self, client: nexmo.Client, breaker: CircuitBreaker):
+        self._client = client
+        self._breaker = breaker
+
+    def __getattr__(self, name: str) -> Any:
+        value = getattr(self._client, name)
+
+        if name.startswith("_") or name in _LOCAL_METHODS or not callable(value):
+            return value
+
+        return functools.partial(self._breaker.call, value)
+
+
+_nexmo_breaker: Optional[CircuitBreaker] = None
+_nexmo_breaker_lock = threading.Lock()
+
+
+def nexmo_breaker() -> CircuitBreaker:
+    """The breaker shared by everything in this process that calls Nexmo."""
+    global _nexmo_breaker
+
+    with _nexmo_breaker_lock:
+        if _nexmo_breaker is None:
+            _nexmo_breaker = CircuitBreaker(
+                "nexmo",
+                failure_threshold=injector.get(
+                    "secrets.nexmo.circuit_breaker.failure_threshold",
+                    DEFAULT_FAILURE_THRESHOLD,
+                ),
+                reset_timeout=injector.get(
+                    "secrets.nexmo.circuit_breaker.reset_timeout",
+                    DEFAULT_RESET_TIMEOUT,
+                ),
+                slow_call_threshold=injector.get(
+                    "secrets.nexmo.circuit_breaker.slow_call_threshold",
+                    DEFAULT_SLOW_CALL_THRESHOLD,
+                ),
+            )
+
+    return _nexmo_breaker
+
+
+def reset() -> None:
+    global _nexmo_breaker
+
+    with _nexmo_breaker_lock:
+        _nexmo_breaker = None
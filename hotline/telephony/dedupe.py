@@ -0,0 +1,158 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Makes sure each webhook is only handled once.
+
+Nexmo retries webhooks that don't respond quickly enough, which would
+otherwise mean calling every member again or sending replies twice. Receipts
+are kept in the database so that every worker sees them, and are removed once
+they're older than ``secrets.webhook_dedupe.ttl`` seconds.
+"""
+
+import datetime
+import json
+import threading
+import time
+from typing import Any, Callable, Optional
+
+import peewee
+from hotline import injector, metrics
+from hotline.database import models
+
+DEFAULT_TTL = 10 * 60
+
+# If the first delivery hasn't finished after this long, assume whatever was
+# handling it went away and let a retry handle it instead.
+IN_FLIGHT_TIMEOUT = datetime.timedelta(seconds=60)
+
+# How often each process removes expired receipts.
+PURGE_INTERVAL = 60
+
+_purge_lock = threading.Lock()
+_last_purge = 0.0
+
+
+def _ttl() -> datetime.timedelta:
+    return datetime.timedelta(
+        seconds=injector.get("secrets.webhook_dedupe.ttl", DEFAULT_TTL)
+    )
+
+
+def purge_expired() -> int:
+    """Removes expired receipts. Returns how many were removed."""
+    return (
+        models.WebhookReceipt.delete()
+        .where(models.WebhookReceipt.created < datetime.datetime.utcnow() - _ttl())
+        .execute()
+    )
+
+
+def _maybe_purge_expired() -> None:
+    global _last_purge
+
+    with _purge_lock:
+        if time.monotonic() - _last_purge < PURGE_INTERVAL:
+            return
+        _last_purge = time.monotonic()
+
+    purge_expired()
+
+
+def claim(key: str) -> Optional[models.WebhookReceipt]:
+    """Claims the webhook with the given key.
+
+    Returns None if the caller should handle the webhook, otherwise the
+    receipt of the delivery that's handling or has handled it.
+    """
+    _maybe_purge_expired()
+
+    try:
+        with models.db.atomic():
+            models.WebhookReceipt.create(key=key)
+        return None
+    except peewee.IntegrityError:
+        pass
+
+    receipt = models.WebhookReceipt.get_or_none(models.WebhookReceipt.key == key)
+
+    if receipt is None:
+        # It expired in the meantime.
+        return claim(key)
+
+    now = datetime.datetime.utcnow()
+    stale = (
+        receipt.completed is None and now - receipt.created > IN_FLIGHT_TIMEOUT
+    ) or now - receipt.created > _ttl()
+
+    if stale:
+        # Take over the receipt, unless another retry already did.
+        updated = (
+            models.WebhookReceipt.update(created=now, completed=None, response=None)
+            .where(
+                (models.WebhookReceipt.id == receipt.id)
+                & (models.WebhookReceipt.created == receipt.created)
+            )
+            .execute()
+        )
+        if updated:
+            return None
+
+    return receipt
+
+
+def complete(key: str, response: Any) -> None:
+    models.WebhookReceipt.update(
+        completed=datetime.datetime.utcnow(), response=json.dumps(response)
+    ).where(models.WebhookReceipt.key == key).execute()
+
+
+def release(key: str) -> None:
+    """Forgets a claim so that a retry can handle the webhook."""
+    models.WebhookReceipt.delete().where(models.WebhookReceipt.key == key).execute()
+
+
+def handle_once(
+    key: Optional[str],
+    handler: Callable[[], Any],
+    in_flight: Callable[[], Any] = lambda: None,
+) -> Any:
+    """Calls handler unless the webhook with this key was already handled.
+
+    Duplicates get the response that the handler returned the first time, or
+    whatever in_flight returns if the first delivery is still being handled.
+    The handler's response must be JSON serializable. Webhooks without a key
+    are always handled.
+    """
+    if not key:
+        return handler()
+
+    receipt = claim(key)
+
+    if receipt is not None:
+        metrics.increment("webhooks.duplicates")
+
+        if receipt.completed is None:
+            return in_flight()
+
+        return json.loads(receipt.response)
+
+    try:
+        response = handler()
+    except Exception:
+        release(key)
+        raise
+
+    complete(key, response)
+
+    return response
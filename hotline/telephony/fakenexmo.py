@@ -0,0 +1,425 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A local stand-in for the parts of the Nexmo API that the hotline uses.
+
+This is for tests and benchmarks, so that clients can be exercised without
+talking to (or paying) Nexmo. The fake can be used in-process through
+transport(), or served over HTTP:
+
+    python -m hotline.telephony.fakenexmo --port 8099 --latency lognormal:0.05,0.5
+
+and used by the app by setting ``secrets.nexmo.base_url`` to
+``http://localhost:8099``.
+
+To see how clients behave under stress, the fake can add latency to each
+request, and respond to a fraction of requests as if they were sent too
+quickly ("Throughput Rate Exceeded") or, for SMS, as if they failed.
+"""
+
+import argparse
+import http.server
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import httpx
+
+THROTTLED_ERROR_TEXT = "Throughput Rate Exceeded - please wait [ 1000 ] and retry"
+FAILED_ERROR_TEXT = "Partner quota violation"
+
+logger = logging.getLogger(__name__)
+
+# Returns how many seconds a request should take, given the fake's random
+# number generator.
+Latency = Callable[[random.Random], float]
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    params: dict
+    # "ok", "throttled" or "failed".
+    outcome: str = "ok"
+
+
+def constant(seconds: float) -> Latency:
+    return lambda rng: seconds
+
+
+def uniform(low: float, high: float) -> Latency:
+    return lambda rng: rng.uniform(low, high)
+
+
+def lognormal(median: float, sigma: float) -> Latency:
+    """A long-tailed distribution, which is what real API latencies look
+    like."""
+    return lambda rng: rng.lognormvariate(math.log(median), sigma)
+
+
+def parse_latency(spec: str) -> Latency:
+    """Parses a latency like "constant:0.05", "uniform:0.01,0.2" or
+    "lognormal:0.05,0.5"."""
+    distributions: Dict[str, Callable[..., Latency]] = {
+        "constant": constant,
+        "uniform": uniform,
+        "lognormal": lognormal,
+    }
+    name, _, args = spec.partition(":")
+
+    if name not in distributions:
+        raise ValueError(f"Unknown latency distribution {name!r}")
+
+    return distributions[name](*[float(arg) for arg in args.split(",") if arg])
+
+
+class FakeNexmo:
+    """Handles Nexmo API requests and records every request it receives.
+
+    Numbers that have been bought are kept in ``account_numbers`` and calls
+    that have been created in ``calls``.
+
+    Each request takes however long ``latency`` says. A ``throttle_rate``
+    fraction of requests are rejected for exceeding the throughput limit, and
+    a ``failure_rate`` fraction of SMS fail with an error-text, the way Nexmo
+    reports failed messages.
+    """
+
+    def __init__(
+        self,
+        country_numbers: int = 10,
+        latency: Optional[Latency] = None,
+        throttle_rate: float = 0,
+        failure_rate: float = 0,
+        seed: int = None,
+    ):
+        self.requests: List[Request] = []
+        self.account_numbers: List[dict] = []
+        self.calls: dict = {}
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.failure_rate = failure_rate
+        self._country_numbers = country_numbers
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _available_numbers(self, country: str, features: str) -> List[dict]:
+        owned = {number["msisdn"] for number in self.account_numbers}
+        prefix = "1555" if country == "US" else "4470"
+
+        numbers = [
+            {
+                "country": country,
+                "msisdn": f"{prefix}{n:07d}",
+                "type": "mobile-lvn",
+                "features": features.split(","),
+                "cost": "0.90",
+            }
+            for n in range(self._country_numbers)
+        ]
+
+        return [number for number in numbers if number["msisdn"] not in owned]
+
+    def _sms_error(self, params: dict, status: str, error_text: str) -> dict:
+        # Nexmo reports these with a 200 response.
+        return {
+            "message-count": "1",
+            "messages": [
+                {"to": params.get("to"), "status": status, "error-text": error_text}
+            ],
+        }
+
+    def _throttled(self, path: str, params: dict) -> Tuple[int, dict]:
+        if path == "/sms/json":
+            return 200, self._sms_error(params, "1", THROTTLED_ERROR_TEXT)
+
+        return (
+            429,
+            {
+                "title": "Too Many Requests",
+                "detail": THROTTLED_ERROR_TEXT,
+                "type": "throttled",
+            },
+        )
+
+    def _send_message(self, params: dict) -> Tuple[int, dict]:
+        return (
+            200,
+            {
+                "message-count": "1",
+                "messages": [
+                    {
+                        "to": params.get("to"),
+                        "message-id": uuid.uuid4().hex,
+                        "status": "0",
+                        "remaining-balance": "10.00",
+                        "message-price": "0.0075",
+                        "network": "12345",
+                    }
+                ],
+            },
+        )
+
+    def _get_account_numbers(self, params: dict) -> Tuple[int, dict]:
+        numbers = self.account_numbers
+        pattern = params.get("pattern")
+
+        if pattern:
+            numbers = [number for number in numbers if pattern in number["msisdn"]]
+
+        # Nexmo's index is 1-based.
+        index = int(params.get("index", 1))
+        size = int(params.get("size", 10))
+        page = numbers[(index - 1) * size : index * size]
+
+        return 200, {"count": len(numbers), "numbers": page}
+
+    def _search_numbers(self, params: dict) -> Tuple[int, dict]:
+        numbers = self._available_numbers(
+            params.get("country", "US"), params.get("features", "SMS,VOICE")
+        )
+        return 200, {"count": len(numbers), "numbers": numbers}
+
+    def _buy_number(self, params: dict) -> Tuple[int, dict]:
+        self.account_numbers.append(
+            {
+                "country": params["country"],
+                "msisdn": params["msisdn"],
+                "type": "mobile-lvn",
+                "features": ["SMS", "VOICE"],
+            }
+        )
+        return 200, {"error-code": "200", "error-code-label": "success"}
+
+    def _update_number(self, params: dict) -> Tuple[int, dict]:
+        for number in self.account_numbers:
+            if number["msisdn"] == params["msisdn"]:
+                number.update(
+                    {
+                        key: value
+                        for key, value in params.items()
+                        if key not in ("api_key", "api_secret", "msisdn")
+                    }
+                )
+                return 200, {"error-code": "200", "error-code-label": "success"}
+
+        return 420, {"error-code": "420", "error-code-label": "Number not found"}
+
+    def _create_call(self, params: dict) -> Tuple[int, dict]:
+        call = {
+            "uuid": str(uuid.uuid4()),
+            "status": "started",
+            "direction": "outbound",
+            "conversation_uuid": f"CON-{uuid.uuid4()}",
+        }
+        self.calls[call["uuid"]] = dict(call, params=params)
+        return 201, call
+
+    def _update_call(self, call_uuid: str, params: dict) -> Tuple[int, Optional[dict]]:
+        call = self.calls.get(call_uuid)
+
+        if call is None:
+            return 404, {"title": "Not found", "detail": call_uuid, "type": "not-found"}
+
+        if params.get("action") == "hangup":
+            call["status"] = "completed"
+
+        return 204, None
+
+    def _send_speech(self, call_uuid: str, params: dict) -> Tuple[int, dict]:
+        return 200, {"message": "Talk started", "uuid": call_uuid}
+
+    def handle(
+        self, method: str, path: str, params: dict
+    ) -> Tuple[int, Optional[dict]]:
+        """Handles a single request and returns the status code and body.
+
+        ``params`` are the query string, form or JSON parameters, whichever
+        the endpoint uses.
+        """
+        with self._lock:
+            delay = self.latency(self._random) if self.latency else 0
+            roll = self._random.random()
+
+        # Sleep outside of the lock, so that concurrent requests overlap like
+        # they would against Nexmo.
+        if delay > 0:
+            time.sleep(delay)
+
+        with self._lock:
+            if roll < self.throttle_rate:
+                self.requests.append(Request(method, path, params, "throttled"))
+                return self._throttled(path, params)
+
+            if path == "/sms/json" and roll < self.throttle_rate + self.failure_rate:
+                self.requests.append(Request(method, path, params, "failed"))
+                return 200, self._sms_error(params, "9", FAILED_ERROR_TEXT)
+
+            self.requests.append(Request(method, path, params))
+
+            if (method, path) == ("POST", "/sms/json"):
+                return self._send_message(params)
+            if (method, path) == ("GET", "/account/numbers"):
+                return self._get_account_numbers(params)
+            if (method, path) == ("GET", "/number/search"):
+                return self._search_numbers(params)
+            if (method, path) == ("POST", "/number/buy"):
+                return self._buy_number(params)
+            if (method, path) == ("POST", "/number/update"):
+                return self._update_number(params)
+            if (method, path) == ("POST", "/v1/calls"):
+                return self._create_call(params)
+
+            call = re.fullmatch(r"/v1/calls/([^/]+)", path)
+            if method == "PUT" and call:
+                return self._update_call(call.group(1), params)
+
+            talk = re.fullmatch(r"/v1/calls/([^/]+)/talk", path)
+            if method == "PUT" and talk:
+                return self._send_speech(talk.group(1), params)
+
+            return 404, {"title": "Not found", "detail": path, "type": "not-found"}
+
+    def requests_to(self, path: str, outcome: str = None) -> List[Request]:
+        with self._lock:
+            return [
+                request
+                for request in self.requests
+                if request.path == path and outcome in (None, request.outcome)
+            ]
+
+
+def parse_params(query: str, content_type: Optional[str], body: bytes) -> dict:
+    """Combines query string and body parameters the way Nexmo accepts them."""
+    params = dict(urllib.parse.parse_qsl(query))
+
+    if body and content_type and content_type.startswith("application/json"):
+        params.update(json.loads(body))
+    elif body:
+        params.update(urllib.parse.parse_qsl(body.decode("utf-8")))
+
+    return params
+
+
+def transport(fake: FakeNexmo) -> httpx.MockTransport:
+    """Returns an httpx transport that sends every request to the fake."""
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        params = parse_params(
+            request.url.query.decode("ascii"),
+            request.headers.get("content-type"),
+            request.read(),
+        )
+        status, body = fake.handle(request.method, request.url.path, params)
+        if body is None:
+            return httpx.Response(status)
+        return httpx.Response(status, json=body)
+
+    return httpx.MockTransport(handler)
+
+
+class _RequestHandler(http.server.BaseHTTPRequestHandler):
+    fake: FakeNexmo
+
+    def _handle(self) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        length = int(self.headers.get("content-length") or 0)
+        params = parse_params(
+            url.query, self.headers.get("content-type"), self.rfile.read(length)
+        )
+
+        status, body = self.fake.handle(self.command, url.path, params)
+
+        self.send_response(status)
+
+        if body is None:
+            self.send_header("content-length", "0")
+            self.end_headers()
+            return
+
+        content = json.dumps(body).encode("utf-8")
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def make_server(
+    fake: FakeNexmo, host: str = "127.0.0.1", port: int = 0
+) -> http.server.ThreadingHTTPServer:
+    """Returns an HTTP server for the fake. Port 0 picks a free port, see
+    ``server.server_address``."""
+    handler = type("RequestHandler", (_RequestHandler,), {"fake": fake})
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves a fake Nexmo API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument(
+        "--latency",
+        type=parse_latency,
+        help='How long requests take, like "lognormal:0.05,0.5".',
+    )
+    parser.add_argument(
+        "--throttle-rate",
+        type=float,
+        default=0,
+        help="The fraction of requests rejected with Throughput Rate Exceeded.",
+    )
+    parser.add_argument(
+        "--failure-rate",
+        type=float,
+        default=0,
+        help="The fraction of SMS that fail with an error-text.",
+    )
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    fake = FakeNexmo(
+        latency=args.latency,
+        throttle_rate=args.throttle_rate,
+        failure_rate=args.failure_rate,
+        seed=args.seed,
+    )
+    server = make_server(fake, args.host, args.port)
+    logger.info(f"Serving a fake Nexmo API on http://{args.host}:{args.port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
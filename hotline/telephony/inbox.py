@@ -0,0 +1,124 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A persistent inbox for inbound SMS.
+
+When the inbox is enabled, the inbound SMS webhook only stores the message
+and the ``process-inbox`` worker command handles it. Messages from the same
+sender are handled one at a time, in the order they arrived, while messages
+from different senders are handled concurrently.
+"""
+
+import datetime
+import enum
+import logging
+from typing import Dict, List
+
+from hotline import injector, metrics
+from hotline.database import models, workqueue
+from hotline.telephony import verification
+
+# How many unfinished messages to look through for each sender's oldest one.
+DEFAULT_BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+
+@enum.unique
+class State(enum.IntEnum):
+    PENDING = workqueue.PENDING
+    PROCESSING = workqueue.CLAIMED
+    PROCESSED = workqueue.DONE
+    FAILED = workqueue.FAILED
+
+
+def is_enabled() -> bool:
+    return injector.get("secrets.inbox.enabled", False)
+
+
+def enqueue(message_id: str, sender: str, to: str, text: str) -> None:
+    """Stores an inbound message. Messages that were already stored, such as
+    retried deliveries, are ignored."""
+    models.InboundMessage.insert(
+        message_id=message_id, sender=sender, to=to, text=text
+    ).on_conflict_ignore().execute()
+
+
+def _claim_messages(batch_size: int) -> List[models.InboundMessage]:
+    """Claims the oldest unfinished message from each sender, if it's due and
+    nobody else is handling it."""
+    now = datetime.datetime.utcnow()
+
+    unfinished = (
+        models.InboundMessage.select()
+        .where(models.InboundMessage.state.in_([State.PENDING, State.PROCESSING]))
+        .order_by(models.InboundMessage.id)
+        .limit(batch_size)
+    )
+
+    heads: Dict[str, models.InboundMessage] = {}
+
+    for message in unfinished:
+        heads.setdefault(message.sender, message)
+
+    # Either not due to be retried yet, or still being handled.
+    due = [message for message in heads.values() if message.next_attempt <= now]
+
+    return workqueue.claim(models.InboundMessage, due)
+
+
+def _process(message: models.InboundMessage) -> bool:
+    try:
+        verification.maybe_handle_verification(message.sender, message.text)
+
+    except Exception as error:
+        logger.exception(f"Failed to process inbound message {message.id}")
+        # Once it's given up on, the sender's later messages aren't stuck
+        # behind this one.
+        workqueue.fail("inbox", message, error)
+
+        return False
+
+    message.state = State.PROCESSED
+    message.processed = datetime.datetime.utcnow()
+    message.error = None
+    message.save()
+
+    metrics.increment("inbox.processed")
+    metrics.observe(
+        "inbox.latency", (message.processed - message.created).total_seconds()
+    )
+
+    return True
+
+
+def drain(workers: int = None, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """Processes messages until there are none left that are due.
+
+    Each sender has at most one message in a batch, so processing them
+    concurrently doesn't reorder anybody's messages.
+
+    Returns the number of messages that were attempted.
+    """
+    return workqueue.drain(
+        "inbox",
+        claim_batch=lambda: _claim_messages(batch_size),
+        handle=_process,
+        workers=workers,
+    )
+
+
+def run_worker(poll_interval: float = 1.0) -> None:
+    """Processes the inbox forever."""
+    workqueue.run_worker(drain, poll_interval)
@@ -0,0 +1,129 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A local mirror of the numbers in the Nexmo account.
+
+The whole inventory is fetched from Nexmo in bulk and stored in the
+NexmoNumber table, so admin pages can show Nexmo's view of hundreds of numbers
+without asking Nexmo about each one. The mirror is refreshed in the background
+once it's older than ``secrets.nexmo.inventory_ttl`` seconds, and can be
+refreshed by hand.
+"""
+
+import datetime
+import logging
+import threading
+from typing import Optional
+
+from hotline import background, injector, metrics
+from hotline.database import highlevel as db
+from hotline.database import models
+from hotline.telephony import lowlevel
+
+DEFAULT_TTL = 15 * 60
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_refreshing = False
+
+
+def refresh() -> int:
+    """Replaces the mirror with the current contents of the Nexmo account.
+
+    Returns the number of numbers in the account.
+    """
+    with metrics.timer("nexmo.inventory.refresh"):
+        numbers = lowlevel.get_all_account_numbers()
+
+    now = datetime.datetime.utcnow()
+    rows = [
+        {
+            "msisdn": number["msisdn"],
+            "country": number.get("country"),
+            "type": number.get("type"),
+            "features": ",".join(number.get("features", [])),
+            "mo_http_url": number.get("moHttpUrl"),
+            "voice_callback_type": number.get("voiceCallbackType"),
+            "voice_callback_value": number.get("voiceCallbackValue"),
+            "fetched": now,
+        }
+        for number in numbers
+    ]
+
+    with models.db.atomic():
+        models.NexmoNumber.delete().execute()
+
+        db.insert_many(models.NexmoNumber, rows)
+
+    logger.info(f"Refreshed {len(rows)} numbers from the Nexmo account.")
+
+    return len(rows)
+
+
+def last_refreshed() -> Optional[datetime.datetime]:
+    oldest = (
+        models.NexmoNumber.select(models.NexmoNumber.fetched)
+        .order_by(models.NexmoNumber.fetched)
+        .first()
+    )
+    return oldest.fetched if oldest is not None else None
+
+
+def is_stale() -> bool:
+    refreshed = last_refreshed()
+
+    if refreshed is None:
+        return True
+
+    ttl = datetime.timedelta(
+        seconds=injector.get("secrets.nexmo.inventory_ttl", DEFAULT_TTL)
+    )
+
+    return datetime.datetime.utcnow() - refreshed > ttl
+
+
+def _refresh_in_background() -> None:
+    global _refreshing
+
+    try:
+        refresh()
+    finally:
+        with _lock:
+            _refreshing = False
+
+
+def refresh_if_stale() -> bool:
+    """Refreshes the mirror in the background if it's past its TTL.
+
+    Returns True if a refresh was started. Only one refresh runs at a time in
+    this process.
+    """
+    global _refreshing
+
+    if not is_stale():
+        return False
+
+    with _lock:
+        if _refreshing:
+            return False
+        _refreshing = True
+
+    background.submit(_refresh_in_background)
+
+    return True
+
+
+def get_number_info(number: str) -> Optional[models.NexmoNumber]:
+    return models.NexmoNumber.get_or_none(models.NexmoNumber.msisdn == number)
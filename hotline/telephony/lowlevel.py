@@ -15,29 +15,127 @@
 """Handles low-level telephony-related actions, such as renting numbers and
 sending messages."""
 
+import concurrent.futures
+import functools
 import logging
-import time
+import re
+from typing import FrozenSet, List, Optional, Pattern, Tuple
 
 import nexmo
 import phonenumbers
+import requests
+import requests.adapters
+import urllib3.util.retry
 from google.api_core import retry
 from hotline import injector
+from hotline.telephony import circuitbreaker, ratelimit
+
+# HTTP settings for talking to Nexmo. The pool size should be at least the
+# number of threads that might talk to Nexmo at once (for example,
+# secrets.voice.fan_out_workers), otherwise connections get thrown away
+# instead of reused.
+DEFAULT_HTTP_POOL_SIZE = 20
+DEFAULT_HTTP_CONNECT_TIMEOUT = 3.05
+DEFAULT_HTTP_READ_TIMEOUT = 10.0
+DEFAULT_HTTP_RETRIES = 2
+
+# How many numbers to buy from Nexmo at once when renting in bulk.
+DEFAULT_RENT_WORKERS = 4
+
+# Nexmo returns at most 100 account numbers per page.
+ACCOUNT_NUMBERS_PAGE_SIZE = 100
+DEFAULT_ACCOUNT_NUMBERS_WORKERS = 4
 
 logger = logging.getLogger(__name__)
 
 
+# How many distinct numbers to remember the normalized forms of. Webhooks see
+# the same handful of event and member numbers over and over.
+NUMBER_CACHE_SIZE = 4096
+
+_E164_DIGITS = re.compile(r"[1-9][0-9]{6,14}")
+
+
+@functools.lru_cache(maxsize=None)
+def _country_metadata(
+    country_code: int,
+) -> Optional[Tuple[Optional[Pattern], FrozenSet[int]]]:
+    regions = phonenumbers.COUNTRY_CODE_TO_REGION_CODE.get(country_code)
+
+    if not regions:
+        return None
+
+    metadata = phonenumbers.PhoneMetadata.metadata_for_region_or_calling_code(
+        country_code, regions[0]
+    )
+
+    if metadata is None or metadata.general_desc is None:
+        return None
+
+    national_prefix = metadata.national_prefix_for_parsing or metadata.national_prefix
+
+    return (
+        re.compile(national_prefix) if national_prefix else None,
+        frozenset(metadata.general_desc.possible_length or ()),
+    )
+
+
+def _canonical_e164(digits: str) -> Optional[str]:
+    """Returns +digits if digits are already a canonical E.164 number.
+
+    This avoids the (comparatively slow) parser for numbers that it would
+    return unchanged: a known country calling code followed by a national
+    number of a possible length that has no national or trunk prefix that the
+    parser would strip. Returns None for anything else, which should then go
+    through the parser.
+    """
+    if not _E164_DIGITS.fullmatch(digits):
+        return None
+
+    for length in (1, 2, 3):
+        metadata = _country_metadata(int(digits[:length]))
+        if metadata is not None:
+            break
+    else:
+        return None
+
+    national_prefix, possible_lengths = metadata
+    national_number = digits[length:]
+
+    if national_number.startswith("0"):
+        return None
+    if national_prefix is not None and national_prefix.match(national_number):
+        return None
+    if len(national_number) not in possible_lengths:
+        return None
+
+    return "+" + digits
+
+
+@functools.lru_cache(maxsize=NUMBER_CACHE_SIZE)
 def normalize_number(value: str, country: str = "US") -> str:
+    if value.startswith("+"):
+        canonical = _canonical_e164(value[1:])
+        if canonical is not None:
+            return canonical
+
     number = phonenumbers.parse(value, country)
     return phonenumbers.format_number(number, phonenumbers.PhoneNumberFormat.E164)
 
 
+@functools.lru_cache(maxsize=NUMBER_CACHE_SIZE)
 def normalize_e164_number(value: str) -> str:
+    canonical = _canonical_e164(value)
+    if canonical is not None:
+        return canonical
+
     # Nexmo sends numbers back in e164 format but without the leading +, so adding
     # that should make the parser work regardless of the default country code.
     number = phonenumbers.parse("+" + value, "US")
     return phonenumbers.format_number(number, phonenumbers.PhoneNumberFormat.E164)
 
 
+@functools.lru_cache(maxsize=NUMBER_CACHE_SIZE)
 def pretty_print_number(number: str, country: str = "US") -> str:
     parsed = phonenumbers.parse(number, "US")
     return phonenumbers.format_number(
@@ -45,6 +143,62 @@ def pretty_print_number(number: str, country: str = "US") -> str:
     )
 
 
+# The Nexmo client always talks to these.
+NEXMO_BASE_URLS = ("https://rest.nexmo.com", "https://api.nexmo.com")
+
+
+class _HTTPSession(requests.Session):
+    """A requests session that applies a default timeout to every request.
+
+    If base_url is given, requests to Nexmo go there instead, for example to
+    a fake Nexmo server (see hotline.telephony.fakenexmo).
+    """
+
+    def __init__(self, timeout: Tuple[float, float], base_url: str = None):
+        super().__init__()
+        self.timeout = timeout
+        self.base_url = base_url.rstrip("/") if base_url else None
+
+    def request(self, method, url, *args, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+
+        if self.base_url:
+            for nexmo_url in NEXMO_BASE_URLS:
+                if url.startswith(nexmo_url):
+                    url = self.base_url + url[len(nexmo_url) :]
+                    break
+
+        return super().request(method, url, *args, **kwargs)
+
+
+def _make_http_session(
+    pool_size: int,
+    connect_timeout: float,
+    read_timeout: float,
+    retries: int,
+    base_url: str = None,
+) -> requests.Session:
+    session = _HTTPSession(timeout=(connect_timeout, read_timeout), base_url=base_url)
+
+    # Only connection errors and idempotent requests are retried here.
+    # Retrying things like sending a message could end up doing it twice.
+    retry_config = urllib3.util.retry.Retry(
+        total=retries,
+        read=0,
+        status_forcelist=(502, 503, 504),
+        backoff_factor=0.1,
+        raise_on_status=False,
+    )
+
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=4, pool_maxsize=pool_size, max_retries=retry_config
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
+
+
 @injector.provides(
     "nexmo.client",
     needs=[
@@ -55,13 +209,63 @@ def pretty_print_number(number: str, country: str = "US") -> str:
     ],
 )
 def _make_client(api_key, api_secret, private_key_location, application_id):
-    return nexmo.Client(
+    client = nexmo.Client(
         key=api_key,
         secret=api_secret,
         application_id=application_id,
         private_key=private_key_location,
     )
 
+    # Keep connections to Nexmo alive and pooled, so that bursts of calls and
+    # messages don't pay for new TCP and TLS connections each time.
+    client.session = _make_http_session(
+        pool_size=injector.get("secrets.nexmo.http.pool_size", DEFAULT_HTTP_POOL_SIZE),
+        connect_timeout=injector.get(
+            "secrets.nexmo.http.connect_timeout", DEFAULT_HTTP_CONNECT_TIMEOUT
+        ),
+        read_timeout=injector.get(
+            "secrets.nexmo.http.read_timeout", DEFAULT_HTTP_READ_TIMEOUT
+        ),
+        retries=injector.get("secrets.nexmo.http.retries", DEFAULT_HTTP_RETRIES),
+        base_url=injector.get("secrets.nexmo.base_url", None),
+    )
+
+    # Fail fast instead of tying up workers while Nexmo is having trouble.
+    return circuitbreaker.BreakerClient(client, circuitbreaker.nexmo_breaker())
+
+
+@injector.needs("nexmo.client")
+def get_http_pool_stats(client: nexmo.Client) -> List[dict]:
+    """Returns statistics for each of the client's HTTP connection pools.
+
+    When connections are being reused, ``requests`` grows much faster than
+    ``connections``.
+    """
+    adapter = client.session.get_adapter("https://")
+    pools = adapter.poolmanager.pools
+    stats = []
+
+    for key in pools.keys():
+        pool = pools[key]
+        idle = 0
+
+        if pool.pool is not None:
+            # The pool's queue is padded with None for connections that
+            # haven't been made yet.
+            idle = sum(1 for conn in list(pool.pool.queue) if conn)
+
+        stats.append(
+            {
+                "host": pool.host,
+                "connections": pool.num_connections,
+                "requests": pool.num_requests,
+                "idle": idle,
+                "size": adapter._pool_maxsize,
+            }
+        )
+
+    return stats
+
 
 # TODO NZ can sms callback URL be empty?
 # or, am I going to need this later for phone number verification?
@@ -127,11 +331,132 @@ def rent_number(
     raise error
 
 
+def _search_numbers(client: nexmo.Client, country_code: str, count: int) -> List[dict]:
+    # Prefer SMS and VOICE numbers, but fall back to VOICE-only numbers if
+    # there aren't enough.
+    numbers = client.get_available_numbers(
+        country_code, {"features": "SMS,VOICE", "type": "mobile-lvn"}
+    ).get("numbers", [])
+
+    if len(numbers) < count:
+        seen = {number["msisdn"] for number in numbers}
+        numbers = numbers + [
+            number
+            for number in client.get_available_numbers(
+                country_code, {"features": "VOICE", "type": "mobile-lvn"}
+            ).get("numbers", [])
+            if number["msisdn"] not in seen
+        ]
+
+    return numbers
+
+
+def _buy_and_setup_number(
+    number: dict, sms_callback_url: str, client: nexmo.Client
+) -> dict:
+    client.buy_number({"country": number["country"], "msisdn": number["msisdn"]})
+
+    setup_number(
+        number=number["msisdn"],
+        country=number["country"],
+        sms_callback_url=sms_callback_url,
+        client=client,
+    )
+
+    return dict(number, msisdn=normalize_e164_number(number["msisdn"]))
+
+
+@injector.needs("nexmo.client")
+def rent_numbers(
+    sms_callback_url: str,
+    count: int,
+    client: nexmo.Client,
+    country_code: str = "US",
+    workers: int = DEFAULT_RENT_WORKERS,
+) -> List[dict]:
+    """Rents up to count numbers for the given country, buying concurrently.
+
+    Returns the numbers that were rented, which may be fewer than count if
+    Nexmo doesn't have enough available or is having trouble. Numbers that
+    were rented are always returned, even if buying others failed, since
+    we're paying for them.
+
+    NOTE: This immediately charges us for the numbers (for at least a month).
+    """
+    candidates = _search_numbers(client, country_code, count)
+    rented: List[dict] = []
+    nexmo_is_failing = False
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(1, min(workers, count)), thread_name_prefix="rent-numbers"
+    ) as executor:
+        # Numbers can get bought out from under us between searching and
+        # buying, so keep going through the candidates until we have enough.
+        while candidates and len(rented) < count and not nexmo_is_failing:
+            batch = candidates[: count - len(rented)]
+            candidates = candidates[len(batch) :]
+
+            futures = [
+                executor.submit(_buy_and_setup_number, number, sms_callback_url, client)
+                for number in batch
+            ]
+
+            for future in futures:
+                try:
+                    rented.append(future.result())
+                except nexmo.Error:
+                    logger.exception("Failed to rent a number")
+                except Exception:
+                    # Connection errors, timeouts or an open circuit breaker.
+                    # Don't try any more candidates, but still collect the
+                    # rest of this batch.
+                    logger.exception("Failed to rent a number")
+                    nexmo_is_failing = True
+
+    return rented
+
+
 @injector.needs("nexmo.client")
 def get_number_info(number: str, client: nexmo.Client) -> dict:
     return client.get_account_numbers(pattern=number)["numbers"][0]
 
 
+@injector.needs("nexmo.client")
+def get_all_account_numbers(
+    client: nexmo.Client,
+    page_size: int = ACCOUNT_NUMBERS_PAGE_SIZE,
+    workers: int = DEFAULT_ACCOUNT_NUMBERS_WORKERS,
+) -> List[dict]:
+    """Returns every number in the Nexmo account.
+
+    The first page tells us how many numbers there are, the rest of the pages
+    are fetched concurrently. msisdn is normalized to have the leading +.
+    """
+
+    def get_page(index: int) -> dict:
+        # Nexmo's page index is 1-based.
+        return client.get_account_numbers(index=index, size=page_size)
+
+    first_page = get_page(1)
+    pages = [first_page]
+    page_count = -(-int(first_page.get("count", 0)) // page_size)
+
+    if page_count > 1:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, min(workers, page_count - 1)),
+            thread_name_prefix="account-numbers",
+        ) as executor:
+            pages.extend(executor.map(get_page, range(2, page_count + 1)))
+
+    numbers = []
+
+    for page in pages:
+        for number in page.get("numbers", []):
+            numbers.append(dict(number, msisdn=normalize_e164_number(number["msisdn"])))
+
+    return numbers
+
+
 def _send_sms_retry_predicate(error):
     logger.exception("Error during SMS send")
     if isinstance(error, nexmo.ClientError) and "Throughput Rate Exceeded" in str(
@@ -141,21 +466,19 @@ def _send_sms_retry_predicate(error):
     return False
 
 
-@retry.Retry(
-    predicate=_send_sms_retry_predicate, initial=1.0, maximum=1.0, deadline=30.0
-)
 @injector.needs("nexmo.client")
-def send_sms(sender: str, to: str, message: str, client: nexmo.Client) -> dict:
-    """Sends an SMS.
+def send_sms_once(sender: str, to: str, message: str, client: nexmo.Client) -> dict:
+    """Sends an SMS without retrying.
 
     ``sender`` and ``to`` must be in proper long form.
     """
-    # This has to be removed at some point. Sleep a little to avoid hitting rate limits.
-    time.sleep(0.3)
-
     # Nexmo is apparently picky about + being in the sender.
     sender = sender.strip("+")
 
+    # Wait for our turn to send from this number, so that we don't hit
+    # Nexmo's throughput limits.
+    ratelimit.acquire(sender)
+
     # TODO NZ: Log caller name instead of {to} number.
     logger.info(f"Sending from {sender} message length {len(message)}")
 
@@ -168,3 +491,15 @@ def send_sms(sender: str, to: str, message: str, client: nexmo.Client) -> dict:
         raise nexmo.ClientError(error_text)
 
     return resp
+
+
+@retry.Retry(
+    predicate=_send_sms_retry_predicate, initial=1.0, maximum=1.0, deadline=30.0
+)
+@injector.needs("nexmo.client")
+def send_sms(sender: str, to: str, message: str, client: nexmo.Client) -> dict:
+    """Sends an SMS, retrying if Nexmo says we're sending too quickly.
+
+    ``sender`` and ``to`` must be in proper long form.
+    """
+    return send_sms_once(sender, to, message, client=client)
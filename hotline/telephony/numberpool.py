@@ -0,0 +1,180 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Keeps a warm pool of rented numbers for each country.
+
+Acquiring a number for an event takes one from the pool in the database, so
+it never has to wait on Nexmo. When a country's pool drops below its low-water
+mark, it's topped back up in the background.
+
+The low-water mark for each country is configured with
+``secrets.number_pool.low_water_marks``, for example ``{"US": 3, "GB": 1}``.
+Countries that aren't listed aren't replenished automatically.
+
+Every number rented costs money, so only one process at a time may replenish
+a country's pool. It holds a lease on the country's row in the database while
+it counts the pool and rents numbers.
+"""
+
+import datetime
+import functools
+import logging
+import threading
+from typing import Dict, List, Optional, Set
+
+from hotline import background, injector, metrics
+from hotline.database import highlevel as db
+from hotline.database import models
+from hotline.telephony import lowlevel
+
+# How many numbers to rent beyond the low-water mark when replenishing, so
+# that the pool isn't replenished after every acquisition.
+DEFAULT_HEADROOM = 2
+
+# How long a process may hold a country's lease. This prevents the pool from
+# never being replenished again if a process dies while renting numbers.
+LEASE_TIMEOUT = datetime.timedelta(minutes=10)
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_replenishing: Set[str] = set()
+
+
+def low_water_marks() -> Dict[str, int]:
+    return injector.get("secrets.number_pool.low_water_marks", {})
+
+
+def _acquire_lease(country: str) -> Optional[datetime.datetime]:
+    """Returns when the lease expires, or None if another process holds it."""
+    models.NumberPoolLease.insert(country=country).on_conflict_ignore().execute()
+
+    now = datetime.datetime.utcnow()
+    expires = now + LEASE_TIMEOUT
+
+    updated = (
+        models.NumberPoolLease.update(expires=expires)
+        .where(
+            (models.NumberPoolLease.country == country)
+            & (models.NumberPoolLease.expires <= now)
+        )
+        .execute()
+    )
+
+    return expires if updated else None
+
+
+def _release_lease(country: str, expires: datetime.datetime) -> None:
+    # Only release the lease if it hasn't expired and been taken by another
+    # process in the meantime.
+    models.NumberPoolLease.update(expires=datetime.datetime.utcnow()).where(
+        (models.NumberPoolLease.country == country)
+        & (models.NumberPoolLease.expires == expires)
+    ).execute()
+
+
+def replenish(
+    country: str, sms_callback_url: str, low_water_mark: Optional[int] = None
+) -> List[dict]:
+    """Rents enough numbers to bring the country's pool back above its low-water
+    mark, plus some headroom.
+
+    Returns the numbers that were rented. Nothing is rented if another process
+    is already replenishing the country's pool.
+    """
+    if low_water_mark is None:
+        low_water_mark = low_water_marks().get(country, 0)
+
+    lease = _acquire_lease(country)
+
+    if lease is None:
+        logger.info(f"The {country} number pool is already being replenished.")
+        return []
+
+    try:
+        return _replenish(country, sms_callback_url, low_water_mark)
+    finally:
+        _release_lease(country, lease)
+
+
+def _replenish(country: str, sms_callback_url: str, low_water_mark: int) -> List[dict]:
+    # Count while holding the lease, since another process might have just
+    # finished replenishing the pool.
+    available = db.count_unused_event_numbers(country)
+
+    if available >= low_water_mark:
+        return []
+
+    needed = (
+        low_water_mark
+        - available
+        + injector.get("secrets.number_pool.headroom", DEFAULT_HEADROOM)
+    )
+
+    logger.info(f"Renting {needed} numbers for the {country} number pool.")
+
+    with metrics.timer("number_pool.replenish"):
+        numbers = lowlevel.rent_numbers(
+            sms_callback_url=sms_callback_url,
+            count=needed,
+            country_code=country,
+            workers=injector.get(
+                "secrets.number_pool.workers", lowlevel.DEFAULT_RENT_WORKERS
+            ),
+        )
+
+    db.add_numbers(numbers)
+    metrics.increment("number_pool.rented", len(numbers))
+
+    if len(numbers) < needed:
+        logger.warning(
+            f"Only rented {len(numbers)} of {needed} numbers for the {country} pool."
+        )
+
+    return numbers
+
+
+def _replenish_and_forget(country: str, sms_callback_url: str) -> List[dict]:
+    try:
+        return replenish(country, sms_callback_url)
+    finally:
+        with _lock:
+            _replenishing.discard(country)
+
+
+def maybe_replenish(country: str, sms_callback_url: str) -> bool:
+    """Replenishes the country's pool in the background if it's running low.
+
+    Returns True if a replenishment was started. Only one replenishment per
+    country is started at a time in this process, and replenish() makes sure
+    that only one runs at a time across processes.
+    """
+    low_water_mark = low_water_marks().get(country)
+
+    if low_water_mark is None:
+        return False
+
+    if db.count_unused_event_numbers(country) >= low_water_mark:
+        return False
+
+    with _lock:
+        if country in _replenishing:
+            return False
+        _replenishing.add(country)
+
+    background.submit(
+        functools.partial(_replenish_and_forget, country, sms_callback_url)
+    )
+
+    return True
@@ -0,0 +1,145 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A persistent outbox for outbound SMS.
+
+When the outbox is enabled, request handlers only queue messages and the
+``drain-outbox`` worker command sends them. The worker sends concurrently,
+respects the per-sender rate limit, and backs off when sends fail.
+"""
+
+import datetime
+import enum
+import logging
+from typing import Iterable, List, Tuple
+
+from hotline import injector, metrics
+from hotline.database import highlevel as db
+from hotline.database import models, workqueue
+from hotline.telephony import circuitbreaker, lowlevel
+
+# How many due messages to claim at a time.
+DEFAULT_BATCH_SIZE = 50
+
+logger = logging.getLogger(__name__)
+
+
+@enum.unique
+class State(enum.IntEnum):
+    PENDING = workqueue.PENDING
+    SENDING = workqueue.CLAIMED
+    SENT = workqueue.DONE
+    FAILED = workqueue.FAILED
+
+
+def is_enabled() -> bool:
+    return injector.get("secrets.outbox.enabled", False)
+
+
+def enqueue_sms(sender: str, to: str, message: str) -> models.OutboundMessage:
+    return models.OutboundMessage.create(sender=sender, to=to, text=message)
+
+
+def enqueue_many(messages: Iterable[Tuple[str, str, str]]) -> int:
+    """Queues (sender, to, message) tuples with multi-row inserts. Returns the
+    number of messages queued."""
+    rows = [
+        {"sender": sender, "to": to, "text": message}
+        for sender, to, message in messages
+    ]
+
+    with models.db.atomic():
+        db.insert_many(models.OutboundMessage, rows)
+
+    return len(rows)
+
+
+def send_sms(sender: str, to: str, message: str) -> None:
+    """Queues the SMS if the outbox is enabled, otherwise sends it right away.
+
+    Without the outbox there's no worker to send queued messages, so this
+    raises CircuitOpen while Nexmo's circuit breaker is open.
+    """
+    if is_enabled():
+        enqueue_sms(sender, to, message)
+        return
+
+    lowlevel.send_sms(sender, to, message)
+
+
+def _claim_messages(limit: int) -> List[models.OutboundMessage]:
+    """Claims due messages so that no other worker sends them."""
+    candidates = (
+        models.OutboundMessage.select()
+        .where(
+            models.OutboundMessage.state.in_([State.PENDING, State.SENDING])
+            & (models.OutboundMessage.next_attempt <= datetime.datetime.utcnow())
+        )
+        .order_by(models.OutboundMessage.id)
+        .limit(limit)
+    )
+
+    return workqueue.claim(models.OutboundMessage, candidates)
+
+
+def _dispatch(message: models.OutboundMessage) -> bool:
+    try:
+        response = lowlevel.send_sms_once(message.sender, message.to, message.text)
+
+    except circuitbreaker.CircuitOpen:
+        # Nexmo is down, which isn't the message's fault, so try again later
+        # without using up an attempt.
+        message.state = State.PENDING
+        message.attempts -= 1
+        message.next_attempt = datetime.datetime.utcnow() + workqueue.BACKOFF_INITIAL
+        message.save()
+
+        return False
+
+    except Exception as error:
+        logger.exception(f"Failed to send outbound message {message.id}")
+        workqueue.fail("outbox", message, error)
+
+        return False
+
+    message.state = State.SENT
+    message.sent = datetime.datetime.utcnow()
+    message.error = None
+    message.nexmo_message_id = response["messages"][0].get("message-id")
+    message.save()
+
+    metrics.increment("outbox.sent")
+
+    return True
+
+
+def drain(workers: int = None, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """Sends messages until there are none left that are due.
+
+    Returns the number of messages that were attempted.
+    """
+    return workqueue.drain(
+        "outbox",
+        claim_batch=lambda: _claim_messages(batch_size),
+        handle=_dispatch,
+        workers=workers,
+        # Leave messages queued until Nexmo's circuit breaker lets a probe
+        # through.
+        should_pause=circuitbreaker.nexmo_breaker().is_open,
+    )
+
+
+def run_worker(poll_interval: float = 1.0) -> None:
+    """Drains the outbox forever."""
+    workqueue.run_worker(drain, poll_interval)
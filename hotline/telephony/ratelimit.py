@@ -0,0 +1,91 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rate limits outbound messages per sender number.
+
+This uses the generic cell rate algorithm (GCRA). Its state lives in the
+database so that every worker process shares the same limits. Updates are
+compare-and-set, so no locks are held while waiting.
+"""
+
+import time
+
+from hotline import injector, metrics
+from hotline.database import models
+
+# Nexmo's throughput limits are per sending number.
+DEFAULT_PER_SECOND = 3.0
+DEFAULT_BURST = 1
+
+
+def _now_us() -> int:
+    return int(time.time() * 1000000)
+
+
+def _get_state(sender: str) -> models.SendRateLimit:
+    state = models.SendRateLimit.get_or_none(models.SendRateLimit.sender == sender)
+
+    if state is None:
+        models.SendRateLimit.insert(sender=sender).on_conflict_ignore().execute()
+        state = models.SendRateLimit.get(models.SendRateLimit.sender == sender)
+
+    return state
+
+
+def reserve(sender: str) -> float:
+    """Reserves the next available send slot for the sender.
+
+    Returns how long, in seconds, the caller must wait before sending.
+    """
+    per_second = injector.get("secrets.sms_rate_limit.per_second", DEFAULT_PER_SECOND)
+    burst = injector.get("secrets.sms_rate_limit.burst", DEFAULT_BURST)
+
+    interval = int(1000000 / per_second)
+    tolerance = interval * (burst - 1)
+
+    while True:
+        state = _get_state(sender)
+        now = _now_us()
+        tat = max(state.tat, now)
+
+        updated = (
+            models.SendRateLimit.update(tat=tat + interval)
+            .where(
+                (models.SendRateLimit.sender == sender)
+                & (models.SendRateLimit.tat == state.tat)
+            )
+            .execute()
+        )
+
+        if updated:
+            return max(0, tat - tolerance - now) / 1000000
+
+        # Another sender got there first, try again with their update.
+        metrics.increment("sms.rate_limit.conflicts")
+
+
+def acquire(sender: str) -> float:
+    """Waits until the sender is allowed to send another message.
+
+    Returns how long, in seconds, was spent waiting.
+    """
+    wait = reserve(sender)
+
+    if wait:
+        metrics.increment("sms.rate_limit.delayed")
+        time.sleep(wait)
+
+    metrics.observe("sms.rate_limit.wait", wait)
+
+    return wait
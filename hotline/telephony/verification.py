@@ -14,9 +14,13 @@
 
 """Methods for verifying numbers."""
 
-from hotline import audit_log, injector
+import functools
+from typing import Iterable
+
+from hotline import audit_log, background, injector
 from hotline.database import highlevel as db
-from hotline.telephony import lowlevel
+from hotline.database import pending, routing
+from hotline.telephony import outbox
 
 
 @injector.needs("secrets.virtual_number")
@@ -29,31 +33,65 @@ def _get_sender_for_member(member, virtual_number: str):
     return virtual_number
 
 
-def start_member_verification(member):
-    sender = _get_sender_for_member(member)
-
-    message = (
+def _verification_message(member) -> str:
+    return (
         f"You've been added as a member of the {member.event.name} event on conducthotline.com."
         " Reply with YES or OK to confirm."
     )
 
-    lowlevel.send_sms(sender, member.number, message)
+
+def start_member_verification(member):
+    sender = _get_sender_for_member(member)
+    outbox.send_sms(sender, member.number, _verification_message(member))
+
+
+def start_member_verifications(members: Iterable) -> None:
+    """Starts verification for many members without waiting for the messages
+    to be sent.
+
+    With the outbox enabled, the messages are queued all at once. Otherwise
+    they're sent concurrently from background threads, which still wait for
+    the sender's rate limit.
+    """
+    if outbox.is_enabled():
+        outbox.enqueue_many(
+            (
+                _get_sender_for_member(member),
+                member.number,
+                _verification_message(member),
+            )
+            for member in members
+        )
+        return
+
+    for member in members:
+        background.submit(functools.partial(start_member_verification, member))
 
 
 def maybe_handle_verification(member_number: str, message: str):
     """Checks if the message is a verification message for the given number."""
+    confirmed = message.strip().lower() in ("ok", "yes", "okay")
+
+    # Most messages aren't from pending members, so don't look for one unless
+    # it might be. Confirmations are always checked, since the member might
+    # have been added by another process since the set was loaded.
+    if not confirmed and not pending.might_be_pending(member_number):
+        return False
+
     pending_member_record = db.find_pending_member_by_number(member_number)
 
     if not pending_member_record:
         return False
 
-    if message.strip().lower() not in ("ok", "yes", "okay"):
+    if not confirmed:
         print(f"Verification message was not okay, was {message}")
         # This was "handled", even though verification wasn't approved.
         return True
 
     pending_member_record.verified = True
     pending_member_record.save()
+    routing.invalidate(pending_member_record.event_id)
+    pending.invalidate()
 
     audit_log.log(
         audit_log.Kind.MEMBER_NUMBER_VERIFIED,
@@ -63,7 +101,7 @@ def maybe_handle_verification(member_number: str, message: str):
 
     sender = _get_sender_for_member(pending_member_record)
     reply = "Thank you, your number is confirmed."
-    lowlevel.send_sms(sender, member_number, reply)
+    outbox.send_sms(sender, member_number, reply)
 
     return True
 
@@ -71,6 +109,8 @@ def maybe_handle_verification(member_number: str, message: str):
 def manually_verify(member):
     member.verified = True
     member.save()
+    routing.invalidate(member.event_id)
+    pending.invalidate()
 
     audit_log.log(
         audit_log.Kind.MEMBER_NUMBER_VERIFIED,
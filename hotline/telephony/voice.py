@@ -18,14 +18,413 @@
 Calling a hotline connects the caller to all of the verified event members.
 """
 
-from typing import List
+import asyncio
+import concurrent.futures
+import datetime
+import enum
+import functools
+import logging
+import threading
+import time
+from typing import Iterable, List, NamedTuple, Optional, Tuple
 
 import nexmo
-from hotline import audit_log, common_text, injector
+import requests
+import urllib3.exceptions
+from google.api_core import retry as retries
+from hotline import audit_log, background, common_text, injector, metrics
 from hotline.database import highlevel as db
+from hotline.database import models, routing
+from hotline.telephony import asyncclient, circuitbreaker
 
 HOLD_MUSIC = "https://assets.ctfassets.net/j7pfe8y48ry3/530pLnJVZmiUu8mkEgIMm2/dd33d28ab6af9a2d32681ae80004886e/oaklawn-dreams.mp3"
 
+# How many member calls can be placed at the same time, across all inbound
+# calls handled by this process. Setting this to 1 places calls one at a time.
+DEFAULT_FAN_OUT_WORKERS = 10
+
+# How many members can join an inbound call. Once this many have answered, the
+# calls to the rest of the members are hung up. 0 means no limit.
+DEFAULT_MAX_SIMULTANEOUS_ANSWERERS = 1
+
+logger = logging.getLogger(__name__)
+
+_dial_out_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_dial_out_executor_lock = threading.Lock()
+
+
+def _is_retryable_error(error: Exception) -> bool:
+    """Only errors where the request never reached Nexmo are retried. Placing
+    a call isn't idempotent, and a server error or read timeout can come back
+    after Nexmo has already placed it, so retrying would ring the member twice.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        # Other connection errors, like the connection being dropped, can
+        # happen after the request was sent.
+        reason = getattr(error.args[0], "reason", None)
+        return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+    return False
+
+
+# Used for Nexmo calls that happen after the response has been sent, where
+# it's okay to take a little longer to get things right.
+_deferred_retry = retries.Retry(
+    predicate=_is_retryable_error, initial=0.5, maximum=2.0, deadline=20.0
+)
+
+
+def _is_deferred() -> bool:
+    """When deferred, member calls and announcements are made after the
+    webhook has responded, so the caller doesn't wait on Nexmo."""
+    return injector.get("secrets.voice.deferred_dial_out", False)
+
+
+@enum.unique
+class LegState(enum.IntEnum):
+    RINGING = 0
+    ANSWERED = 1
+    CANCELLED = 2
+
+
+class DialOutResult(NamedTuple):
+    """The outcome of calling a single member."""
+
+    member: models.EventMember
+    response: Optional[dict]
+    error: Optional[Exception]
+
+
+def _get_dial_out_executor() -> Optional[concurrent.futures.ThreadPoolExecutor]:
+    global _dial_out_executor
+
+    workers = injector.get("secrets.voice.fan_out_workers", DEFAULT_FAN_OUT_WORKERS)
+
+    if workers <= 1:
+        return None
+
+    with _dial_out_executor_lock:
+        if _dial_out_executor is None:
+            _dial_out_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="dial-out"
+            )
+
+    return _dial_out_executor
+
+
+def _call_params(member: models.EventMember, from_number: str, answer_url: str) -> dict:
+    return {
+        "to": [{"type": "phone", "number": member.number}],
+        "from": {"type": "phone", "number": from_number},
+        "answer_url": [answer_url],
+        "answer_method": "POST",
+        "machine_detection": "hangup",
+    }
+
+
+def _call_member(
+    client: nexmo.Client, member: models.EventMember, from_number: str, answer_url: str
+) -> dict:
+    return client.create_call(_call_params(member, from_number, answer_url))
+
+
+def _dial_members_threaded(
+    client: nexmo.Client,
+    members: List[models.EventMember],
+    from_number: str,
+    answer_url: str,
+    retry: Optional[retries.Retry],
+) -> List[Tuple[Optional[dict], Optional[Exception]]]:
+    executor = _get_dial_out_executor()
+    call_member = _call_member if retry is None else retry(_call_member)
+    outcomes: List[Tuple[Optional[dict], Optional[Exception]]] = []
+    pending: List[Tuple[models.EventMember, Optional[concurrent.futures.Future]]]
+
+    if executor is None:
+        pending = [(member, None) for member in members]
+    else:
+        pending = [
+            (
+                member,
+                executor.submit(call_member, client, member, from_number, answer_url),
+            )
+            for member in members
+        ]
+
+    for member, future in pending:
+        try:
+            if future is None:
+                response = call_member(client, member, from_number, answer_url)
+            else:
+                response = future.result()
+            outcomes.append((response, None))
+        except Exception as error:
+            outcomes.append((None, error))
+
+    return outcomes
+
+
+@injector.needs("nexmo.async_client")
+async def _dial_members_async(
+    members: List[models.EventMember],
+    from_number: str,
+    answer_url: str,
+    async_client: asyncclient.AsyncClient,
+) -> List[Tuple[Optional[dict], Optional[Exception]]]:
+    responses = await asyncio.gather(
+        *[
+            async_client.create_call(_call_params(member, from_number, answer_url))
+            for member in members
+        ],
+        return_exceptions=True,
+    )
+
+    outcomes: List[Tuple[Optional[dict], Optional[Exception]]] = []
+
+    for response in responses:
+        if isinstance(response, Exception):
+            outcomes.append((None, response))
+        elif isinstance(response, BaseException):
+            # Cancellation and the like shouldn't be treated as a failed call.
+            raise response
+        else:
+            outcomes.append((response, None))
+
+    return outcomes
+
+
+def dial_members(
+    client: nexmo.Client,
+    members: Iterable[models.EventMember],
+    from_number: str,
+    answer_url: str,
+    retry: Optional[retries.Retry] = None,
+) -> List[DialOutResult]:
+    """Calls all of the given members, in parallel when possible.
+
+    Failing to call one member doesn't stop the others from being called, so
+    every member gets a result with either the Nexmo response or the error.
+    If retry is given, each member's call is retried according to it.
+
+    Calls are placed from a thread pool, or, when secrets.voice.fan_out_mode
+    is "asyncio", all at once from the shared asyncio client. Calls that need
+    retrying always use the thread pool.
+    """
+    start = time.monotonic()
+    members = list(members)
+
+    if retry is None and injector.get("secrets.voice.fan_out_mode", "threads") == (
+        "asyncio"
+    ):
+        outcomes = asyncclient.run(
+            _dial_members_async(members, from_number, answer_url)
+        )
+    else:
+        outcomes = _dial_members_threaded(
+            client, members, from_number, answer_url, retry
+        )
+
+    results = []
+
+    for member, (response, error) in zip(members, outcomes):
+        if error is not None:
+            logger.error(f"Failed to call member {member.id}: {error!r}")
+        results.append(DialOutResult(member, response, error))
+
+    duration = time.monotonic() - start
+    failures = sum(1 for result in results if result.error is not None)
+
+    metrics.observe("voice.fan_out", duration)
+    metrics.increment("voice.fan_out.legs", len(results))
+    metrics.increment("voice.fan_out.failed_legs", failures)
+
+    logger.info(
+        f"Called {len(results)} members ({failures} failed) in {duration:.3f} seconds."
+    )
+
+    return results
+
+
+def conversation_ncco(conversation_uuid: str) -> dict:
+    """Puts the reporter into the conversation (conference call) that
+    members are connected to, on hold until one joins."""
+    return {
+        "action": "conversation",
+        "name": conversation_uuid,
+        "eventMethod": "POST",
+        "musicOnHoldUrl": [HOLD_MUSIC],
+        "endOnExit": False,
+        "startOnEnter": False,
+    }
+
+
+def _record_legs(conversation_uuid: str, results: List[DialOutResult]) -> None:
+    rows = [
+        {
+            "conversation_uuid": conversation_uuid,
+            "call_uuid": result.response["uuid"],
+            "number": result.member.number,
+        }
+        for result in results
+        # Only calls that were placed have a response.
+        if result.response is not None
+    ]
+
+    # Tracking legs is only used to hang up unneeded calls, so failing to
+    # record them shouldn't fail the call.
+    try:
+        if rows:
+            models.CallLeg.insert_many(rows).execute()
+    except Exception:
+        logger.exception(f"Failed to record call legs for {conversation_uuid[-12:]}")
+
+
+def _claim_answer(call_uuid: Optional[str]) -> bool:
+    """Marks a member's leg as answered.
+
+    Returns False if enough members have already answered, or if the leg was
+    already hung up. Legs that aren't tracked can always answer.
+    """
+    if call_uuid is None:
+        return True
+
+    leg = models.CallLeg.get_or_none(models.CallLeg.call_uuid == call_uuid)
+
+    if leg is None:
+        return True
+
+    (
+        models.CallLeg.update(
+            state=LegState.ANSWERED, answered=datetime.datetime.utcnow()
+        )
+        .where(
+            (models.CallLeg.id == leg.id) & (models.CallLeg.state == LegState.RINGING)
+        )
+        .execute()
+    )
+
+    leg = models.CallLeg.get_by_id(leg.id)
+
+    if leg.state != LegState.ANSWERED:
+        return False
+
+    limit = injector.get(
+        "secrets.voice.max_simultaneous_answerers", DEFAULT_MAX_SIMULTANEOUS_ANSWERERS
+    )
+
+    if not limit:
+        return True
+
+    # Members can answer at the same time, so order the answers to decide who
+    # gets in. Ties on the time are broken by the order the legs were placed.
+    position = (
+        models.CallLeg.select()
+        .where(
+            (models.CallLeg.conversation_uuid == leg.conversation_uuid)
+            & (models.CallLeg.state == LegState.ANSWERED)
+            & (
+                (models.CallLeg.answered < leg.answered)
+                | (
+                    (models.CallLeg.answered == leg.answered)
+                    & (models.CallLeg.id <= leg.id)
+                )
+            )
+        )
+        .count()
+    )
+
+    return position <= limit
+
+
+def _cancel_ringing_legs(conversation_uuid: str) -> List[str]:
+    """Marks the conversation's ringing legs as cancelled if enough members
+    have answered, and returns the call UUIDs that need to be hung up."""
+    limit = injector.get(
+        "secrets.voice.max_simultaneous_answerers", DEFAULT_MAX_SIMULTANEOUS_ANSWERERS
+    )
+
+    if not limit:
+        return []
+
+    legs = list(
+        models.CallLeg.select().where(
+            models.CallLeg.conversation_uuid == conversation_uuid
+        )
+    )
+
+    answered = sum(1 for leg in legs if leg.state == LegState.ANSWERED)
+
+    if answered < limit:
+        return []
+
+    cancelled = []
+
+    for leg in legs:
+        if leg.state != LegState.RINGING:
+            continue
+
+        # Only hang up legs that haven't been answered in the meantime.
+        updated = (
+            models.CallLeg.update(state=LegState.CANCELLED)
+            .where(
+                (models.CallLeg.id == leg.id)
+                & (models.CallLeg.state == LegState.RINGING)
+            )
+            .execute()
+        )
+
+        if updated:
+            cancelled.append(leg.call_uuid)
+
+    return cancelled
+
+
+def _hang_up_call(client: nexmo.Client, call_uuid: str) -> None:
+    try:
+        client.update_call(call_uuid, action="hangup")
+    except nexmo.Error as error:
+        # The call may have already ended on its own.
+        logger.warning(f"Failed to hang up call {call_uuid[-12:]}: {error!r}")
+
+
+def hang_up_calls(client: nexmo.Client, call_uuids: List[str]) -> None:
+    """Hangs up all of the given calls, in parallel when possible."""
+    executor = _get_dial_out_executor()
+
+    if executor is None:
+        for call_uuid in call_uuids:
+            _hang_up_call(client, call_uuid)
+    else:
+        futures = [
+            executor.submit(_hang_up_call, client, call_uuid)
+            for call_uuid in call_uuids
+        ]
+        concurrent.futures.wait(futures)
+
+    metrics.increment("voice.cancelled_legs", len(call_uuids))
+
+
+def _deferred_dial_members(
+    client: nexmo.Client,
+    members: List[models.EventMember],
+    from_number: str,
+    answer_url: str,
+    conversation_uuid: str,
+    call_uuid: str,
+) -> None:
+    results = dial_members(
+        client, members, from_number, answer_url, retry=_deferred_retry
+    )
+    _record_legs(conversation_uuid, results)
+
+    # The reporter is already on hold by now, so let them know that nobody is
+    # coming.
+    if all(result.error is not None for result in results):
+        client.send_speech(call_uuid, text=common_text.voice_dial_out_failed)
+
 
 @injector.needs("nexmo.client")
 def handle_inbound_call(
@@ -36,75 +435,78 @@ def handle_inbound_call(
     host: str,
     client: nexmo.Client,
 ) -> List[dict]:
+    # Look up everything needed to route the call, usually from the cache.
+    route = routing.get_inbound_call_route(event_number, reporter_number)
+
     # Get the event. If there's no event, tell the user that something went
     # wrong.
-    event = db.get_event_by_number(event_number)
+    event = route.event
 
     if event is None:
         error_ncco = [{"action": "talk", "text": common_text.voice_no_event}]
         return error_ncco
 
     # Make sure the number isn't blocked.
-    if db.check_if_blocked(event=event, number=reporter_number):
+    if route.blocked:
         error_ncco = [{"action": "talk", "text": common_text.voice_blocked}]
         return error_ncco
 
     # Make sure that the user is a verified member of this hotline.
     # If not, bounce them.
-    if not db.get_verified_member_for_event_by_number(event, number=reporter_number):
+    if not route.caller_is_member:
         error_ncco = [{"action": "talk", "text": common_text.voice_non_member}]
         return error_ncco
 
     # Get the members for the event, excluding the current caller.
     # If there are no members, tell the user. :(
-    event_members = list(
-        db.get_verified_event_members_except_caller(event, number=reporter_number)
-    )
+    event_members = route.members
 
     if not event_members:
         error_ncco = [{"action": "talk", "text": common_text.voice_no_members}]
         return error_ncco
 
-    # Great, we have an event. Greet the user.
-    if event.voice_greeting is not None and event.voice_greeting.strip():
-        greeting = event.voice_greeting
-    else:
-        greeting = common_text.voice_default_greeting.format(event=event)
+    # Nexmo is having trouble, so members can't be called. Say so right away
+    # instead of holding up the caller (and this worker) until it times out.
+    if circuitbreaker.nexmo_breaker().is_open():
+        metrics.increment("voice.circuit_open")
+        error_ncco = [{"action": "talk", "text": common_text.voice_unavailable}]
+        return error_ncco
 
     # NCCOs to be given to the caller.
     reporter_nccos: List[dict] = []
 
-    # Greet the reporter.
-    reporter_nccos.append({"action": "talk", "text": greeting})
+    # Great, we have an event. Greet the reporter.
+    # Routes for an event always have a greeting.
+    assert route.greeting_ncco is not None
+    reporter_nccos.append(dict(route.greeting_ncco))
 
     # Start a "conversation" (conference call)
-    reporter_nccos.append(
-        {
-            "action": "conversation",
-            "name": conversation_uuid,
-            "eventMethod": "POST",
-            "musicOnHoldUrl": [HOLD_MUSIC],
-            "endOnExit": False,
-            "startOnEnter": False,
-        }
-    )
+    reporter_nccos.append(conversation_ncco(conversation_uuid))
 
     # Nexmo is apparently picky about + being in the from field.
     from_number = event.primary_number.strip("+")
 
+    answer_url = f"https://{host}/telephony/connect-to-conference/{conversation_uuid}/{call_uuid}"
+
     # Add all of the event members to the conference call.
-    for member in event_members:
-        client.create_call(
-            {
-                "to": [{"type": "phone", "number": member.number}],
-                "from": {"type": "phone", "number": from_number},
-                "answer_url": [
-                    f"https://{host}/telephony/connect-to-conference/{conversation_uuid}/{call_uuid}"
-                ],
-                "answer_method": "POST",
-                "machine_detection": "hangup",
-            }
+    if _is_deferred():
+        background.submit(
+            functools.partial(
+                _deferred_dial_members,
+                client,
+                event_members,
+                from_number=from_number,
+                answer_url=answer_url,
+                conversation_uuid=conversation_uuid,
+                call_uuid=call_uuid,
+            )
+        )
+        results = []
+    else:
+        results = dial_members(
+            client, event_members, from_number=from_number, answer_url=answer_url
         )
+        _record_legs(conversation_uuid, results)
 
     # TODO NZ: log name instead of number.
     # Last four digits of number is {reporter_number[-4:]}
@@ -115,6 +517,11 @@ def handle_inbound_call(
         reporter_number=reporter_number,
     )
 
+    # If nobody could be called, don't leave the reporter on hold forever.
+    if results and all(result.error is not None for result in results):
+        error_ncco = [{"action": "talk", "text": common_text.voice_dial_out_failed}]
+        return error_ncco
+
     return reporter_nccos
 
 
@@ -125,8 +532,14 @@ def handle_member_answer(
     origin_conversation_uuid: str,
     origin_call_uuid: str,
     client: nexmo.Client,
+    call_uuid: Optional[str] = None,
 ):
-    """Connects an organizer to a call-in-progress when they answer."""
+    """Connects an organizer to a call-in-progress when they answer.
+
+    call_uuid is the organizer's own leg. Once enough organizers have
+    answered, the calls to the rest are hung up, and anyone who answers late
+    is told that they aren't needed.
+    """
 
     # Members can actually be part of multiple events, so look up the event
     # separately.
@@ -137,10 +550,27 @@ def handle_member_answer(
         error_ncco = [{"action": "talk", "text": common_text.voice_answer_error}]
         return error_ncco
 
-    client.send_speech(
-        origin_call_uuid, text=common_text.voice_answer_announce.format(member=member)
+    if not _claim_answer(call_uuid):
+        metrics.increment("voice.late_answers")
+        return [{"action": "talk", "text": common_text.voice_answer_too_late}]
+
+    hang_up = functools.partial(
+        hang_up_calls, client, _cancel_ringing_legs(origin_conversation_uuid)
     )
 
+    announce = functools.partial(
+        client.send_speech,
+        origin_call_uuid,
+        text=common_text.voice_answer_announce.format(member=member),
+    )
+
+    if _is_deferred():
+        background.submit(announce, retry=_deferred_retry)
+        background.submit(hang_up)
+    else:
+        announce()
+        hang_up()
+
     ncco = [
         {
             "action": "talk",
@@ -12,12 +12,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
 import logging
 
 import flask
 import hotline.database.ext
 from hotline import csrf, injector
-from hotline.telephony import lowlevel, verification, voice
+from hotline.telephony import (
+    callevents,
+    dedupe,
+    inbox,
+    lowlevel,
+    verification,
+    voice,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -38,8 +46,22 @@ def inbound_sms():
     relay_number = lowlevel.normalize_e164_number(message["to"])
     message_text = message["text"]
 
+    message_id = message.get("messageId")
+
+    # Acknowledge right away and let the inbox worker handle the message.
+    # Retried deliveries have the same messageId and are ignored.
+    if inbox.is_enabled():
+        inbox.enqueue(message_id, user_number, relay_number, message_text)
+        return "", 204
+
     # Maybe handle verification, if this is a response to a verification message.
-    verification.maybe_handle_verification(user_number, message_text)
+    # Nexmo retries slow deliveries, so make sure it's only handled once.
+    dedupe.handle_once(
+        f"inbound-sms:{message_id}" if message_id else None,
+        functools.partial(
+            verification.maybe_handle_verification, user_number, message_text
+        ),
+    )
 
     return "", 204
 
@@ -57,12 +79,20 @@ def inbound_call(client):
     conversation_uuid = call["conversation_uuid"]
     call_uuid = call["uuid"]
 
-    ncco = voice.handle_inbound_call(
-        reporter_number=reporter_number,
-        event_number=event_number,
-        conversation_uuid=conversation_uuid,
-        call_uuid=call_uuid,
-        host=flask.request.host,
+    # Nexmo retries slow deliveries. The retries get the first delivery's
+    # NCCO instead of calling all of the members again, or, if that's still
+    # being worked on, join the same conversation.
+    ncco = dedupe.handle_once(
+        f"inbound-call:{call_uuid}",
+        functools.partial(
+            voice.handle_inbound_call,
+            reporter_number=reporter_number,
+            event_number=event_number,
+            conversation_uuid=conversation_uuid,
+            call_uuid=call_uuid,
+            host=flask.request.host,
+        ),
+        in_flight=lambda: [voice.conversation_ncco(conversation_uuid)],
     )
 
     return flask.jsonify(ncco)
@@ -84,6 +114,7 @@ def connect_to_conference(origin_conversation_uuid, origin_call_uuid, client):
         member_number=member_number,
         origin_conversation_uuid=origin_conversation_uuid,
         origin_call_uuid=origin_call_uuid,
+        call_uuid=call.get("uuid"),
     )
 
     return flask.jsonify(ncco)
@@ -92,6 +123,14 @@ def connect_to_conference(origin_conversation_uuid, origin_call_uuid, client):
 @csrf.exempt
 @blueprint.route("/telephony/event", methods=["POST"])
 def event():
-    # For now, we do nothing with these events, but this is required by
-    # nexmo.
+    call_event = flask.request.get_json(silent=True)
+
+    # There's nothing to record, but an error would only make Nexmo retry.
+    if not isinstance(call_event, dict):
+        logger.warning("Ignoring a call event without a JSON object body.")
+        return "", 204
+
+    # Events are written in batches in the background, so that this doesn't
+    # hold up Nexmo.
+    callevents.record(call_event)
     return "", 204
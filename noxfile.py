@@ -80,6 +80,16 @@ def serve(session):
     session.run("python", "-m", "flask", "run", env=env)
 
 
+@nox.session(python="3.7")
+def benchmark(session):
+    # For example, nox -s benchmark -- webhook_load --requests 500
+    session.install("-r", "requirements.txt")
+    name, *args = session.posargs or ["webhook_load"]
+    session.run(
+        "python", f"benchmarks/{name}.py", *args, env={"PYTHONPATH": os.getcwd()}
+    )
+
+
 @nox.session(python="3.7")
 def serve_prod(session):
     session.install("-r", "requirements.txt")
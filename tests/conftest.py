@@ -1,6 +1,25 @@
 import pytest
-from hotline.database import create_tables, highlevel
+from hotline import injector
+from hotline.database import create_tables, highlevel, pending, routing
 from hotline.database import models as db
+from hotline.telephony import circuitbreaker
+
+
+@pytest.fixture(autouse=True)
+def injector_registry():
+    """Keeps values that tests inject from leaking into other tests."""
+    registry = dict(injector._registry)
+    yield
+    injector._registry.clear()
+    injector._registry.update(registry)
+
+
+@pytest.fixture(autouse=True)
+def nexmo_circuit_breaker():
+    """Starts every test with a closed breaker for Nexmo."""
+    circuitbreaker.reset()
+    yield
+    circuitbreaker.reset()
 
 
 @pytest.fixture
@@ -9,6 +28,10 @@ def database(tmpdir):
     highlevel.initialize_db(database=f"sqlite:///{db_file}")
 
     create_tables.create_tables()
+    routing.clear()
+    pending.invalidate()
 
-    with db.db:
+    # Don't hold a transaction open for the whole test, otherwise SQLite
+    # would lock out any other threads the code under test uses.
+    with db.db.connection_context():
         yield db
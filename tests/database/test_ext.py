@@ -0,0 +1,56 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import flask
+import pytest
+from hotline import metrics
+from hotline.database import ext, models
+
+
+@pytest.fixture
+def app(database):
+    # Requests open their own connection.
+    database.db.close()
+    metrics.reset()
+
+    blueprint = flask.Blueprint("test", __name__)
+    ext.init_app(blueprint)
+
+    @blueprint.route("/static")
+    def static():
+        assert models.db.is_closed()
+        return "static"
+
+    @blueprint.route("/query")
+    def query():
+        return str(models.Event.select().count())
+
+    app = flask.Flask(__name__)
+    app.register_blueprint(blueprint)
+    return app
+
+
+def test_connects_lazily(app):
+    client = app.test_client()
+
+    assert client.get("/static").status_code == 200
+    assert models.db.is_closed()
+    assert metrics.snapshot()["counters"] == {"database.requests.skipped": 1}
+
+    assert client.get("/query").data == b"0"
+    assert models.db.is_closed()
+    assert metrics.snapshot()["counters"] == {
+        "database.requests.skipped": 1,
+        "database.requests.connected": 1,
+    }
@@ -0,0 +1,203 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+from unittest import mock
+
+import pytest
+from hotline import audit_log, injector
+from hotline.database import highlevel as db
+from hotline.database import models
+from tests.telephony import helpers
+
+
+def test_add_event_members(database):
+    event = helpers.create_event()
+    existing = helpers.add_member(event, name="Bob", number="+15035550101")
+
+    with mock.patch.object(
+        database.db.obj, "execute_sql", wraps=database.db.obj.execute_sql
+    ) as execute_sql:
+        added = db.add_event_members(
+            event,
+            [
+                ("Alice", "+15035550100"),
+                ("Bob again", "+15035550101"),
+                ("Carol", "+15035550102"),
+            ],
+        )
+
+    statements = [call[0][0].split()[0] for call in execute_sql.call_args_list]
+    # Looking up existing members, one insert and reading the new rows back.
+    assert [s for s in statements if s != "BEGIN"] == ["SELECT", "INSERT", "SELECT"]
+
+    assert [member.name for member in added] == ["Alice", "Carol"]
+    assert all(not member.verified for member in added)
+    assert added[0].event.name == event.name
+
+    numbers = [member.number for member in db.get_event_members(event)]
+    assert sorted(numbers) == ["+15035550100", existing.number, "+15035550102"]
+
+
+def test_insert_many(database):
+    rows = [
+        {"number": f"+1503555{n:04d}", "country": "US", "features": ""}
+        for n in range(db.INSERT_CHUNK_SIZE * 2 + 1)
+    ]
+
+    with mock.patch.object(
+        database.db.obj, "execute_sql", wraps=database.db.obj.execute_sql
+    ) as execute_sql:
+        db.insert_many(models.Number, rows)
+
+    assert execute_sql.call_count == 3
+    assert models.Number.select().count() == len(rows)
+
+
+def test_initialize_db_pooled(tmpdir):
+    injector.set("secrets.database_pool.max_connections", 3)
+    injector.set("secrets.database_pool.stale_timeout", 60)
+
+    db.initialize_db(database=f"sqlite+pool:///{tmpdir.join('pool.sqlite')}")
+
+    try:
+        assert db.get_db_pool_stats() == {
+            "max_connections": 3,
+            "in_use": 0,
+            "idle": 0,
+            "stale_timeout": 60,
+        }
+
+        models.db.connect()
+        connection = models.db.connection()
+        assert db.get_db_pool_stats()["in_use"] == 1
+
+        # Closing returns the connection to the pool instead of closing it.
+        models.db.close()
+        stats = db.get_db_pool_stats()
+        assert stats["in_use"] == 0
+        assert stats["idle"] == 1
+
+        models.db.connect()
+        assert models.db.connection() is connection
+
+    finally:
+        models.db.close_all()
+
+
+def test_initialize_db_pool_url_params_win(tmpdir):
+    injector.set("secrets.database_pool.max_connections", 3)
+
+    db.initialize_db(
+        database=f"sqlite+pool:///{tmpdir.join('pool.sqlite')}?max_connections=7"
+    )
+
+    try:
+        assert db.get_db_pool_stats()["max_connections"] == 7
+
+    finally:
+        models.db.close_all()
+
+
+def test_get_db_pool_stats_not_pooled(database):
+    assert db.get_db_pool_stats() is None
+
+
+def _add_logs(event, count, start=datetime.datetime(2019, 2, 23, 9)):
+    logs = []
+
+    for n in range(count):
+        logs.append(
+            models.AuditLog.create(
+                event=event,
+                # Pairs of logs share a timestamp, so pages can split a pair.
+                timestamp=start + datetime.timedelta(minutes=n // 2),
+                kind=(
+                    audit_log.Kind.SMS_CONVERSATION_STARTED
+                    if n % 3
+                    else audit_log.Kind.MEMBER_ADDED
+                ),
+                reporter_number=f"+1555{n:04d}" if n % 3 else None,
+            )
+        )
+
+    # Newest first.
+    return sorted(logs, key=lambda log: (log.timestamp, log.id), reverse=True)
+
+
+def test_get_logs_for_event_pages(database):
+    event = helpers.create_event()
+    other_event = models.Event.create(name="Other event", slug="other")
+    logs = _add_logs(event, 7)
+    _add_logs(other_event, 3)
+
+    seen = []
+    cursor = None
+
+    while True:
+        page = db.get_logs_for_event(event, before=cursor, limit=3)
+        seen.extend(log.id for log in page.logs)
+        cursor = page.next_cursor
+
+        if cursor is None:
+            break
+
+    assert seen == [log.id for log in logs]
+
+
+def test_get_logs_for_event_filters(database):
+    event = helpers.create_event()
+    logs = _add_logs(event, 12)
+
+    page = db.get_logs_for_event(event, kinds=[audit_log.Kind.MEMBER_ADDED])
+    assert [log.id for log in page.logs] == [
+        log.id for log in logs if log.kind == audit_log.Kind.MEMBER_ADDED
+    ]
+
+    page = db.get_logs_for_event(event, has_reporter_number=False)
+    assert [log.id for log in page.logs] == [
+        log.id for log in logs if log.reporter_number is None
+    ]
+
+    start = datetime.datetime(2019, 2, 23, 9, 2)
+    end = datetime.datetime(2019, 2, 23, 9, 4)
+    page = db.get_logs_for_event(
+        event, start=start, end=end, has_reporter_number=True, limit=2
+    )
+    expected = [
+        log.id
+        for log in logs
+        if start <= log.timestamp < end and log.reporter_number is not None
+    ]
+    assert [log.id for log in page.logs] == expected[:2]
+
+    page = db.get_logs_for_event(
+        event,
+        start=start,
+        end=end,
+        has_reporter_number=True,
+        limit=2,
+        before=page.next_cursor,
+    )
+    assert [log.id for log in page.logs] == expected[2:]
+    assert page.next_cursor is None
+
+
+def test_decode_log_cursor():
+    log = models.AuditLog(id=42, timestamp=datetime.datetime(2019, 2, 23, 9, 0, 1, 5))
+
+    assert db.decode_log_cursor(db.encode_log_cursor(log)) == (log.timestamp, 42)
+
+    with pytest.raises(ValueError):
+        db.decode_log_cursor("nope")
@@ -0,0 +1,69 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import mock
+
+from hotline import injector
+from hotline.database import highlevel as db
+from hotline.database import pending
+from tests.telephony import helpers
+
+
+def test_might_be_pending(database):
+    event = helpers.create_event()
+    helpers.add_members(event)
+    judy = helpers.add_unverfied_members(event)
+
+    assert pending.might_be_pending(judy.number)
+
+    with mock.patch.object(
+        database.db.obj, "execute_sql", wraps=database.db.obj.execute_sql
+    ) as execute_sql:
+        assert not pending.might_be_pending("101")
+        assert not pending.might_be_pending("999")
+
+    execute_sql.assert_not_called()
+
+
+def test_reloads_after_ttl(database):
+    injector.set("secrets.pending_verifications.ttl", 0)
+    event = helpers.create_event()
+
+    assert not pending.might_be_pending("303")
+
+    # Added without telling this process, like another process would.
+    helpers.add_unverfied_members(event)
+
+    assert pending.might_be_pending("303")
+
+
+def test_add_event_members_adds(database):
+    event = helpers.create_event()
+
+    assert not pending.might_be_pending("+15035550100")
+
+    db.add_event_members(event, [("Alice", "+15035550100")])
+
+    assert pending.might_be_pending("+15035550100")
+
+
+def test_remove_event_member_invalidates(database):
+    event = helpers.create_event()
+    judy = helpers.add_unverfied_members(event)
+
+    assert pending.might_be_pending(judy.number)
+
+    db.remove_event_member(judy.id)
+
+    assert not pending.might_be_pending(judy.number)
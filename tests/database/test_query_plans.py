@@ -0,0 +1,284 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Checks that the queries in hotline.database.highlevel and routing don't
+scan whole tables, so that missing indexes show up before the tables grow.
+
+Every query a function runs is captured and passed through EXPLAIN. On
+SQLite, any table that's read with SCAN instead of SEARCH fails the test.
+
+To also check against Postgres, point HOTLINE_TEST_POSTGRES_URL at a scratch
+database. Its tables are dropped and recreated. Sequential scans are disabled
+there, so that the planner only picks one when no index can serve the query,
+however small the table is.
+"""
+
+import datetime
+import json
+import os
+import re
+from typing import List, Set
+from unittest import mock
+
+import pytest
+from hotline.database import create_tables
+from hotline.database import highlevel as db
+from hotline.database import models, routing
+
+EVENTS = 500
+MEMBERS_PER_EVENT = 10
+LOGS_PER_EVENT = 20
+# Numbers that aren't assigned to an event yet.
+SPARE_NUMBERS = 500
+COUNTRIES = ["US", "GB", "CA", "AU"]
+
+POSTGRES_URL = os.environ.get("HOTLINE_TEST_POSTGRES_URL")
+
+_SQLITE_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)")
+_TABLE_ALIAS = re.compile(r'"(\w+)" AS "(\w+)"')
+
+
+def _event_number(n: int) -> str:
+    return f"+1503555{n:04d}"
+
+
+def _member_number(event: int, n: int) -> str:
+    return f"+1971{event:04d}{n:03d}"
+
+
+def _seed() -> None:
+    numbers = [
+        {
+            "id": n + 1,
+            "number": _event_number(n),
+            "country": COUNTRIES[n % len(COUNTRIES)],
+            "features": "SMS,VOICE",
+        }
+        for n in range(EVENTS + SPARE_NUMBERS)
+    ]
+    events = [
+        {
+            "id": n + 1,
+            "name": f"Event {n}",
+            "slug": f"event-{n}",
+            "primary_number": _event_number(n),
+            "primary_number_id": n + 1,
+            "country": COUNTRIES[n % len(COUNTRIES)],
+        }
+        for n in range(EVENTS)
+    ]
+    members = [
+        {
+            "event": event + 1,
+            "name": f"Member {n}",
+            "number": _member_number(event, n),
+            # Most members have verified.
+            "verified": n != 0,
+        }
+        for event in range(EVENTS)
+        for n in range(MEMBERS_PER_EVENT)
+    ]
+    organizers = [
+        {
+            "event": event + 1,
+            "user_id": f"user-{event}" if n == 0 else None,
+            "user_name": f"Organizer {event}" if n == 0 else None,
+            "user_email": f"organizer-{event}-{n}@example.com",
+        }
+        for event in range(EVENTS)
+        for n in range(2)
+    ]
+    block_list = [
+        {"event": event + 1, "number": f"+1555{event:04d}{n:03d}"}
+        for event in range(EVENTS)
+        for n in range(3)
+    ]
+    logs = [
+        {
+            "event": event + 1,
+            "kind": 1,
+            "description": "Call",
+            "reporter_number": f"+1555{event:04d}{n:03d}",
+        }
+        for event in range(EVENTS)
+        for n in range(LOGS_PER_EVENT)
+    ]
+    nexmo_numbers = [
+        {"msisdn": _event_number(n).lstrip("+"), "country": "US"} for n in range(EVENTS)
+    ]
+
+    with models.db.atomic():
+        for model, rows in (
+            (models.Number, numbers),
+            (models.Event, events),
+            (models.EventMember, members),
+            (models.EventOrganizer, organizers),
+            (models.BlockList, block_list),
+            (models.AuditLog, logs),
+            (models.NexmoNumber, nexmo_numbers),
+        ):
+            db.insert_many(model, rows)
+
+
+@pytest.fixture(
+    scope="module",
+    params=[
+        "sqlite",
+        pytest.param(
+            "postgres",
+            marks=pytest.mark.skipif(
+                not POSTGRES_URL, reason="HOTLINE_TEST_POSTGRES_URL isn't set."
+            ),
+        ),
+    ],
+)
+def backend(request, tmp_path_factory):
+    if request.param == "sqlite":
+        db_file = tmp_path_factory.mktemp("plans") / "database.sqlite"
+        db.initialize_db(database=f"sqlite:///{db_file}")
+    else:
+        db.initialize_db(database=POSTGRES_URL)
+
+    create_tables.create_tables()
+
+    with models.db.connection_context():
+        _seed()
+        models.db.execute_sql("ANALYZE")
+
+    yield request.param
+
+    models.db.close()
+
+
+def _explain_sqlite(sql: str, params) -> Set[str]:
+    cursor = models.db.execute_sql(f"EXPLAIN QUERY PLAN {sql}", params)
+    # The plan names tables by the aliases peewee gives them.
+    tables = {alias: table for table, alias in _TABLE_ALIAS.findall(sql)}
+    scanned = set()
+
+    for row in cursor.fetchall():
+        match = _SQLITE_SCAN.match(row[-1])
+        if match:
+            scanned.add(tables.get(match.group(1), match.group(1)))
+
+    return scanned
+
+
+def _seq_scans(plan: dict) -> Set[str]:
+    scanned = set()
+
+    if plan["Node Type"] == "Seq Scan":
+        scanned.add(plan["Relation Name"])
+
+    for child in plan.get("Plans", []):
+        scanned |= _seq_scans(child)
+
+    return scanned
+
+
+def _explain_postgres(sql: str, params) -> Set[str]:
+    with models.db.atomic() as transaction:
+        models.db.execute_sql("SET LOCAL enable_seqscan = off")
+        cursor = models.db.execute_sql(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+        transaction.rollback()
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return _seq_scans(plan[0]["Plan"])
+
+
+def _capture(func) -> List[tuple]:
+    """Runs the function, returning the queries it ran."""
+    with mock.patch.object(
+        models.db.obj, "execute_sql", wraps=models.db.obj.execute_sql
+    ) as execute_sql:
+        func()
+
+    return [
+        (call[0][0], call[0][1] if len(call[0]) > 1 else ())
+        for call in execute_sql.call_args_list
+        if call[0][0].split()[0] in ("SELECT", "UPDATE", "DELETE")
+    ]
+
+
+def _event():
+    return models.Event.get(models.Event.slug == "event-42")
+
+
+# Each case is a query function, given a seeded event, and the tables it's
+# expected to scan in full.
+CASES = {
+    "list_events_for_user": (lambda event: list(db.list_events_for_user("user-42")),),
+    "check_if_user_is_organizer": (
+        lambda event: db.check_if_user_is_organizer("event-42", "user-42"),
+    ),
+    "get_event_by_slug": (lambda event: db.get_event_by_slug("event-42"),),
+    "get_event_by_number": (lambda event: db.get_event_by_number(_event_number(42)),),
+    "get_event_organizers": (lambda event: list(db.get_event_organizers(event)),),
+    "get_event_organizer": (lambda event: db.get_event_organizer("42"),),
+    "get_event_members": (lambda event: list(db.get_event_members(event)),),
+    "get_verified_event_members": (
+        lambda event: list(db.get_verified_event_members(event)),
+    ),
+    # Loading a route that isn't cached yet.
+    "routing.get_inbound_call_route": (
+        lambda event: (
+            routing.clear(),
+            routing.get_inbound_call_route(_event_number(42), _member_number(42, 1)),
+        ),
+    ),
+    "get_member": (lambda event: db.get_member("42"),),
+    "get_member_by_number": (
+        lambda event: db.get_member_by_number(_member_number(42, 1)),
+    ),
+    "find_pending_member_by_number": (
+        lambda event: db.find_pending_member_by_number(_member_number(42, 0)),
+    ),
+    "find_unused_event_numbers": (lambda event: db.find_unused_event_numbers("GB"),),
+    "count_unused_event_numbers": (lambda event: db.count_unused_event_numbers("GB"),),
+    "get_logs_for_event": (lambda event: db.get_logs_for_event(event),),
+    "get_logs_for_event_filtered": (
+        lambda event: db.get_logs_for_event(
+            event,
+            kinds=[1],
+            start=datetime.datetime(2019, 1, 1),
+            end=datetime.datetime(2038, 1, 1),
+            has_reporter_number=True,
+            before=db.get_logs_for_event(event, limit=5).next_cursor,
+        ),
+    ),
+    "get_blocklist_for_event": (lambda event: list(db.get_blocklist_for_event(event)),),
+    # The admin numbers page lists every number.
+    "list_numbers": (lambda event: list(db.list_numbers()), {"number"}),
+    "get_number_and_event": (lambda event: db.get_number_and_event(_event_number(42)),),
+}
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_query_plan(backend, name):
+    func, *allowed = CASES[name]
+    allowed_scans = allowed[0] if allowed else set()
+    explain = _explain_sqlite if backend == "sqlite" else _explain_postgres
+
+    with models.db.connection_context():
+        event = _event()
+        queries = _capture(lambda: func(event))
+
+        assert queries, f"{name} didn't run any queries."
+
+        for sql, params in queries:
+            scanned = explain(sql, params) - allowed_scans
+            assert not scanned, f"{name} scans {sorted(scanned)}:\n{sql}"
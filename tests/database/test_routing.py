@@ -0,0 +1,88 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import mock
+
+from hotline.database import models, routing
+from tests.telephony import helpers
+
+
+def test_get_inbound_call_route(database):
+    event = helpers.create_event()
+    members = helpers.add_members(event)
+    helpers.add_unverfied_members(event)
+
+    route = routing.get_inbound_call_route("+5678", members[0].number)
+
+    assert route.event.id == event.id
+    assert not route.blocked
+    assert route.caller_is_member
+    # Only the other verified members are called.
+    assert [member.id for member in route.members] == [members[1].id]
+
+
+def test_get_inbound_call_route_no_event(database):
+    route = routing.get_inbound_call_route("+5678", "101")
+
+    assert route.event is None
+    assert route.members == []
+
+
+def test_get_inbound_call_route_blocked(database):
+    event = helpers.create_event()
+    helpers.add_members(event)
+    helpers.create_block_list(event=event, number="303", blocked_by="test")
+
+    route = routing.get_inbound_call_route("+5678", "303")
+
+    assert route.blocked
+    assert not route.caller_is_member
+    assert len(route.members) == 2
+
+
+def test_get_inbound_call_route_member_of_another_event(database):
+    event = helpers.create_event()
+    helpers.add_members(event)
+
+    other_event = models.Event.create(name="Other event", slug="other")
+    helpers.add_member(event=other_event, name="Mallory", number="404")
+
+    route = routing.get_inbound_call_route("+5678", "404")
+
+    assert not route.caller_is_member
+
+
+def test_get_inbound_call_route_no_other_members(database):
+    event = helpers.create_event()
+    member = helpers.add_member(event=event, name="Bob", number="101")
+
+    route = routing.get_inbound_call_route("+5678", member.number)
+
+    assert route.caller_is_member
+    assert route.members == []
+
+
+def test_get_inbound_call_route_is_one_query(database):
+    event = helpers.create_event()
+    members = helpers.add_members(event)
+    helpers.create_block_list(event=event, number="999", blocked_by="test")
+
+    with mock.patch.object(
+        database.db.obj, "execute_sql", wraps=database.db.obj.execute_sql
+    ) as execute_sql:
+        route = routing.get_inbound_call_route("+5678", members[0].number)
+
+    assert len(route.members) == 1
+    assert route.greeting_ncco["action"] == "talk"
+    execute_sql.assert_called_once()
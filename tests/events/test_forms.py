@@ -0,0 +1,60 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from hotline.events import forms
+from werkzeug.datastructures import MultiDict
+
+
+def _import(members):
+    form = forms.ImportMembersForm(MultiDict({"members": members}))
+    valid = form.validate()
+    return valid, form.members
+
+
+def test_import_members_pasted():
+    valid, field = _import("Alice, +1 503 555 0100\n\nBob,503-555-0101\n")
+
+    assert valid
+    assert field.data == [("Alice", "+15035550100"), ("Bob", "+15035550101")]
+
+
+def test_import_members_csv_with_header():
+    valid, field = _import('Name,Number\r\n"Smith, Alice",+15035550100\r\n')
+
+    assert valid
+    assert field.data == [("Smith, Alice", "+15035550100")]
+
+
+def test_import_members_errors():
+    valid, field = _import(
+        "Alice\n"
+        "Bob, nope\n"
+        "Carol, +1 503 555 0100\n"
+        "Dan, 503 555 0100\n"
+        "Erin, +1 503 555 0101\n"
+    )
+
+    assert not valid
+    assert field.errors == [
+        "Line 1: expected a name and a number.",
+        "Line 2: nope does not appear to be a valid number.",
+        "Line 4: 503 555 0100 is listed twice.",
+    ]
+
+
+def test_import_members_nothing_to_add():
+    valid, field = _import("Name, Number\n\n")
+
+    assert not valid
+    assert field.errors == ["There aren't any members to add."]
@@ -0,0 +1,168 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from unittest import mock
+
+import flask
+import hotline.app
+import nexmo
+import pytest
+from hotline import audit_log, injector
+from hotline.database import models, pending
+from hotline.events import webhandlers
+from hotline.telephony import voice
+from tests.telephony import helpers
+
+HOTLINE_DIR = os.path.dirname(hotline.app.__file__)
+
+
+@pytest.fixture
+def app(database):
+    # Requests open their own connection.
+    database.db.close()
+
+    # Signs requests in as a developer.
+    injector.set("secrets.firebase", {"development_mode": True})
+
+    # The admin layout needs the shared templates. CSRF isn't set up here.
+    app = flask.Flask(
+        __name__,
+        template_folder=os.path.join(HOTLINE_DIR, "templates"),
+        static_folder=os.path.join(HOTLINE_DIR, "static"),
+    )
+    app.register_blueprint(webhandlers.blueprint)
+    app.add_template_filter(hotline.app.phone_format_filter, "phone")
+    app.jinja_env.globals["csrf_field"] = lambda: ""
+    return app
+
+
+def _create_event():
+    event = helpers.create_event()
+    models.EventOrganizer.create(
+        event=event, user_id="dev", user_name="Developer", user_email="dev@example.com"
+    )
+    return event
+
+
+def _dial_in(nexmo_client, reporter_number):
+    return voice.handle_inbound_call(
+        reporter_number=reporter_number,
+        event_number="+5678",
+        conversation_uuid="conversation",
+        call_uuid="call",
+        host="example.com",
+        client=nexmo_client,
+    )
+
+
+def test_details_updates_cached_route(app):
+    injector.set("secrets.routing_cache.ttl", 60)
+    event = helpers.create_event()
+    members = helpers.add_members(event)
+    models.EventOrganizer.create(
+        event=event, user_id="dev", user_name="Developer", user_email="dev@example.com"
+    )
+
+    nexmo_client = mock.create_autospec(nexmo.Client)
+    nexmo_client.create_call.side_effect = lambda params: {
+        "uuid": f"leg-{len(nexmo_client.create_call.call_args_list)}"
+    }
+
+    ncco = _dial_in(nexmo_client, members[0].number)
+    assert ncco[0]["text"] != "Thanks for calling!"
+
+    response = app.test_client().post(
+        f"/manage/events/{event.slug}/details",
+        data={
+            "name": event.name,
+            "slug": event.slug,
+            "country": "US",
+            "voice_greeting": "Thanks for calling!",
+        },
+    )
+    assert response.status_code == 302
+
+    ncco = _dial_in(nexmo_client, members[0].number)
+    assert ncco[0] == {"action": "talk", "text": "Thanks for calling!"}
+
+
+def test_import_members(app):
+    injector.set("secrets.outbox.enabled", True)
+    injector.set("secrets.virtual_number", "+15035550000")
+    event = _create_event()
+    helpers.add_member(event=event, name="Bob", number="+15035550101")
+
+    response = app.test_client().post(
+        f"/manage/events/{event.slug}/members/import",
+        data={"members": "Name,Number\nAlice,+1 503 555 0100\nBob,503-555-0101\n"},
+    )
+
+    assert response.status_code == 302
+    assert response.headers["Location"].endswith(f"/manage/events/{event.slug}/numbers")
+
+    # Bob is already a member, so only Alice is added.
+    members = {member.name: member for member in models.EventMember.select()}
+    assert members["Alice"].number == "+15035550100"
+    assert not members["Alice"].verified
+
+    logs = list(
+        models.AuditLog.select().where(
+            models.AuditLog.kind == audit_log.Kind.MEMBER_ADDED
+        )
+    )
+    assert len(logs) == 1
+    assert logs[0].description == "Developer added 1 members: Alice."
+
+    # The verification message is queued in the outbox.
+    assert [message.to for message in models.OutboundMessage.select()] == [
+        "+15035550100"
+    ]
+
+
+def test_import_members_errors(app):
+    event = _create_event()
+
+    response = app.test_client().post(
+        f"/manage/events/{event.slug}/members/import",
+        data={"members": "Alice\nBob, nope\n"},
+    )
+
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert "Line 1: expected a name and a number." in body
+    assert "Line 2: nope does not appear to be a valid number." in body
+    assert models.EventMember.select().count() == 0
+    assert models.AuditLog.select().count() == 0
+
+
+@pytest.mark.parametrize(
+    ["path", "data"],
+    [
+        ("numbers", {"name": "Alice", "number": "+1 503 555 0100"}),
+        ("members/import", {"members": "Alice, +1 503 555 0100"}),
+    ],
+)
+def test_adding_members_updates_pending(app, path, data):
+    injector.set("secrets.outbox.enabled", True)
+    injector.set("secrets.virtual_number", "+15035550000")
+    event = _create_event()
+
+    # Loads the set, which isn't reloaded for a while.
+    assert not pending.might_be_pending("+15035550100")
+
+    response = app.test_client().post(f"/manage/events/{event.slug}/{path}", data=data)
+    assert response.status_code == 302
+
+    assert pending.might_be_pending("+15035550100")
@@ -0,0 +1,82 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import flask
+import hotline
+import nexmo
+import pytest
+from hotline import injector, metrics
+from hotline.database import highlevel as db
+from hotline.database import models
+from hotline.events import webhandlers as events_webhandlers
+from hotline.numberadmin import webhandlers
+
+HOTLINE_DIR = os.path.dirname(hotline.__file__)
+
+
+@pytest.fixture
+def app():
+    metrics.reset()
+    metrics.increment("outbox.sent")
+    metrics.observe("outbox.batch", 0.25)
+
+    # Signs requests in as a developer.
+    injector.set("secrets.firebase", {"development_mode": True})
+    injector.set("nexmo.client", nexmo.Client(key="key", secret="secret"))
+
+    # The admin layout needs the shared templates and the events pages.
+    app = flask.Flask(
+        __name__,
+        template_folder=os.path.join(HOTLINE_DIR, "templates"),
+        static_folder=os.path.join(HOTLINE_DIR, "static"),
+    )
+    app.register_blueprint(webhandlers.blueprint)
+    app.register_blueprint(events_webhandlers.blueprint)
+    return app
+
+
+def _get_stats(app):
+    response = app.test_client().get("/admin/stats")
+
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert "outbox.sent" in body
+    # The mean of the single 250 ms timing.
+    assert "250.0" in body
+
+    return body
+
+
+def test_stats(database, app):
+    # Requests open their own connection.
+    database.db.close()
+
+    body = _get_stats(app)
+
+    assert "The database isn't pooled." in body
+
+
+def test_stats_pooled(tmpdir, app):
+    db.initialize_db(database=f"sqlite+pool:///{tmpdir.join('pool.sqlite')}")
+
+    try:
+        body = _get_stats(app)
+
+    finally:
+        models.db.close_all()
+
+    assert "The database isn't pooled." not in body
+    assert "Stale timeout" in body
@@ -0,0 +1,190 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from unittest import mock
+
+import httpx
+import jwt
+import nexmo
+import pytest
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from hotline import injector
+from hotline.telephony import asyncclient, fakenexmo, voice
+from tests.telephony import helpers
+
+
+@pytest.fixture(scope="module")
+def private_key():
+    key = rsa.generate_private_key(
+        public_exponent=65537, key_size=2048, backend=default_backend()
+    )
+    return key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode("ascii")
+
+
+@pytest.fixture
+def fake():
+    return fakenexmo.FakeNexmo()
+
+
+@pytest.fixture
+def client(fake, private_key):
+    return asyncclient.AsyncClient(
+        key="key",
+        secret="secret",
+        application_id="appid",
+        private_key=private_key,
+        transport=fakenexmo.transport(fake),
+    )
+
+
+def test_send_message(fake, client):
+    resp = asyncio.run(
+        client.send_message({"from": "5678", "to": "1234", "text": "meep"})
+    )
+
+    assert resp["messages"][0]["to"] == "1234"
+
+    request = fake.requests_to("/sms/json")[0]
+    assert request.method == "POST"
+    assert request.params == {
+        "from": "5678",
+        "to": "1234",
+        "text": "meep",
+        "api_key": "key",
+        "api_secret": "secret",
+    }
+
+
+def test_number_provisioning(fake, client):
+    async def provision():
+        available = await client.get_available_numbers(
+            "US", {"features": "SMS,VOICE", "type": "mobile-lvn"}
+        )
+        number = available["numbers"][0]
+
+        await client.buy_number({"country": "US", "msisdn": number["msisdn"]})
+        await client.update_number(
+            {
+                "country": "US",
+                "msisdn": number["msisdn"],
+                "voiceCallbackType": "app",
+                "voiceCallbackValue": "appid",
+            }
+        )
+
+        return number, await client.get_account_numbers(pattern=number["msisdn"])
+
+    number, owned = asyncio.run(provision())
+
+    assert owned["count"] == 1
+    assert owned["numbers"][0]["msisdn"] == number["msisdn"]
+    assert owned["numbers"][0]["voiceCallbackValue"] == "appid"
+
+    search = fake.requests_to("/number/search")[0]
+    assert search.method == "GET"
+    assert search.params["country"] == "US"
+    assert search.params["api_key"] == "key"
+
+
+def test_calls(fake, client):
+    async def call():
+        created = await asyncio.gather(
+            *[
+                client.create_call({"to": [{"type": "phone", "number": f"{n}"}]})
+                for n in range(100)
+            ]
+        )
+        await client.send_speech(created[0]["uuid"], text="Hello")
+        return created
+
+    created = asyncio.run(call())
+
+    assert len({call["uuid"] for call in created}) == 100
+    assert len(fake.calls) == 100
+
+    talk = fake.requests_to(f"/v1/calls/{created[0]['uuid']}/talk")[0]
+    assert talk.method == "PUT"
+    assert talk.params == {"text": "Hello"}
+
+
+@pytest.mark.parametrize(
+    ["status", "error"],
+    [
+        (401, nexmo.AuthenticationError),
+        (400, nexmo.ClientError),
+        (500, nexmo.ServerError),
+    ],
+)
+def test_errors(private_key, status, error):
+    client = asyncclient.AsyncClient(
+        key="key",
+        secret="secret",
+        private_key=private_key,
+        transport=httpx.MockTransport(lambda request: httpx.Response(status)),
+    )
+
+    with pytest.raises(error):
+        asyncio.run(client.send_message({"to": "1234"}))
+
+
+def test_run_reuses_client_across_calls(fake, client):
+    first = asyncclient.run(client.send_message({"to": "1234"}), timeout=10)
+    second = asyncclient.run(client.send_message({"to": "5678"}), timeout=10)
+
+    assert first["messages"][0]["to"] == "1234"
+    assert second["messages"][0]["to"] == "5678"
+    assert len(fake.requests_to("/sms/json")) == 2
+
+
+def test_dial_members_asyncio(database, fake, client):
+    injector.set("secrets.voice.fan_out_mode", "asyncio")
+    injector.set("nexmo.async_client", client)
+
+    event = helpers.create_event()
+    members = [
+        helpers.add_member(event=event, name=f"Member {n}", number=f"{n}")
+        for n in range(20)
+    ]
+
+    results = voice.dial_members(
+        mock.sentinel.unused_client,
+        members,
+        from_number="5678",
+        answer_url="https://example.com/answer",
+    )
+
+    assert [result.member for result in results] == members
+    assert all(result.error is None for result in results)
+    assert {call["params"]["to"][0]["number"] for call in fake.calls.values()} == {
+        f"{n}" for n in range(20)
+    }
+
+
+def test_jwt(client, private_key):
+    token = client._jwt_headers()["Authorization"].split(" ", 1)[1]
+
+    public_key = serialization.load_pem_private_key(
+        private_key.encode("ascii"), password=None, backend=default_backend()
+    ).public_key()
+    claims = jwt.decode(token, public_key, algorithms=["RS256"])
+
+    assert claims["application_id"] == "appid"
+    assert claims["exp"] - claims["iat"] == 60
@@ -0,0 +1,116 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import time
+
+import flask
+import hotline.csrf
+import pytest
+from hotline import injector
+from hotline.database import batching, models
+from hotline.telephony import callevents, webhandlers
+
+
+@pytest.fixture
+def writer():
+    # Don't let the background thread flush on its own.
+    injector.set("secrets.call_events.flush_interval", 60)
+    callevents._writer = None
+    yield
+    callevents._writer = None
+
+
+@pytest.fixture
+def app(database):
+    # Requests open their own connection.
+    database.db.close()
+
+    app = flask.Flask(__name__)
+    hotline.csrf.init_app(app)
+    app.register_blueprint(webhandlers.blueprint)
+    return app
+
+
+def _call_event(n, status="ringing"):
+    return {
+        "from": "15035550000",
+        "to": f"1503555{n:04d}",
+        "uuid": f"leg-{n}",
+        "conversation_uuid": "CON-1",
+        "status": status,
+        "direction": "outbound",
+        "timestamp": "2019-07-28T22:07:31.123Z",
+    }
+
+
+def test_record_and_flush(database, writer):
+    callevents.record(_call_event(1))
+    callevents.record(dict(_call_event(1, status="completed"), duration="42"))
+
+    assert models.CallEvent.select().count() == 0
+    assert callevents.flush() == 2
+
+    events = list(models.CallEvent.select().order_by(models.CallEvent.id))
+    assert [event.status for event in events] == ["ringing", "completed"]
+    assert events[0].call_uuid == "leg-1"
+    assert events[0].conversation_uuid == "CON-1"
+    assert events[0].timestamp == datetime.datetime(2019, 7, 28, 22, 7, 31, 123000)
+    assert events[0].duration is None
+    assert events[1].duration == 42
+
+
+def test_event_webhook(database, writer, app):
+    client = app.test_client()
+
+    for n in range(20):
+        response = client.post("/telephony/event", json=_call_event(n))
+        assert response.status_code == 204
+
+    # Nothing is written while handling the webhooks.
+    assert models.CallEvent.select().count() == 0
+
+    callevents.flush()
+
+    assert models.CallEvent.select().count() == 20
+
+
+def test_buffered_writer_flushes_full_batches(database):
+    writer = batching.BufferedWriter(
+        models.CallEvent, batch_size=120, flush_interval=60
+    )
+
+    for n in range(120):
+        writer.add({"call_uuid": f"leg-{n}", "status": "ringing"})
+
+    deadline = time.monotonic() + 5
+    while writer.pending() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    # The background thread may still be inside the flush.
+    writer.flush()
+
+    assert models.CallEvent.select().count() == 120
+
+
+@pytest.mark.parametrize("body", [b"", b"not json", b"[1, 2]"])
+def test_event_webhook_without_an_event(database, writer, app, body):
+    client = app.test_client()
+
+    response = client.post(
+        "/telephony/event", data=body, content_type="application/json"
+    )
+
+    assert response.status_code == 204
+    assert callevents.flush() == 0
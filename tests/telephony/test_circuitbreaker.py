@@ -0,0 +1,276 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from unittest import mock
+
+import httpx
+import nexmo
+import pytest
+import requests
+from hotline import common_text, injector
+from hotline.database import models
+from hotline.telephony import asyncclient, circuitbreaker, outbox, voice
+from tests.telephony import helpers
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def breaker(clock):
+    return circuitbreaker.CircuitBreaker(
+        "test", failure_threshold=3, reset_timeout=30, clock=clock
+    )
+
+
+def _fail():
+    raise nexmo.ServerError("500 response from rest.nexmo.com")
+
+
+def _trip(breaker):
+    for _ in range(breaker.failure_threshold):
+        with pytest.raises(nexmo.ServerError):
+            breaker.call(_fail)
+
+
+def test_opens_after_failures_in_a_row(breaker):
+    for _ in range(2):
+        with pytest.raises(nexmo.ServerError):
+            breaker.call(_fail)
+
+    # A success resets the count.
+    assert breaker.call(lambda: "ok") == "ok"
+
+    _trip(breaker)
+
+    assert breaker.state == circuitbreaker.State.OPEN
+    assert breaker.is_open()
+
+    func = mock.Mock()
+    with pytest.raises(circuitbreaker.CircuitOpen):
+        breaker.call(func)
+    func.assert_not_called()
+
+
+def test_client_errors_dont_count(breaker):
+    def reject():
+        raise nexmo.ClientError("420 response from rest.nexmo.com")
+
+    for _ in range(5):
+        with pytest.raises(nexmo.ClientError):
+            breaker.call(reject)
+
+    assert breaker.state == circuitbreaker.State.CLOSED
+
+
+def test_slow_calls_count(breaker, clock):
+    def slow():
+        clock.now += 10
+        return "ok"
+
+    for _ in range(3):
+        assert breaker.call(slow) == "ok"
+
+    assert breaker.is_open()
+
+
+def test_half_open_probe_closes(breaker, clock):
+    _trip(breaker)
+
+    clock.now += 30
+    assert not breaker.is_open()
+
+    def probe():
+        # Only the probe is let through while it's in flight.
+        assert breaker.state == circuitbreaker.State.HALF_OPEN
+        assert breaker.is_open()
+        with pytest.raises(circuitbreaker.CircuitOpen):
+            breaker.call(mock.Mock())
+        return "ok"
+
+    assert breaker.call(probe) == "ok"
+    assert breaker.state == circuitbreaker.State.CLOSED
+
+
+def test_half_open_probe_failure_reopens(breaker, clock):
+    _trip(breaker)
+
+    clock.now += 30
+    with pytest.raises(requests.exceptions.Timeout):
+        breaker.call(mock.Mock(side_effect=requests.exceptions.Timeout()))
+
+    assert breaker.state == circuitbreaker.State.OPEN
+    assert breaker.is_open()
+
+    clock.now += 30
+    assert not breaker.is_open()
+
+
+def test_breaker_client(breaker):
+    client = mock.create_autospec(nexmo.Client, instance=True)
+    client.session = mock.sentinel.session
+    client.send_message.side_effect = nexmo.ServerError("500")
+    wrapped = circuitbreaker.BreakerClient(client, breaker)
+
+    assert wrapped.session is mock.sentinel.session
+
+    threshold = breaker.failure_threshold
+    for _ in range(threshold):
+        with pytest.raises(nexmo.ServerError):
+            wrapped.send_message({"to": "1234"})
+
+    with pytest.raises(circuitbreaker.CircuitOpen):
+        wrapped.send_message({"to": "1234"})
+
+    assert client.send_message.call_count == threshold
+
+
+def test_async_client(breaker):
+    transport = mock.Mock(return_value=httpx.Response(500))
+    client = asyncclient.AsyncClient(
+        key="key",
+        secret="secret",
+        transport=httpx.MockTransport(transport),
+        breaker=breaker,
+    )
+
+    threshold = breaker.failure_threshold
+    for _ in range(threshold):
+        with pytest.raises(nexmo.ServerError):
+            asyncio.run(client.send_message({"to": "1234"}))
+
+    with pytest.raises(circuitbreaker.CircuitOpen):
+        asyncio.run(client.send_message({"to": "1234"}))
+
+    assert transport.call_count == threshold
+
+
+def test_async_client_connection_errors_count(breaker):
+    def refuse(request):
+        raise httpx.ConnectError("Connection refused", request=request)
+
+    client = asyncclient.AsyncClient(
+        key="key",
+        secret="secret",
+        transport=httpx.MockTransport(refuse),
+        breaker=breaker,
+    )
+
+    for _ in range(breaker.failure_threshold):
+        with pytest.raises(httpx.ConnectError):
+            asyncio.run(client.send_message({"to": "1234"}))
+
+    assert breaker.is_open()
+
+
+def test_make_async_client_uses_breaker():
+    injector.set("secrets.nexmo.api_key", "key")
+    injector.set("secrets.nexmo.api_secret", "secret")
+    injector.set("secrets.nexmo.application_id", "appid")
+    injector.set("secrets.nexmo.private_key_location", None)
+
+    client = injector.get("nexmo.async_client")
+
+    assert client._breaker is circuitbreaker.nexmo_breaker()
+
+
+def test_make_client_uses_breaker():
+    injector.set("secrets.nexmo.api_key", "key")
+    injector.set("secrets.nexmo.api_secret", "secret")
+    injector.set("secrets.nexmo.application_id", "appid")
+    injector.set("secrets.nexmo.private_key_location", None)
+
+    client = injector.get("nexmo.client")
+
+    assert isinstance(client, circuitbreaker.BreakerClient)
+    assert client.application_id == "appid"
+
+
+def _open_nexmo_breaker():
+    _trip(circuitbreaker.nexmo_breaker())
+
+
+def test_inbound_call_falls_back_when_open(database):
+    nexmo_client = mock.create_autospec(nexmo.Client)
+    event = helpers.create_event()
+    helpers.add_members(event)
+
+    _open_nexmo_breaker()
+
+    ncco = voice.handle_inbound_call(
+        reporter_number="101",
+        event_number="+5678",
+        conversation_uuid="conversation",
+        call_uuid="call",
+        host="example.com",
+        client=nexmo_client,
+    )
+
+    assert ncco == [{"action": "talk", "text": common_text.voice_unavailable}]
+    nexmo_client.create_call.assert_not_called()
+
+
+def _breaker_client():
+    client = mock.create_autospec(nexmo.Client, instance=True)
+    client.send_message.return_value = {"messages": [{"message-id": "abc"}]}
+    injector.set(
+        "nexmo.client",
+        circuitbreaker.BreakerClient(client, circuitbreaker.nexmo_breaker()),
+    )
+    injector.set("secrets.sms_rate_limit.per_second", 1000)
+    return client
+
+
+def test_send_sms_fails_fast_when_open(database):
+    client = _breaker_client()
+
+    _open_nexmo_breaker()
+
+    # There's no outbox worker to send it later, so don't queue it.
+    with pytest.raises(circuitbreaker.CircuitOpen):
+        outbox.send_sms("5678", "1234", "meep")
+
+    client.send_message.assert_not_called()
+    assert models.OutboundMessage.select().count() == 0
+
+
+def test_outbox_waits_for_breaker(database):
+    client = _breaker_client()
+    injector.set("secrets.outbox.enabled", True)
+
+    _open_nexmo_breaker()
+
+    outbox.send_sms("5678", "1234", "meep")
+
+    client.send_message.assert_not_called()
+    assert models.OutboundMessage.get().to == "1234"
+
+    # The outbox waits for the breaker to let a probe through.
+    assert outbox.drain() == 0
+
+    circuitbreaker.nexmo_breaker().reset_timeout = 0
+
+    assert outbox.drain() == 1
+    client.send_message.assert_called_once()
@@ -0,0 +1,142 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+from unittest import mock
+
+import flask
+import hotline.csrf
+import pytest
+from hotline import injector
+from hotline.database import models
+from hotline.telephony import dedupe, webhandlers
+
+
+@pytest.fixture
+def app(database):
+    # Requests open their own connection.
+    database.db.close()
+
+    app = flask.Flask(__name__)
+    hotline.csrf.init_app(app)
+    app.register_blueprint(webhandlers.blueprint)
+    return app
+
+
+def test_handle_once(database):
+    handler = mock.Mock(return_value=[{"action": "talk", "text": "Hi"}])
+
+    first = dedupe.handle_once("call:1", handler)
+    second = dedupe.handle_once("call:1", handler)
+
+    assert first == second == [{"action": "talk", "text": "Hi"}]
+    handler.assert_called_once()
+
+    dedupe.handle_once("call:2", handler)
+    assert handler.call_count == 2
+
+
+def test_handle_once_in_flight(database):
+    dedupe.claim("call:1")
+
+    handler = mock.Mock()
+    response = dedupe.handle_once("call:1", handler, in_flight=lambda: "hold")
+
+    assert response == "hold"
+    handler.assert_not_called()
+
+
+def test_handle_once_stuck_in_flight(database):
+    dedupe.claim("call:1")
+    models.WebhookReceipt.update(
+        created=datetime.datetime.utcnow() - dedupe.IN_FLIGHT_TIMEOUT * 2
+    ).execute()
+
+    handler = mock.Mock(return_value="handled")
+
+    assert dedupe.handle_once("call:1", handler) == "handled"
+
+
+def test_handle_once_failure_allows_retry(database):
+    handler = mock.Mock(side_effect=[RuntimeError(), "handled"])
+
+    with pytest.raises(RuntimeError):
+        dedupe.handle_once("call:1", handler)
+
+    assert dedupe.handle_once("call:1", handler) == "handled"
+
+
+def test_handle_once_without_key(database):
+    handler = mock.Mock(return_value=None)
+
+    dedupe.handle_once(None, handler)
+    dedupe.handle_once(None, handler)
+
+    assert handler.call_count == 2
+
+
+def test_purge_expired(database):
+    injector.set("secrets.webhook_dedupe.ttl", 60)
+
+    dedupe.handle_once("call:1", lambda: None)
+    dedupe.handle_once("call:2", lambda: None)
+    models.WebhookReceipt.update(
+        created=datetime.datetime.utcnow() - datetime.timedelta(seconds=61)
+    ).where(models.WebhookReceipt.key == "call:1").execute()
+
+    assert dedupe.purge_expired() == 1
+    assert [receipt.key for receipt in models.WebhookReceipt.select()] == ["call:2"]
+
+
+def test_inbound_call_retries_are_deduplicated(app):
+    injector.set("nexmo.client", lambda: mock.Mock())
+    call = {
+        "to": "15035550000",
+        "from": "15035550001",
+        "uuid": "call",
+        "conversation_uuid": "conversation",
+    }
+    ncco = [{"action": "talk", "text": "Hello"}]
+
+    with mock.patch(
+        "hotline.telephony.voice.handle_inbound_call",
+        autospec=True,
+        return_value=ncco,
+    ) as handle_inbound_call:
+        client = app.test_client()
+        first = client.post("/telephony/inbound-call", json=call)
+        second = client.post("/telephony/inbound-call", json=call)
+
+    assert first.get_json() == second.get_json() == ncco
+    handle_inbound_call.assert_called_once()
+
+
+def test_inbound_sms_retries_are_deduplicated(app):
+    message = {
+        "msisdn": "15035550001",
+        "to": "15035550000",
+        "messageId": "message",
+        "text": "yes",
+    }
+
+    with mock.patch(
+        "hotline.telephony.verification.maybe_handle_verification",
+        autospec=True,
+        return_value=True,
+    ) as maybe_handle_verification:
+        client = app.test_client()
+        assert client.post("/telephony/inbound-sms", json=message).status_code == 204
+        assert client.post("/telephony/inbound-sms", json=message).status_code == 204
+
+    maybe_handle_verification.assert_called_once()
@@ -0,0 +1,118 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+import threading
+import time
+
+import nexmo
+import pytest
+from hotline import injector
+from hotline.telephony import fakenexmo, lowlevel
+
+
+@pytest.fixture
+def fake():
+    return fakenexmo.FakeNexmo(seed=1234)
+
+
+@pytest.fixture
+def client(fake, database):
+    server = fakenexmo.make_server(fake)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    host, port = server.server_address
+    injector.set("secrets.nexmo.api_key", "key")
+    injector.set("secrets.nexmo.api_secret", "secret")
+    injector.set("secrets.nexmo.application_id", "appid")
+    injector.set("secrets.nexmo.private_key_location", None)
+    injector.set("secrets.nexmo.base_url", f"http://{host}:{port}")
+    injector.set("secrets.sms_rate_limit.per_second", 1000)
+
+    yield injector.get("nexmo.client")
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_parse_latency():
+    rng = random.Random(1234)
+
+    assert fakenexmo.parse_latency("constant:0.05")(rng) == 0.05
+    assert 0.01 <= fakenexmo.parse_latency("uniform:0.01,0.2")(rng) <= 0.2
+    assert fakenexmo.parse_latency("lognormal:0.05,0.5")(rng) > 0
+
+    with pytest.raises(ValueError):
+        fakenexmo.parse_latency("gaussian:1")
+
+
+def test_send_sms_over_http(fake, client):
+    response = lowlevel.send_sms_once("5678", "1234", "meep")
+
+    assert response["messages"][0]["message-id"]
+
+    request = fake.requests_to("/sms/json")[0]
+    assert request.method == "POST"
+    assert request.params["from"] == "5678"
+    assert request.params["text"] == "meep"
+    assert request.outcome == "ok"
+
+
+def test_get_account_numbers_over_http(fake, client):
+    fake.account_numbers.append({"country": "US", "msisdn": "15035550000"})
+
+    response = client.get_account_numbers(size=10)
+
+    assert response["numbers"][0]["msisdn"] == "15035550000"
+
+
+def test_throttled(fake, client):
+    fake.throttle_rate = 1
+
+    with pytest.raises(nexmo.ClientError, match="Throughput Rate Exceeded") as error:
+        lowlevel.send_sms_once("5678", "1234", "meep")
+
+    # send_sms retries these.
+    assert lowlevel._send_sms_retry_predicate(error.value)
+    assert len(fake.requests_to("/sms/json", outcome="throttled")) == 1
+
+    with pytest.raises(nexmo.ClientError, match="Too Many Requests"):
+        client.get_account_numbers(size=10)
+
+
+def test_failed_messages(fake, client):
+    fake.failure_rate = 0.5
+
+    outcomes = []
+
+    for _ in range(50):
+        try:
+            lowlevel.send_sms_once("5678", "1234", "meep")
+            outcomes.append("ok")
+        except nexmo.ClientError as error:
+            assert str(error) == fakenexmo.FAILED_ERROR_TEXT
+            outcomes.append("failed")
+
+    assert 0 < outcomes.count("failed") < 50
+    assert [request.outcome for request in fake.requests_to("/sms/json")] == outcomes
+
+
+def test_latency(fake, client):
+    fake.latency = fakenexmo.constant(0.1)
+
+    start = time.monotonic()
+    lowlevel.send_sms_once("5678", "1234", "meep")
+
+    assert time.monotonic() - start >= 0.1
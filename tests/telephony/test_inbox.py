@@ -0,0 +1,138 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import threading
+from unittest import mock
+
+import flask
+import hotline.csrf
+import pytest
+from hotline import injector
+from hotline.database import models
+from hotline.telephony import inbox, webhandlers
+
+
+@pytest.fixture
+def handled(monkeypatch):
+    handled = []
+    lock = threading.Lock()
+
+    def maybe_handle_verification(sender, text):
+        with lock:
+            handled.append((sender, text))
+
+    monkeypatch.setattr(
+        inbox.verification, "maybe_handle_verification", maybe_handle_verification
+    )
+
+    return handled
+
+
+def test_enqueue_ignores_duplicates(database):
+    inbox.enqueue("abc", "101", "5678", "yes")
+    inbox.enqueue("abc", "101", "5678", "yes")
+    inbox.enqueue(None, "101", "5678", "yes")
+
+    assert models.InboundMessage.select().count() == 2
+
+
+def test_drain_keeps_each_senders_order(database, handled):
+    for n in range(5):
+        for sender in ("101", "202", "303"):
+            inbox.enqueue(f"{sender}-{n}", sender, "5678", f"{n}")
+
+    assert inbox.drain(workers=4) == 15
+
+    for sender in ("101", "202", "303"):
+        texts = [text for number, text in handled if number == sender]
+        assert texts == ["0", "1", "2", "3", "4"]
+
+    for message in models.InboundMessage.select():
+        assert message.state == inbox.State.PROCESSED
+        assert message.attempts == 1
+
+    # Nothing is left to process.
+    assert inbox.drain() == 0
+
+
+def test_drain_backs_off_on_failure(database, monkeypatch):
+    injector.set("secrets.inbox.max_attempts", 2)
+    handler = mock.Mock(side_effect=RuntimeError("Nope"))
+    monkeypatch.setattr(inbox.verification, "maybe_handle_verification", handler)
+
+    inbox.enqueue("abc", "101", "5678", "yes")
+    inbox.enqueue("def", "101", "5678", "no")
+
+    assert inbox.drain() == 1
+
+    message = models.InboundMessage.get(models.InboundMessage.message_id == "abc")
+    assert message.state == inbox.State.PENDING
+    assert message.error == "Nope"
+    assert message.next_attempt > datetime.datetime.utcnow()
+
+    # It isn't due again yet, and the sender's next message waits behind it.
+    assert inbox.drain() == 0
+
+    message.next_attempt = datetime.datetime.utcnow()
+    message.save()
+
+    assert inbox.drain() == 2
+
+    message = models.InboundMessage.get(models.InboundMessage.message_id == "abc")
+    assert message.state == inbox.State.FAILED
+    assert message.attempts == 2
+    assert handler.call_args_list == [
+        mock.call("101", "yes"),
+        mock.call("101", "yes"),
+        mock.call("101", "no"),
+    ]
+
+
+def test_drain_reclaims_abandoned_messages(database, handled):
+    inbox.enqueue("abc", "101", "5678", "yes")
+    models.InboundMessage.update(state=inbox.State.PROCESSING).execute()
+
+    assert inbox.drain() == 1
+    assert models.InboundMessage.get().state == inbox.State.PROCESSED
+
+
+def test_inbound_sms_webhook_queues(database, handled):
+    injector.set("secrets.inbox.enabled", True)
+
+    database.db.close()
+    app = flask.Flask(__name__)
+    hotline.csrf.init_app(app)
+    app.register_blueprint(webhandlers.blueprint)
+
+    message = {
+        "msisdn": "15035550001",
+        "to": "15035550002",
+        "text": "yes",
+        "messageId": "abc",
+    }
+
+    with app.test_client() as client:
+        for _ in range(2):
+            response = client.post("/telephony/inbound-sms", json=message)
+            assert response.status_code == 204
+
+    database.db.connect(reuse_if_open=True)
+
+    assert handled == []
+    assert models.InboundMessage.select().count() == 1
+
+    inbox.drain()
+
+    assert handled == [("+15035550001", "yes")]
@@ -0,0 +1,106 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+from unittest import mock
+
+import nexmo
+import pytest
+from hotline import background, injector
+from hotline.database import models
+from hotline.telephony import fakenexmo, inventory, lowlevel
+
+
+@pytest.fixture
+def fake():
+    fake = fakenexmo.FakeNexmo()
+
+    for n in range(250):
+        fake.account_numbers.append(
+            {
+                "country": "US",
+                "msisdn": f"1503555{n:04d}",
+                "type": "mobile-lvn",
+                "features": ["SMS", "VOICE"],
+                "voiceCallbackType": "app",
+                "voiceCallbackValue": "appid",
+            }
+        )
+
+    return fake
+
+
+@pytest.fixture
+def client(fake):
+    client = mock.create_autospec(nexmo.Client)
+
+    def get_account_numbers(params=None, **kwargs):
+        status, body = fake.handle("GET", "/account/numbers", params or kwargs)
+        return body
+
+    client.get_account_numbers.side_effect = get_account_numbers
+    injector.set("nexmo.client", lambda: client)
+
+    return client
+
+
+def test_get_all_account_numbers(fake, client):
+    numbers = lowlevel.get_all_account_numbers(client=client)
+
+    assert len(numbers) == 250
+    assert numbers[0]["msisdn"] == "+15035550000"
+    assert numbers[-1]["msisdn"] == "+15035550249"
+    # One request per page of 100.
+    assert client.get_account_numbers.call_count == 3
+
+
+def test_refresh(database, fake, client):
+    models.NexmoNumber.create(msisdn="+15035559999")
+
+    assert inventory.refresh() == 250
+
+    # Numbers no longer in the account are removed.
+    assert inventory.get_number_info("+15035559999") is None
+
+    info = inventory.get_number_info("+15035550042")
+    assert info.country == "US"
+    assert info.features == "SMS,VOICE"
+    assert info.voice_callback_type == "app"
+    assert info.voice_callback_value == "appid"
+
+
+def test_is_stale(database, fake, client):
+    injector.set("secrets.nexmo.inventory_ttl", 60)
+
+    assert inventory.last_refreshed() is None
+    assert inventory.is_stale()
+
+    inventory.refresh()
+    assert not inventory.is_stale()
+
+    models.NexmoNumber.update(
+        fetched=datetime.datetime.utcnow() - datetime.timedelta(seconds=61)
+    ).execute()
+    assert inventory.is_stale()
+
+
+def test_refresh_if_stale(database, fake, client):
+    assert inventory.refresh_if_stale()
+    background.wait()
+
+    assert models.NexmoNumber.select().count() == 250
+    calls = client.get_account_numbers.call_count
+
+    assert not inventory.refresh_if_stale()
+    assert client.get_account_numbers.call_count == calls
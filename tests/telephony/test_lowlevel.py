@@ -12,10 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import http.server
+import threading
 from unittest import mock
 
 import nexmo
+import phonenumbers
 import pytest
+import requests
 from hotline.telephony import lowlevel
 
 
@@ -77,7 +81,7 @@ def test_rent_number_buy_error_is_okay():
 
 
 @mock.patch("time.sleep", autospec=True)
-def test_send_sms(sleep):
+def test_send_sms(sleep, database):
     client = mock.create_autospec(nexmo.Client)
     client.application_id = "appid"
 
@@ -88,3 +92,224 @@ def test_send_sms(sleep):
     client.send_message.assert_called_once_with(
         {"from": "5678", "to": "1234", "text": "meep"}
     )
+
+
+class _KeepAliveHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def http_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_make_client_uses_pooled_session():
+    client = lowlevel._make_client(
+        api_key="key",
+        api_secret="secret",
+        private_key_location=None,
+        application_id="appid",
+    )
+
+    adapter = client.session.get_adapter("https://rest.nexmo.com")
+    assert adapter._pool_maxsize == lowlevel.DEFAULT_HTTP_POOL_SIZE
+    assert client.session.timeout == (
+        lowlevel.DEFAULT_HTTP_CONNECT_TIMEOUT,
+        lowlevel.DEFAULT_HTTP_READ_TIMEOUT,
+    )
+
+
+def test_http_session_default_timeout():
+    session = lowlevel._make_http_session(
+        pool_size=2, connect_timeout=1.0, read_timeout=2.0, retries=0
+    )
+
+    with mock.patch.object(requests.Session, "request", autospec=True) as request:
+        session.get("https://example.com")
+        session.get("https://example.com", timeout=5)
+
+    assert request.call_args_list[0][1]["timeout"] == (1.0, 2.0)
+    assert request.call_args_list[1][1]["timeout"] == 5
+
+
+def test_http_pool_stats_show_connection_reuse(http_server):
+    client = nexmo.Client(key="key", secret="secret")
+    client.session = lowlevel._make_http_session(
+        pool_size=2, connect_timeout=1.0, read_timeout=2.0, retries=0
+    )
+
+    for _ in range(5):
+        client.session.get(http_server).raise_for_status()
+
+    stats = lowlevel.get_http_pool_stats(client=client)
+
+    assert len(stats) == 1
+    assert stats[0]["requests"] == 5
+    assert stats[0]["connections"] == 1
+    assert stats[0]["idle"] == 1
+    assert stats[0]["size"] == 2
+
+
+@pytest.mark.parametrize(
+    ["value", "expected"],
+    [
+        ("+15035551234", "+15035551234"),
+        ("(503) 555-1234", "+15035551234"),
+        ("+44 7700 900123", "+447700900123"),
+        # Trunk prefixes must still be stripped by the parser.
+        ("+4407700900123", "+447700900123"),
+    ],
+)
+def test_normalize_number(value, expected):
+    assert lowlevel.normalize_number(value) == expected
+
+
+@pytest.mark.parametrize(
+    ["value", "expected"],
+    [
+        ("15035551234", "+15035551234"),
+        ("447700900123", "+447700900123"),
+        ("4407700900123", "+447700900123"),
+        ("390612345678", "+390612345678"),
+    ],
+)
+def test_normalize_e164_number(value, expected):
+    assert lowlevel.normalize_e164_number(value) == expected
+
+
+def test_canonical_e164_agrees_with_parser():
+    numbers = [
+        "15035551234",
+        "12125550000",
+        "447700900123",
+        "4407700900123",
+        "390612345678",
+        "61412345678",
+        "79161234567",
+        "8613812345678",
+        "4915123456789",
+        "3612345678",
+        "999123456789",
+        "1123",
+    ]
+
+    for number in numbers:
+        canonical = lowlevel._canonical_e164(number)
+        if canonical is None:
+            continue
+
+        parsed = phonenumbers.parse("+" + number, "US")
+        assert canonical == phonenumbers.format_number(
+            parsed, phonenumbers.PhoneNumberFormat.E164
+        )
+
+
+def test_normalize_number_caches_parses():
+    lowlevel.normalize_number.cache_clear()
+    lowlevel.pretty_print_number.cache_clear()
+
+    with mock.patch("phonenumbers.parse", wraps=phonenumbers.parse) as parse:
+        lowlevel.pretty_print_number("+15035551234")
+        lowlevel.pretty_print_number("+15035551234")
+        lowlevel.normalize_number("(503) 555-1234")
+        lowlevel.normalize_number("(503) 555-1234")
+
+    assert parse.call_count == 2
+
+
+def test_pretty_print_number():
+    assert lowlevel.pretty_print_number("+15035551234") == "+1 503-555-1234"
+
+
+def test_rent_numbers_buys_concurrently_and_skips_failures():
+    client = mock.create_autospec(nexmo.Client)
+    client.application_id = "appid"
+
+    client.get_available_numbers.return_value = {
+        "numbers": [
+            {"country": "US", "msisdn": "15035550001"},
+            {"country": "US", "msisdn": "15035550002"},
+            {"country": "US", "msisdn": "15035550003"},
+        ]
+    }
+
+    def buy_number(params):
+        if params["msisdn"] == "15035550001":
+            raise nexmo.ClientError("Number already bought")
+
+    client.buy_number.side_effect = buy_number
+
+    result = lowlevel.rent_numbers(
+        sms_callback_url="example.com/sms", count=2, client=client, workers=2
+    )
+
+    assert sorted(number["msisdn"] for number in result) == [
+        "+15035550002",
+        "+15035550003",
+    ]
+    client.get_available_numbers.assert_called_once()
+    # The first number couldn't be bought, so the next one was tried.
+    assert client.buy_number.call_count == 3
+    assert client.update_number.call_count == 2
+
+
+def test_rent_numbers_keeps_numbers_rented_before_an_error():
+    client = mock.create_autospec(nexmo.Client)
+    client.application_id = "appid"
+
+    client.get_available_numbers.return_value = {
+        "numbers": [
+            {"country": "US", "msisdn": "15035550001"},
+            {"country": "US", "msisdn": "15035550002"},
+            {"country": "US", "msisdn": "15035550003"},
+        ]
+    }
+
+    def buy_number(params):
+        if params["msisdn"] == "15035550001":
+            raise requests.exceptions.ReadTimeout()
+
+    client.buy_number.side_effect = buy_number
+
+    result = lowlevel.rent_numbers(
+        sms_callback_url="example.com/sms", count=2, client=client, workers=2
+    )
+
+    # The number bought alongside the failed one is still returned, and no
+    # more candidates are tried while Nexmo is having trouble.
+    assert [number["msisdn"] for number in result] == ["+15035550002"]
+    assert client.buy_number.call_count == 2
+    client.update_number.assert_called_once()
+
+
+def test_rent_numbers_not_enough_available():
+    client = mock.create_autospec(nexmo.Client)
+    client.application_id = "appid"
+
+    client.get_available_numbers.return_value = {
+        "numbers": [{"country": "US", "msisdn": "15035550001"}]
+    }
+
+    result = lowlevel.rent_numbers(
+        sms_callback_url="example.com/sms", count=3, client=client
+    )
+
+    assert [number["msisdn"] for number in result] == ["+15035550001"]
+    # Not enough SMS numbers, so VOICE-only numbers were searched as well.
+    assert client.get_available_numbers.call_count == 2
+    client.buy_number.assert_called_once()
@@ -0,0 +1,133 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+from unittest import mock
+
+import pytest
+from hotline import background, injector
+from hotline.database import highlevel as db
+from hotline.database import models
+from hotline.telephony import numberpool
+
+
+def _add_unused_numbers(country, count):
+    for n in range(count):
+        models.Number.create(number=f"+{n}", country=country, features="")
+
+
+@pytest.fixture
+def rent_numbers():
+    def fake_rent_numbers(sms_callback_url, count, country_code, workers):
+        return [
+            {
+                "country": country_code,
+                "msisdn": f"+1503555{n:04d}",
+                "features": ["SMS", "VOICE"],
+            }
+            for n in range(count)
+        ]
+
+    with mock.patch(
+        "hotline.telephony.lowlevel.rent_numbers",
+        autospec=True,
+        side_effect=fake_rent_numbers,
+    ) as rent_numbers:
+        yield rent_numbers
+
+
+def test_acquire_number_none_available(database):
+    event = models.Event.create(name="Test event", slug="test", country="US")
+
+    with pytest.raises(db.NoNumbersAvailable):
+        db.acquire_number(event)
+
+
+def test_acquire_number(database):
+    _add_unused_numbers("US", 1)
+    event = models.Event.create(name="Test event", slug="test", country="US")
+
+    assert db.acquire_number(event) == "+0"
+    assert db.count_unused_event_numbers("US") == 0
+
+
+def test_replenish(database, rent_numbers):
+    injector.set("secrets.number_pool.low_water_marks", {"US": 3})
+    injector.set("secrets.number_pool.headroom", 2)
+    _add_unused_numbers("US", 1)
+    _add_unused_numbers("GB", 5)
+
+    numbers = numberpool.replenish("US", "example.com/sms")
+
+    assert len(numbers) == 4
+    rent_numbers.assert_called_once_with(
+        sms_callback_url="example.com/sms", count=4, country_code="US", workers=4
+    )
+    assert db.count_unused_event_numbers("US") == 5
+    assert models.Number.get(models.Number.number == "+15035550000").features == (
+        "SMS,VOICE"
+    )
+
+
+def test_replenish_above_low_water_mark(database, rent_numbers):
+    injector.set("secrets.number_pool.low_water_marks", {"US": 3})
+    _add_unused_numbers("US", 3)
+
+    assert numberpool.replenish("US", "example.com/sms") == []
+    rent_numbers.assert_not_called()
+
+
+def test_replenish_while_another_process_is_renting(database, rent_numbers):
+    injector.set("secrets.number_pool.low_water_marks", {"US": 3})
+    models.NumberPoolLease.create(
+        country="US",
+        expires=datetime.datetime.utcnow() + datetime.timedelta(minutes=5),
+    )
+
+    assert numberpool.replenish("US", "example.com/sms") == []
+    rent_numbers.assert_not_called()
+
+
+def test_replenish_takes_over_expired_lease(database, rent_numbers):
+    injector.set("secrets.number_pool.low_water_marks", {"US": 3})
+    injector.set("secrets.number_pool.headroom", 0)
+    models.NumberPoolLease.create(
+        country="US",
+        expires=datetime.datetime.utcnow() - datetime.timedelta(minutes=1),
+    )
+
+    assert len(numberpool.replenish("US", "example.com/sms")) == 3
+
+    # The lease is released once it's done.
+    lease = models.NumberPoolLease.get(models.NumberPoolLease.country == "US")
+    assert lease.expires <= datetime.datetime.utcnow()
+
+
+def test_maybe_replenish_in_background(database, rent_numbers):
+    injector.set("secrets.number_pool.low_water_marks", {"US": 2})
+    injector.set("secrets.number_pool.headroom", 0)
+
+    assert numberpool.maybe_replenish("US", "example.com/sms")
+    background.wait()
+
+    assert db.count_unused_event_numbers("US") == 2
+    # Now that the pool is full, nothing else should happen.
+    assert not numberpool.maybe_replenish("US", "example.com/sms")
+
+
+def test_maybe_replenish_unconfigured_country(database, rent_numbers):
+    injector.set("secrets.number_pool.low_water_marks", {"US": 2})
+
+    assert not numberpool.maybe_replenish("GB", "example.com/sms")
+    rent_numbers.assert_not_called()
@@ -0,0 +1,188 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+from unittest import mock
+
+import nexmo
+import pytest
+from hotline import injector
+from hotline.database import highlevel as db
+from hotline.database import models
+from hotline.telephony import circuitbreaker, outbox, verification
+from tests.telephony import helpers
+
+
+@pytest.fixture
+def client():
+    client = mock.create_autospec(nexmo.Client, instance=True)
+    client.application_id = "appid"
+    client.send_message.return_value = {"messages": [{"message-id": "abc"}]}
+    injector.set("nexmo.client", client)
+    injector.set("secrets.virtual_number", "1234567890")
+    injector.set("secrets.sms_rate_limit.per_second", 1000)
+    return client
+
+
+def test_send_sms_disabled_sends_immediately(database, client):
+    outbox.send_sms("5678", "1234", "meep")
+
+    client.send_message.assert_called_once_with(
+        {"from": "5678", "to": "1234", "text": "meep"}
+    )
+    assert models.OutboundMessage.select().count() == 0
+
+
+def test_send_sms_enabled_queues(database, client):
+    injector.set("secrets.outbox.enabled", True)
+
+    outbox.send_sms("5678", "1234", "meep")
+
+    client.send_message.assert_not_called()
+    message = models.OutboundMessage.get()
+    assert message.to == "1234"
+    assert message.state == outbox.State.PENDING
+
+
+def test_drain(database, client):
+    for n in range(20):
+        outbox.enqueue_sms("5678", f"{n}", "meep")
+
+    assert outbox.drain(workers=4, batch_size=7) == 20
+
+    assert client.send_message.call_count == 20
+    for message in models.OutboundMessage.select():
+        assert message.state == outbox.State.SENT
+        assert message.attempts == 1
+        assert message.nexmo_message_id == "abc"
+
+    # Nothing is left to send.
+    assert outbox.drain() == 0
+
+
+def test_drain_backs_off_on_failure(database, client):
+    injector.set("secrets.outbox.max_attempts", 2)
+    client.send_message.return_value = {"messages": [{"error-text": "Nope"}]}
+
+    outbox.enqueue_sms("5678", "1234", "meep")
+
+    assert outbox.drain() == 1
+
+    message = models.OutboundMessage.get()
+    assert message.state == outbox.State.PENDING
+    assert message.error == "Nope"
+    assert message.next_attempt > datetime.datetime.utcnow()
+
+    # It isn't due again yet.
+    assert outbox.drain() == 0
+
+    message.next_attempt = datetime.datetime.utcnow()
+    message.save()
+
+    assert outbox.drain() == 1
+
+    message = models.OutboundMessage.get()
+    assert message.state == outbox.State.FAILED
+    assert message.attempts == 2
+
+
+def test_drain_reclaims_abandoned_messages(database, client):
+    message = outbox.enqueue_sms("5678", "1234", "meep")
+    message.state = outbox.State.SENDING
+    message.save()
+
+    assert outbox.drain() == 1
+    assert models.OutboundMessage.get().state == outbox.State.SENT
+
+
+def _open_nexmo_breaker():
+    breaker = circuitbreaker.nexmo_breaker()
+
+    for _ in range(breaker.failure_threshold):
+        with pytest.raises(nexmo.ServerError):
+            breaker.call(mock.Mock(side_effect=nexmo.ServerError("500")))
+
+
+def test_drain_requeues_when_circuit_open(database, client):
+    client.send_message.side_effect = circuitbreaker.CircuitOpen()
+
+    outbox.enqueue_sms("5678", "1234", "meep")
+
+    assert outbox.drain() == 1
+
+    # The attempt is handed back and the message waits for Nexmo to recover.
+    message = models.OutboundMessage.get()
+    assert message.state == outbox.State.PENDING
+    assert message.attempts == 0
+    assert message.error is None
+    assert message.next_attempt > datetime.datetime.utcnow()
+
+
+def test_drain_stops_while_circuit_open(database, client):
+    def send_and_open(params):
+        _open_nexmo_breaker()
+        return {"messages": [{"message-id": "abc"}]}
+
+    client.send_message.side_effect = send_and_open
+
+    for n in range(3):
+        outbox.enqueue_sms("5678", f"{n}", "meep")
+
+    # The breaker opens during the first batch, so the rest stay queued.
+    assert outbox.drain(workers=1, batch_size=1) == 1
+    client.send_message.assert_called_once()
+
+    messages = models.OutboundMessage.select().order_by(models.OutboundMessage.id)
+    states = [message.state for message in messages]
+    assert states == [outbox.State.SENT, outbox.State.PENDING, outbox.State.PENDING]
+
+    assert outbox.drain() == 0
+    client.send_message.assert_called_once()
+
+
+def test_verification_uses_outbox(database, client):
+    injector.set("secrets.outbox.enabled", True)
+
+    event = helpers.create_event()
+    member = helpers.add_unverfied_members(event)
+
+    verification.start_member_verification(member)
+
+    client.send_message.assert_not_called()
+    assert models.OutboundMessage.get().to == member.number
+
+    outbox.drain()
+
+    client.send_message.assert_called_once_with(
+        {"from": "5678", "to": member.number, "text": mock.ANY}
+    )
+
+
+def test_start_member_verifications_uses_outbox(database, client):
+    injector.set("secrets.outbox.enabled", True)
+
+    event = helpers.create_event()
+    members = db.add_event_members(
+        event, [(f"Member {n}", f"+1503555{n:04d}") for n in range(10)]
+    )
+
+    verification.start_member_verifications(members)
+
+    client.send_message.assert_not_called()
+    assert [message.to for message in models.OutboundMessage.select()] == [
+        member.number for member in members
+    ]
+
+    assert outbox.drain() == 10
+    assert client.send_message.call_count == 10
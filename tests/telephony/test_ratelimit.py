@@ -0,0 +1,67 @@
+# Copyright 2019 Alethea Katherine Flowers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import mock
+
+import pytest
+from hotline import injector
+from hotline.telephony import ratelimit
+
+
+@pytest.fixture
+def now():
+    with mock.patch.object(ratelimit, "_now_us", autospec=True) as now:
+        now.return_value = 1000000000
+        yield now
+
+
+def test_reserve_spaces_out_sends(database, now):
+    injector.set("secrets.sms_rate_limit.per_second", 2)
+    injector.set("secrets.sms_rate_limit.burst", 1)
+
+    assert ratelimit.reserve("5678") == 0
+    assert ratelimit.reserve("5678") == pytest.approx(0.5)
+    assert ratelimit.reserve("5678") == pytest.approx(1.0)
+
+    # Once time has passed, sends are allowed straight away again.
+    now.return_value += 10 * 1000000
+    assert ratelimit.reserve("5678") == 0
+
+
+def test_reserve_burst(database, now):
+    injector.set("secrets.sms_rate_limit.per_second", 1)
+    injector.set("secrets.sms_rate_limit.burst", 3)
+
+    assert [ratelimit.reserve("5678") for _ in range(4)] == [0, 0, 0, 1.0]
+
+
+def test_reserve_is_per_sender(database, now):
+    injector.set("secrets.sms_rate_limit.per_second", 1)
+    injector.set("secrets.sms_rate_limit.burst", 1)
+
+    assert ratelimit.reserve("5678") == 0
+    assert ratelimit.reserve("1234") == 0
+    assert ratelimit.reserve("5678") == 1.0
+
+
+@mock.patch("time.sleep", autospec=True)
+def test_acquire_waits(sleep, database, now):
+    injector.set("secrets.sms_rate_limit.per_second", 4)
+    injector.set("secrets.sms_rate_limit.burst", 1)
+
+    assert ratelimit.acquire("5678") == 0
+    sleep.assert_not_called()
+
+    assert ratelimit.acquire("5678") == 0.25
+    sleep.assert_called_once_with(0.25)
@@ -2,8 +2,9 @@ from unittest import mock
 
 import nexmo
 import pytest
-from hotline import injector
+from hotline import background, injector
 from hotline.database import highlevel as db
+from hotline.database import pending
 from hotline.telephony import verification
 from tests.telephony import helpers
 
@@ -111,3 +112,67 @@ def test_handle_verification_negative_message(sleep, database):
         assert not member.verified
 
         client.send_message.assert_not_called()
+
+
+def test_start_member_verifications(database):
+    client = mock.create_autospec(nexmo.Client, instance=True)
+    client.application_id = "appid"
+    client.send_message.return_value = {"messages": [{"error-text": ""}]}
+
+    injector.set("nexmo.client", client)
+    injector.set("secrets.virtual_number", "1234567890")
+    injector.set("secrets.sms_rate_limit.per_second", 1000)
+
+    event = helpers.create_event()
+    members = db.add_event_members(
+        event, [(f"Member {n}", f"+1503555{n:04d}") for n in range(10)]
+    )
+
+    verification.start_member_verifications(members)
+    background.wait(timeout=10)
+
+    assert client.send_message.call_count == 10
+    assert {call[0][0]["to"] for call in client.send_message.call_args_list} == {
+        member.number for member in members
+    }
+
+
+def test_handle_verification_skips_lookup_for_other_numbers(database):
+    event = helpers.create_event()
+    helpers.add_unverfied_members(event)
+
+    # Loads the pending numbers.
+    assert not verification.maybe_handle_verification("101", "hello")
+
+    with mock.patch.object(
+        db, "find_pending_member_by_number", autospec=True
+    ) as find_pending_member_by_number:
+        assert not verification.maybe_handle_verification("101", "I need help")
+
+    find_pending_member_by_number.assert_not_called()
+
+
+@mock.patch("time.sleep", autospec=True)
+def test_handle_verification_updates_pending_numbers(sleep, database):
+    client = mock.create_autospec(nexmo.Client, instance=True)
+    client.application_id = "appid"
+    client.send_message.return_value = {"messages": [{"error-text": ""}]}
+
+    injector.set("nexmo.client", client)
+    injector.set("secrets.virtual_number", "1234567890")
+
+    event = helpers.create_event()
+    assert not pending.might_be_pending("303")
+
+    # Added without telling this process, like another process would. The
+    # confirmation is still handled.
+    member = helpers.add_unverfied_members(event)
+    assert verification.maybe_handle_verification(member.number, "yes")
+    assert db.get_member_by_number(member.number).verified
+    assert not pending.might_be_pending(member.number)
+
+    member = db.add_event_members(event, [("Alice", "+15035550100")])[0]
+    assert pending.might_be_pending(member.number)
+
+    verification.manually_verify(member)
+    assert not pending.might_be_pending(member.number)
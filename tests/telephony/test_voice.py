@@ -16,7 +16,10 @@ from unittest import mock
 
 import nexmo
 import pytest
-from hotline.telephony import voice
+import requests
+from hotline import background, common_text, injector
+from hotline.database import models
+from hotline.telephony import verification, voice
 from tests.telephony import helpers
 
 
@@ -125,7 +128,7 @@ def test_handle_inbound_call(database):
     # member of the hotline, excluding the original caller.
     assert nexmo_client.create_call.call_count == 1
 
-    calls_created = [call[1][0] for call in nexmo_client.create_call.mock_calls]
+    calls_created = [call[0][0] for call in nexmo_client.create_call.call_args_list]
 
     assert calls_created[0]["to"] == [{"type": "phone", "number": "202"}]
     assert calls_created[0]["from"] == {"type": "phone", "number": "5678"}
@@ -198,3 +201,411 @@ def test_handle_member_answer(database):
 
     # The conference call should have been notified that the member is joining.
     nexmo_client.send_speech.assert_called_once_with("call", text=mock.ANY)
+
+
+def test_handle_inbound_call_calls_all_members(database):
+    event = helpers.create_event()
+    caller = helpers.add_member(event=event, name="Caller", number="100")
+
+    for n in range(20):
+        helpers.add_member(event=event, name=f"Member {n}", number=f"2{n:02d}")
+
+    nexmo_client = mock.create_autospec(nexmo.Client)
+
+    ncco = voice.handle_inbound_call(
+        reporter_number=caller.number,
+        event_number="+5678",
+        conversation_uuid="conversation",
+        call_uuid="call",
+        host="example.com",
+        client=nexmo_client,
+    )
+
+    assert ncco[1]["action"] == "conversation"
+    assert nexmo_client.create_call.call_count == 20
+
+    numbers_called = {
+        call[0][0]["to"][0]["number"]
+        for call in nexmo_client.create_call.call_args_list
+    }
+    assert numbers_called == {f"2{n:02d}" for n in range(20)}
+
+
+def test_handle_inbound_call_some_calls_fail(database):
+    hotline = helpers.create_event()
+    members = helpers.add_members(hotline)
+    helpers.add_member(event=hotline, name="Carol", number="303")
+    caller = members[0]
+
+    nexmo_client = mock.create_autospec(nexmo.Client)
+
+    def create_call(params):
+        if params["to"][0]["number"] == "202":
+            raise nexmo.ServerError("Oh no")
+        return {"uuid": "leg"}
+
+    nexmo_client.create_call.side_effect = create_call
+
+    ncco = voice.handle_inbound_call(
+        reporter_number=caller.number,
+        event_number="+5678",
+        conversation_uuid="conversation",
+        call_uuid="call",
+        host="example.com",
+        client=nexmo_client,
+    )
+
+    # One member couldn't be called, but the other one could, so the caller
+    # should still be put into the conference.
+    assert len(ncco) == 2
+    assert ncco[1]["action"] == "conversation"
+    assert nexmo_client.create_call.call_count == 2
+
+
+def test_handle_inbound_call_all_calls_fail(database):
+    hotline = helpers.create_event()
+    members = helpers.add_members(hotline)
+    caller = members[0]
+
+    nexmo_client = mock.create_autospec(nexmo.Client)
+    nexmo_client.create_call.side_effect = nexmo.ServerError("Oh no")
+
+    ncco = voice.handle_inbound_call(
+        reporter_number=caller.number,
+        event_number="+5678",
+        conversation_uuid="conversation",
+        call_uuid="call",
+        host="example.com",
+        client=nexmo_client,
+    )
+
+    assert len(ncco) == 1
+    assert "weren't able to reach" in ncco[0]["text"]
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_dial_members(database, workers):
+    injector.set("secrets.voice.fan_out_workers", workers)
+    event = helpers.create_event()
+    members = helpers.add_members(event)
+
+    nexmo_client = mock.create_autospec(nexmo.Client)
+    nexmo_client.create_call.side_effect = [{"uuid": "one"}, nexmo.ServerError()]
+
+    results = voice.dial_members(
+        nexmo_client, members, from_number="5678", answer_url="example.com"
+    )
+
+    assert [result.member for result in results] == members
+    assert sum(1 for result in results if result.error is None) == 1
+    assert sum(1 for result in results if result.error is not None) == 1
+
+
+def test_handle_inbound_call_deferred(database):
+    injector.set("secrets.voice.deferred_dial_out", True)
+    hotline = helpers.create_event()
+    members = helpers.add_members(hotline)
+    caller = members[0]
+
+    nexmo_client = mock.create_autospec(nexmo.Client)
+    # The first attempt couldn't connect, so it's retried in the background.
+    nexmo_client.create_call.side_effect = [
+        requests.exceptions.ConnectTimeout(),
+        {"uuid": "leg"},
+    ]
+
+    ncco = voice.handle_inbound_call(
+        reporter_number=caller.number,
+        event_number="+5678",
+        conversation_uuid="conversation",
+        call_uuid="call",
+        host="example.com",
+        client=nexmo_client,
+    )
+
+    assert len(ncco) == 2
+    assert ncco[1]["action"] == "conversation"
+
+    background.wait(timeout=10)
+
+    assert nexmo_client.create_call.call_count == 2
+    nexmo_client.send_speech.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "error", [nexmo.ServerError(), requests.exceptions.ReadTimeout()]
+)
+def test_handle_inbound_call_deferred_doesnt_retry_sent_calls(database, error):
+    injector.set("secrets.voice.deferred_dial_out", True)
+    hotline = helpers.create_event()
+    members = helpers.add_members(hotline)
+    caller = members[0]
+
+    nexmo_client = mock.create_autospec(nexmo.Client)
+    # Nexmo might have placed the call anyway, so retrying could ring the
+    # member twice.
+    nexmo_client.create_call.side_effect = [error, {"uuid": "leg"}]
+
+    voice.handle_inbound_call(
+        reporter_number=caller.number,
+        event_number="+5678",
+        conversation_uuid="conversation",
+        call_uuid="call",
+        host="example.com",
+        client=nexmo_client,
+    )
+
+    background.wait(timeout=10)
+
+    nexmo_client.create_call.assert_called_once()
+
+
+def test_handle_inbound_call_deferred_all_calls_fail(database):
+    injector.set("secrets.voice.deferred_dial_out", True)
+    hotline = helpers.create_event()
+    members = helpers.add_members(hotline)
+    caller = members[0]
+
+    nexmo_client = mock.create_autospec(nexmo.Client)
+    nexmo_client.create_call.side_effect = nexmo.ClientError("Bad number")
+
+    ncco = voice.handle_inbound_call(
+        reporter_number=caller.number,
+        event_number="+5678",
+        conversation_uuid="conversation",
+        call_uuid="call",
+        host="example.com",
+        client=nexmo_client,
+    )
+
+    # The reporter has already been put on hold when the calls fail, so they
+    # should be told about it over the call.
+    assert ncco[1]["action"] == "conversation"
+
+    background.wait(timeout=10)
+
+    nexmo_client.send_speech.assert_called_once_with(
+        "call", text=common_text.voice_dial_out_failed
+    )
+
+
+def test_handle_member_answer_deferred(database):
+    injector.set("secrets.voice.deferred_dial_out", True)
+    event = helpers.create_event()
+    helpers.add_members(event)
+
+    nexmo_client = mock.create_autospec(nexmo.Client)
+
+    ncco = voice.handle_member_answer(
+        event_number="+5678",
+        member_number="202",
+        origin_conversation_uuid="conversation",
+        origin_call_uuid="call",
+        client=nexmo_client,
+    )
+
+    assert ncco[1]["action"] == "conversation"
+
+    background.wait(timeout=10)
+
+    nexmo_client.send_speech.assert_called_once_with("call", text=mock.ANY)
+
+
+def _dial_in(event, nexmo_client, reporter_number="101"):
+    nexmo_client.create_call.side_effect = lambda params: {
+        "uuid": f"leg-{params['to'][0]['number']}"
+    }
+
+    return voice.handle_inbound_call(
+        reporter_number=reporter_number,
+        event_number="+5678",
+        conversation_uuid="conversation",
+        call_uuid="call",
+        host="example.com",
+        client=nexmo_client,
+    )
+
+
+def _answer(nexmo_client, member_number):
+    return voice.handle_member_answer(
+        event_number="+5678",
+        member_number=member_number,
+        origin_conversation_uuid="conversation",
+        origin_call_uuid="call",
+        call_uuid=f"leg-{member_number}",
+        client=nexmo_client,
+    )
+
+
+def test_handle_inbound_call_records_legs(database):
+    event = helpers.create_event()
+    helpers.add_members(event)
+    helpers.add_member(event=event, name="Carol", number="303")
+
+    nexmo_client = mock.create_autospec(nexmo.Client)
+    _dial_in(event, nexmo_client)
+
+    legs = models.CallLeg.select().order_by(models.CallLeg.number)
+    assert [(leg.call_uuid, leg.state) for leg in legs] == [
+        ("leg-202", voice.LegState.RINGING),
+        ("leg-303", voice.LegState.RINGING),
+    ]
+
+
+def test_handle_member_answer_hangs_up_other_legs(database):
+    event = helpers.create_event()
+    helpers.add_members(event)
+    helpers.add_member(event=event, name="Carol", number="303")
+    helpers.add_member(event=event, name="Dave", number="404")
+
+    nexmo_client = mock.create_autospec(nexmo.Client)
+    _dial_in(event, nexmo_client)
+
+    ncco = _answer(nexmo_client, "202")
+
+    assert ncco[1]["action"] == "conversation"
+    assert nexmo_client.update_call.call_count == 2
+    nexmo_client.update_call.assert_any_call("leg-303", action="hangup")
+    nexmo_client.update_call.assert_any_call("leg-404", action="hangup")
+
+    states = {leg.call_uuid: leg.state for leg in models.CallLeg.select()}
+    assert states == {
+        "leg-202": voice.LegState.ANSWERED,
+        "leg-303": voice.LegState.CANCELLED,
+        "leg-404": voice.LegState.CANCELLED,
+    }
+
+
+def test_handle_member_answer_too_late(database):
+    event = helpers.create_event()
+    helpers.add_members(event)
+    helpers.add_member(event=event, name="Carol", number="303")
+
+    nexmo_client = mock.create_autospec(nexmo.Client)
+    _dial_in(event, nexmo_client)
+
+    _answer(nexmo_client, "202")
+    nexmo_client.send_speech.reset_mock()
+
+    # Carol picked up before her call was hung up.
+    ncco = _answer(nexmo_client, "303")
+
+    assert ncco == [{"action": "talk", "text": common_text.voice_answer_too_late}]
+    nexmo_client.send_speech.assert_not_called()
+
+
+def test_handle_member_answer_max_simultaneous_answerers(database):
+    injector.set("secrets.voice.max_simultaneous_answerers", 2)
+    event = helpers.create_event()
+    helpers.add_members(event)
+    helpers.add_member(event=event, name="Carol", number="303")
+    helpers.add_member(event=event, name="Dave", number="404")
+
+    nexmo_client = mock.create_autospec(nexmo.Client)
+    _dial_in(event, nexmo_client)
+
+    _answer(nexmo_client, "202")
+    nexmo_client.update_call.assert_not_called()
+
+    ncco = _answer(nexmo_client, "303")
+
+    assert ncco[1]["action"] == "conversation"
+    nexmo_client.update_call.assert_called_once_with("leg-404", action="hangup")
+
+
+def test_handle_inbound_call_routes_in_one_query(database):
+    event = helpers.create_event()
+    members = helpers.add_members(event)
+    helpers.add_member(event=event, name="Carol", number="303")
+    helpers.create_block_list(event=event, number="999", blocked_by="test")
+    helpers.create_block_list(event=event, number="888", blocked_by="test")
+
+    nexmo_client = mock.create_autospec(nexmo.Client)
+    statements = []
+    execute_sql = database.db.obj.execute_sql
+
+    def counting_execute_sql(sql, *args, **kwargs):
+        statements.append(sql)
+        return execute_sql(sql, *args, **kwargs)
+
+    # Nothing is cached yet.
+    with mock.patch.object(database.db.obj, "execute_sql", counting_execute_sql):
+        ncco = _dial_in(event, nexmo_client, reporter_number=members[0].number)
+
+    assert ncco[1]["action"] == "conversation"
+    assert nexmo_client.create_call.call_count == 2
+
+    selects = [sql for sql in statements if sql.lstrip().upper().startswith("SELECT")]
+    assert len(selects) == 1, selects
+
+    for number in ("999", "888"):
+        ncco = _dial_in(event, nexmo_client, reporter_number=number)
+        assert ncco == [{"action": "talk", "text": common_text.voice_blocked}]
+
+
+def test_handle_inbound_call_routes_from_cache(database):
+    event = helpers.create_event()
+    members = helpers.add_members(event)
+    helpers.add_member(event=event, name="Carol", number="303")
+    helpers.create_block_list(event=event, number="999", blocked_by="test")
+
+    nexmo_client = mock.create_autospec(nexmo.Client)
+    statements = []
+    execute_sql = database.db.obj.execute_sql
+
+    def counting_execute_sql(sql, *args, **kwargs):
+        statements.append(sql)
+        return execute_sql(sql, *args, **kwargs)
+
+    def count_selects():
+        selects = [
+            sql for sql in statements if sql.lstrip().upper().startswith("SELECT")
+        ]
+        statements.clear()
+        return len(selects)
+
+    with mock.patch.object(database.db.obj, "execute_sql", counting_execute_sql):
+        ncco = _dial_in(event, nexmo_client, reporter_number=members[0].number)
+        # The event, its members and its block list.
+        assert count_selects() == 1
+
+        _dial_in(event, nexmo_client, reporter_number=members[1].number)
+        assert count_selects() == 0
+
+        ncco = _dial_in(event, nexmo_client, reporter_number="999")
+        assert count_selects() == 0
+
+    assert ncco == [{"action": "talk", "text": common_text.voice_blocked}]
+    assert nexmo_client.create_call.call_count == 4
+
+
+def test_handle_inbound_call_sees_invalidated_routes(database):
+    injector.set("secrets.routing_cache.ttl", 60)
+    event = helpers.create_event()
+    members = helpers.add_members(event)
+    carol = helpers.add_member(event=event, name="Carol", number="303", verified=False)
+
+    nexmo_client = mock.create_autospec(nexmo.Client)
+    _dial_in(event, nexmo_client, reporter_number=members[0].number)
+    assert nexmo_client.create_call.call_count == 1
+
+    verification.manually_verify(carol)
+
+    nexmo_client.reset_mock()
+    _dial_in(event, nexmo_client, reporter_number=members[0].number)
+    assert nexmo_client.create_call.call_count == 2
+
+
+def test_handle_inbound_call_rechecks_version_after_ttl(database):
+    injector.set("secrets.routing_cache.ttl", 0)
+    event = helpers.create_event()
+    members = helpers.add_members(event)
+
+    nexmo_client = mock.create_autospec(nexmo.Client)
+    _dial_in(event, nexmo_client, reporter_number=members[0].number)
+
+    # Another process changed the event.
+    models.Event.update(voice_greeting="Hi!", routing_version=42).execute()
+
+    ncco = _dial_in(event, nexmo_client, reporter_number=members[0].number)
+    assert ncco[0]["text"] == "Hi!"